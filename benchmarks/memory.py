@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Memory and time to build RiakObjects the way a bulk read does: one per
+key, populated from a transport result with two index entries and a
+link, plus the index entries and links themselves.
+
+no riak node needed, run from the top of the tree:
+
+    python benchmarks/memory.py [count]
+
+Builds everything in a fresh process and reports the growth of the
+resident set per object, so run it once per revision to compare.
+"""
+
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from riakasaurus import riak
+from riakasaurus.metadata import *
+from riakasaurus.riak_index_entry import RiakIndexEntry
+from riakasaurus.mapreduce import RiakLink
+
+
+def rss():
+    """resident set size in bytes"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def result(i):
+    # what PBCTransport.parseRpbGetResp returns for an object
+    metadata = {MD_CTYPE: 'application/json', MD_VTAG: 'vtag',
+                MD_LASTMOD: 1335866400,
+                MD_INDEX: [RiakIndexEntry('field_bin', 'v%d' % i),
+                           RiakIndexEntry('field_int', i)],
+                MD_LINKS: [RiakLink('bucket', 'k%d' % i, 'tag')]}
+    return 'vclock', [(metadata, '{"value": %d}' % i)]
+
+
+def measure(name, build, count):
+    gc.collect()
+    before = rss()
+    started = time.time()
+    objects = [build(i) for i in xrange(count)]
+    elapsed = time.time() - started
+    gc.collect()
+    grown = rss() - before
+    print '%-14s %8d bytes/object %8.2f us/object' % (
+        name, grown / count, elapsed * 1e6 / count)
+    return objects
+
+
+def main(count):
+    client = riak.RiakClient()
+    bucket = client.bucket('bucket')
+
+    def riak_object(i):
+        obj = bucket.new('k%d' % i)
+        return obj.populate(result(i))
+
+    # the results are built beforehand, only the objects are measured
+    results = [result(i) for i in xrange(count)]
+    def populated(i):
+        return bucket.new('k%d' % i).populate(results[i])
+
+    # everything is kept, so no measurement reuses the memory of another
+    kept = [
+        measure('RiakIndexEntry', lambda i: RiakIndexEntry('field_bin', i), count),
+        measure('RiakLink', lambda i: RiakLink('bucket', 'k%d' % i, 'tag'), count),
+        measure('RiakObject', populated, count),
+        measure('bulk read', riak_object, count)]
+
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 200000)
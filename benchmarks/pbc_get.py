@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Time to turn the body of a RpbGetResp into a populated RiakObject: with
+protobuf's ParseFromString followed by parse_get_response, and with
+decode_get_response reading the wire format directly.
+
+no riak node needed, run from the top of the tree:
+
+    python benchmarks/pbc_get.py [count]
+
+The protobuf implementation in use is printed first, set
+PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION to compare.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.protobuf.internal import api_implementation
+
+from riakasaurus import riak
+from riakasaurus.pbc_decode import decode_get_response, parse_get_response
+from riakasaurus.riak_kv_pb2 import RpbGetResp
+
+
+def body():
+    # an object with a vtag, two indexes and a link, as riak sends it
+    resp = RpbGetResp()
+    resp.vclock = 'a85hYGBgzGDKBVIcypz/fgaUHjmdwZTImMfKsP/0yVN8WQA='
+    content = resp.content.add()
+    content.value = '{"name": "bob", "n": 12345, "tags": ["a", "b"]}'
+    content.content_type = 'application/json'
+    content.vtag = '5bnavU3rrubcxLI8EvFXhB'
+    content.last_mod = 1335866400
+    content.last_mod_usecs = 123456
+    link = content.links.add()
+    link.bucket, link.key, link.tag = 'bucket', 'k2', 'friend'
+    for field, value in (('email_bin', 'bob@example.com'), ('age_int', '42')):
+        pair = content.indexes.add()
+        pair.key, pair.value = field, value
+    return resp.SerializeToString()
+
+
+def main(count):
+    print 'protobuf implementation:', api_implementation.Type()
+    data = memoryview(body())
+    bucket = riak.RiakClient().bucket('bucket')
+
+    def protobuf():
+        resp = RpbGetResp()
+        resp.ParseFromString(data)
+        return bucket.new('key').populate(parse_get_response(resp))
+
+    def direct():
+        return bucket.new('key').populate(decode_get_response(data))
+
+    def touched(build):
+        def run():
+            obj = build()
+            obj.get_links()
+            obj.get_indexes()
+        return run
+
+    for name, run in (('protobuf', protobuf), ('direct', direct),
+                      ('protobuf, links and indexes', touched(protobuf)),
+                      ('direct, links and indexes', touched(direct))):
+        best = min(timeit.repeat(run, number=count, repeat=3))
+        print '%-30s %8.2f us/get' % (name, best * 1e6 / count)
+
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 20000)
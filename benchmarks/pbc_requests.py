@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Time to build the body of a get, put and delete request: from a new
+protobuf message, as RiakPBC.get, put and delete do, and from the
+request template of a prepared bucket, looking it up included.
+
+no riak node needed, run from the top of the tree:
+
+    python benchmarks/pbc_requests.py [count]
+
+The protobuf implementation in use is printed first, set
+PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION to compare.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.protobuf.internal import api_implementation
+
+from riakasaurus.tx_riak_pb import RiakPBC
+
+
+VCLOCK = 'a85hYGBgzGDKBVIcypz/fgaUHjmdwZTImMfKsP/0yVN8WQA='
+CONTENT = {'value': '{"name": "bob", "n": 12345}',
+           'content_type': 'application/json',
+           'indexes': [('email_bin', 'bob@example.com'), ('age_int', '42')]}
+
+# what PBCTransport passes for each
+REQUESTS = [
+    ('get', RiakPBC._getRequest, RiakPBC.prepareGet,
+     {'r': 2, 'pr': 'default'}, (None, None)),
+    ('put', RiakPBC._putRequest, RiakPBC.preparePut,
+     {'w': 2, 'dw': 2, 'pw': 'default', 'return_body': True,
+      'if_none_match': False}, (VCLOCK, CONTENT)),
+    ('delete', RiakPBC._deleteRequest, RiakPBC.prepareDelete,
+     {'rw': 'default', 'r': 2, 'w': 2, 'dw': 2, 'pr': 'default',
+      'pw': 'default'}, (VCLOCK, None)),
+    ]
+
+
+def main(count):
+    print 'protobuf implementation:', api_implementation.Type()
+    templates = {}
+
+    for name, build, prepare, kwargs, (vclock, content) in REQUESTS:
+        def message():
+            if name == 'put':
+                request = build('bucket', 'key', content, vclock, **kwargs)
+            elif name == 'delete':
+                request = build('bucket', 'key', vclock=vclock, **kwargs)
+            else:
+                request = build('bucket', 'key', **kwargs)
+            return request.SerializeToString()
+
+        def template():
+            key = (prepare, tuple(sorted(kwargs.iteritems())))
+            template = templates.get(key)
+            if template is None:
+                template = templates[key] = prepare('bucket', **kwargs)
+            return template.body('key', vclock, content)
+
+        for how, run in (('message', message), ('template', template)):
+            best = min(timeit.repeat(run, number=count, repeat=3))
+            print '%-6s %-10s %8.2f us/request' % (name, how, best * 1e6 / count)
+
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 20000)
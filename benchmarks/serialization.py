@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Size and time to encode and decode values with every JSON
+implementation installed and msgpack, plain and gzipped, the way
+RiakObject does.
+
+no riak node needed, run from the top of the tree:
+
+    python benchmarks/serialization.py [count]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from riakasaurus import codec
+
+
+def user(i):
+    # a profile document
+    return {'id': i,
+            'name': u'User %d' % i,
+            'email': 'user%d@example.com' % i,
+            'created': 1335866400 + i,
+            'active': i % 3 != 0,
+            'score': i * 0.37,
+            'tags': ['tag%d' % (i % 17), 'tag%d' % (i % 5)],
+            'address': {'street': '%d Long Street' % i, 'city': 'Cape Town',
+                        'zip': '%04d' % (i % 10000)},
+            'friends': range(i, i + 20)}
+
+
+def events(i):
+    # a time series bucket, mostly numbers
+    rnd = random.Random(i)
+    return [{'t': 1335866400 + n * 60, 'v': rnd.random(),
+             'n': rnd.randint(0, 1000)} for n in xrange(100)]
+
+
+def measure(label, encode, decode, values):
+    started = time.time()
+    encoded = [encode(value) for value in values]
+    encoding = time.time() - started
+    started = time.time()
+    for data in encoded:
+        decode(data)
+    decoding = time.time() - started
+    count = len(values)
+    print '  %-18s %8d bytes %8.2f us encode %8.2f us decode' % (
+        label, sum(len(data) for data in encoded) / count,
+        encoding * 1e6 / count, decoding * 1e6 / count)
+
+
+def main(count):
+    codecs = [(name, dumps, loads)
+              for name, (dumps, loads) in sorted(codec.JSON_CODECS.items())]
+    if codec.msgpack is not None:
+        codecs.append(('msgpack', codec.msgpack_dumps, codec.msgpack_loads))
+    else:
+        print 'msgpack is not installed'
+    gzip, gunzip = codec.COMPRESSIONS['gzip']
+
+    for payload in (user, events):
+        values = [payload(i) for i in xrange(count)]
+        print '%s:' % payload.__name__
+        for name, dumps, loads in codecs:
+            measure(name, dumps, loads, values)
+            measure(name + '+gzip',
+                    lambda value: gzip(dumps(value)),
+                    lambda data: loads(gunzip(data)), values)
+
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 10000)
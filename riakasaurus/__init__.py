@@ -49,3 +49,9 @@ class RiakError(Exception) :
         self.value = value
     def __str__(self):
         return repr(self.value)
+
+class RiakConflictError(RiakError) :
+    """
+    A conditional store failed: the object was modified, or created,
+    since it was read.
+    """
@@ -17,11 +17,13 @@ KIND, either express or implied.  See the License for the
 specific language governing permissions and limitations
 under the License.
 """
-from twisted.internet import defer
+from twisted.internet import defer, reactor, task
 
+from riakasaurus import RiakError, RiakConflictError, codec
 from riakasaurus.riak_object import RiakObject
 
 import mimetypes
+import random
 
 class RiakBucket(object):
     """
@@ -57,6 +59,17 @@ class RiakBucket(object):
         self._pw = None
         self._encoders = {}
         self._decoders = {}
+        # the client's codecs overridden by the bucket's, merged once
+        # rather than looked up in both for every object
+        self._resolved_encoders = {}
+        self._resolved_decoders = {}
+        self._codecs_generation = None  # client's when merged
+        self._cache = None
+        self._negative_cache = None
+        self._resolver = None
+        self._resolver_write_back = False
+        self._compression = None
+        self._prepared = None
 
     def get_name(self):
         """
@@ -221,10 +234,9 @@ class RiakBucket(object):
 
         :param content_type: Content type requested
         """
-        if content_type in self._encoders:
-            return self._encoders[content_type]
-        else:
-            return self._client.get_encoder(content_type)
+        if self._codecs_generation != self._client._codecs_generation:
+            self._resolve_codecs()
+        return self._resolved_encoders.get(content_type)
 
     def set_encoder(self, content_type, encoder):
         """
@@ -235,6 +247,7 @@ class RiakBucket(object):
                         argument.
         """
         self._encoders[content_type] = encoder
+        self._codecs_generation = None
         return self
 
     def get_decoder(self, content_type):
@@ -243,10 +256,9 @@ class RiakBucket(object):
 
         :param content_type: Content type for decoder
         """
-        if content_type in self._decoders:
-            return self._decoders[content_type]
-        else:
-            return self._client.get_decoder(content_type)
+        if self._codecs_generation != self._client._codecs_generation:
+            self._resolve_codecs()
+        return self._resolved_decoders.get(content_type)
 
     def set_decoder(self, content_type, decoder):
         """
@@ -256,6 +268,172 @@ class RiakBucket(object):
         :param decoder: Function to decode with - will be called with string
         """
         self._decoders[content_type] = decoder
+        self._codecs_generation = None
+        return self
+
+    def set_json_codec(self, name=None):
+        """
+        Encode and decode JSON objects in this bucket with the given JSON
+        implementation.
+
+        :param name: as registered in :mod:`riakasaurus.codec`, such as
+         ujson, the default (stdlib json) if None
+        :type name: string
+        :rtype: self
+        """
+        dumps, loads = codec.json_codec(name)
+        for content_type in codec.JSON_CONTENT_TYPES:
+            self.set_encoder(content_type, dumps)
+            self.set_decoder(content_type, loads)
+        return self
+
+    def _resolve_codecs(self):
+        self._resolved_encoders = dict(self._client._encoders)
+        self._resolved_encoders.update(self._encoders)
+        self._resolved_decoders = dict(self._client._decoders)
+        self._resolved_decoders.update(self._decoders)
+        self._codecs_generation = self._client._codecs_generation
+
+    def get_cache(self):
+        """
+        Get the object cache for this bucket, if it is set, otherwise
+        return the cache of the client.
+
+        :rtype: :class:`ObjectCache <riakasaurus.cache.ObjectCache>`
+        """
+        if self._cache is not None:
+            return self._cache
+        return self._client.get_cache()
+
+    def set_cache(self, cache):
+        """
+        Cache the objects read from this bucket in cache rather than in
+        the cache of the client.
+
+        :param cache: the cache
+        :type cache: :class:`ObjectCache <riakasaurus.cache.ObjectCache>`
+        :rtype: self
+        """
+        self._cache = cache
+        return self
+
+    def get_negative_cache(self):
+        """
+        Get the cache of missing keys for this bucket, if it is set,
+        otherwise return the one of the client.
+
+        :rtype: :class:`NegativeCache <riakasaurus.cache.NegativeCache>`
+        """
+        if self._negative_cache is not None:
+            return self._negative_cache
+        return self._client.get_negative_cache()
+
+    def set_negative_cache(self, negative_cache):
+        """
+        Remember the keys found missing in this bucket in negative_cache
+        rather than in the one of the client.
+
+        :param negative_cache: the cache
+        :type negative_cache: :class:`NegativeCache <riakasaurus.cache.NegativeCache>`
+        :rtype: self
+        """
+        self._negative_cache = negative_cache
+        return self
+
+    def get_resolver(self):
+        """
+        Get the sibling resolver for this bucket, if it is set, otherwise
+        return the default of the client.
+
+        :rtype: (resolver, write_back) tuple
+        """
+        if self._resolver is not None:
+            return self._resolver, self._resolver_write_back
+        return self._client.get_resolver()
+
+    def set_resolver(self, resolver, write_back=False):
+        """
+        Resolve the siblings of the objects read from this bucket with
+        resolver. It is called with the siblings, RiakObjects with
+        decoded data, and returns the sibling that wins or the merged
+        value. See :mod:`riakasaurus.resolver` for ready-made ones.
+
+        The object read holds the resolved value and the vclock of the
+        siblings, so storing it settles the conflict. With write_back it
+        is stored before it is returned.
+
+        :param resolver: the resolver
+        :type resolver: function
+        :param write_back: store the resolved object right away
+        :type write_back: bool
+        :rtype: self
+        """
+        self._resolver = resolver
+        self._resolver_write_back = write_back
+        return self
+
+    def get_compression(self):
+        """
+        Get the compression the objects of this bucket are stored with,
+        (content encoding, threshold) or None if they are not
+        compressed.
+
+        :rtype: tuple
+        """
+        return self._compression
+
+    def set_compression(self, encoding='gzip', threshold=1024):
+        """
+        Compress the values stored in this bucket that are at least
+        threshold bytes long once encoded. They are stored with the
+        content encoding and decompressed when read, whatever the
+        compression setting of the bucket reading them.
+
+        :param encoding: content encoding of a compression registered in
+         :mod:`riakasaurus.codec`, gzip or deflate unless others were
+         added, None to stop compressing
+        :type encoding: string
+        :param threshold: smallest value compressed, in bytes
+        :type threshold: integer
+        :rtype: self
+        """
+        if encoding is None:
+            self._compression = None
+        elif encoding not in codec.COMPRESSIONS:
+            raise RiakError('Unknown compression %r, have %s'
+                            % (encoding, ', '.join(sorted(codec.COMPRESSIONS))))
+        else:
+            self._compression = (encoding, threshold)
+        return self
+
+    def get_prepared(self):
+        """
+        Get the request templates of this bucket, a dict the transport
+        keeps them in, or None if requests are not prepared.
+
+        :rtype: dict
+        """
+        return self._prepared
+
+    def set_prepared(self, prepared=True):
+        """
+        Prepare the requests of this bucket: over protocol buffers, the
+        bucket name and quorum values of gets, heads, stores and deletes
+        are serialized once into a template for each set of values used,
+        only the key, vclock and content are serialized per request.
+        Worth it for many requests on small objects. Other transports
+        ignore this setting.
+
+        :param prepared: False to drop the templates and build every
+         request from scratch
+        :type prepared: bool
+        :rtype: self
+        """
+        if prepared:
+            if self._prepared is None:
+                self._prepared = {}
+        else:
+            self._prepared = None
         return self
 
     def new(self, key=None, data=None, content_type='application/json'):
@@ -267,6 +445,9 @@ class RiakBucket(object):
         :type key: string
         :param data: The data to store.
         :type data: object
+        :param content_type: how it is encoded, application/json or any
+         content type with an encoder such as application/x-msgpack
+        :type content_type: string
         :rtype: :class:`RiakObject <riak.riak_object.RiakObject>`
         """
         try:
@@ -318,6 +499,155 @@ class RiakBucket(object):
         pr = self.get_pr(pr)
         return obj.reload(r=r, pr=pr)
 
+    @defer.inlineCallbacks
+    def update(self, key, mutator, retries=5, backoff=0.05, r=None, pr=None,
+               w=None, dw=None, pw=None):
+        """
+        Read-modify-write a JSON-encoded object: store mutator(data) with
+        the vclock of what was read, on condition that the object was not
+        modified meanwhile (or, for a new key, created). On conflict the
+        object is read again and mutator applied again, after a random
+        delay of up to backoff * 2 ** attempt seconds.
+
+        :param key: Name of the key.
+        :type key: string
+        :param mutator: called with the current data (None for a new key),
+         returns the new data. May be called more than once.
+        :type mutator: function
+        :param retries: how many times to retry on conflict before giving up
+        :type retries: integer
+        :param backoff: base of the delay between retries, in seconds
+        :type backoff: float
+        :rtype: :class:`RiakObject <riak.riak_object.RiakObject>` as stored -- via deferred
+        :raises: :class:`RiakConflictError <riakasaurus.RiakConflictError>`
+         when the retries are exhausted
+        """
+        attempt = 0
+        while True:
+            obj = yield self.get(key, r=r, pr=pr)
+            obj.set_data(mutator(obj.get_data()))
+            exists = obj.exists()
+            try:
+                # the new vclock comes back with the write, no need to
+                # read the object again
+                yield obj.store(w=w, dw=dw, pw=pw, return_head=True,
+                                if_none_match=not exists,
+                                if_not_modified=exists)
+            except RiakConflictError:
+                if attempt >= retries:
+                    raise
+            else:
+                defer.returnValue(obj)
+
+            # don't read the object we lost against from a cache
+            for cache in (self.get_cache(), self.get_negative_cache()):
+                if cache is not None:
+                    cache.invalidate(self._name, key)
+            yield task.deferLater(reactor,
+                                  random.uniform(0, backoff * 2 ** attempt),
+                                  lambda: None)
+            attempt += 1
+
+    def multi_get(self, keys, r=None, pr=None, concurrency=20):
+        """
+        Retrieve many JSON-encoded objects from Riak, with at most
+        concurrency requests in flight. See :func:`RiakClient.multi_get`.
+
+        :param keys: Names of the keys.
+        :type keys: list
+        :param r: R-Value of the requests (defaults to bucket's R)
+        :type r: integer
+        :param pr: PR-Value of the requests (defaults to bucket's PR)
+        :type pr: integer
+        :param concurrency: maximum number of requests in flight
+        :type concurrency: integer
+        :rtype: list of (success, :class:`RiakObject <riak.riak_object.RiakObject>` or Failure) -- via deferred
+        """
+        return self._client.multi_get([(self, key) for key in keys],
+                                      r=r, pr=pr, concurrency=concurrency)
+
+    def multi_store(self, objects, w=None, dw=None, pw=None, return_body=False,
+                    concurrency=50):
+        """
+        Store many objects at once. The objects need a key. Over
+        protocol buffers the puts are pipelined, several of them written
+        to a connection in one go.
+
+        :param objects: the objects to store
+        :type objects: list of :class:`RiakObject <riak.riak_object.RiakObject>`
+        :param w: W-value (defaults to bucket's W)
+        :type w: integer
+        :param dw: DW-value (defaults to bucket's DW)
+        :type dw: integer
+        :param pw: PW-value (defaults to bucket's PW)
+        :type pw: integer
+        :param return_body: if the stored objects should be retrieved
+        :type return_body: bool
+        :param concurrency: maximum number of requests in flight
+        :type concurrency: integer
+        :rtype: list of (success, :class:`RiakObject <riak.riak_object.RiakObject>` or Failure) -- via deferred
+        """
+        objects = list(objects)
+        t = self._client.get_transport()
+        d = t.put_many(objects, w=self.get_w(w), dw=self.get_dw(dw),
+                       pw=self.get_pw(pw), return_body=return_body,
+                       concurrency=concurrency)
+
+        def stored(results):
+            cache = self.get_cache()
+            negative_cache = self.get_negative_cache()
+            ret = []
+            for obj, (success, result) in zip(objects, results):
+                if negative_cache is not None:
+                    negative_cache.invalidate(self._name, obj.get_key())
+                if cache is not None:
+                    if success and return_body:
+                        cache.stored(self._name, obj.get_key(), result)
+                    else:
+                        cache.invalidate(self._name, obj.get_key())
+                if success:
+                    if return_body and result is not None:
+                        obj.populate(result)
+                    else:
+                        obj._exists = True
+                    result = obj
+                ret.append((success, result))
+            return ret
+
+        return d.addCallback(stored)
+
+    def multi_delete(self, keys, rw=None, r=None, w=None, dw=None, pr=None,
+                     pw=None, concurrency=50):
+        """
+        Delete many keys at once, pipelined like :func:`multi_store`.
+
+        :param keys: names of the keys or the objects to delete
+        :type keys: list
+        :param concurrency: maximum number of requests in flight
+        :type concurrency: integer
+        :rtype: list of (success, :class:`RiakObject <riak.riak_object.RiakObject>` or Failure) -- via deferred
+        """
+        objects = [isinstance(key, RiakObject) and key or
+                   RiakObject(self._client, self, key) for key in keys]
+        t = self._client.get_transport()
+        d = t.delete_many(objects, rw=self.get_rw(rw), r=self.get_r(r),
+                          w=self.get_w(w), dw=self.get_dw(dw),
+                          pr=self.get_pr(pr), pw=self.get_pw(pw),
+                          concurrency=concurrency)
+
+        def deleted(results):
+            cache = self.get_cache()
+            ret = []
+            for obj, (success, result) in zip(objects, results):
+                if cache is not None:
+                    cache.invalidate(self._name, obj.get_key())
+                if success:
+                    result = obj.clear()
+                ret.append((success, result))
+            return ret
+
+        return d.addCallback(deleted)
+
     def head(self, key, r=None, pr=None):
         """
         Retrieve a JSON-encoded object from Riak.
@@ -501,6 +831,23 @@ class RiakBucket(object):
         """
         return self._client.get_transport().get_keys(self)
 
+    def stream_keys(self, consumer):
+        """
+        Hand the keys within the bucket to consumer, a list of keys at a
+        time, as they arrive from Riak rather than collecting them all
+        first. If consumer returns a deferred, reading the response is
+        paused until it fires.
+
+        .. warning::
+
+           Like :func:`get_keys` this is a very expensive operation.
+
+        :param consumer: function called with each list of keys
+        :type consumer: function
+        :rtype: None -- via deferred, once every key has been consumed
+        """
+        return self._client.get_transport().stream_keys(self, consumer)
+
     def new_binary_from_file(self, key, filename):
         """
         Create a new Riak object in the bucket, using the content of the specified file.
@@ -557,8 +904,14 @@ class RiakBucket(object):
     def get_index(self, index, startkey, endkey=None):
         """
         Queries a secondary index over objects in this bucket, returning keys.
+        An exact match on startkey, or a range query if endkey is given.
+
+        :param index: name of the index, e.g. 'field_bin'
+        :type index: string
+        :rtype: list of keys -- via deferred
         """
-        return self._client._transport.get_index(self._name, index, startkey, endkey)
+        return self._client.get_transport().get_index(self._name, index,
+                                                      startkey, endkey)
 
     def list_keys(self):
         """ Same as get_keys - for txRiak compat """
@@ -0,0 +1,234 @@
+"""
+.. module:: cache.py
+
+ObjectCache, an in-process read-through cache of Riak objects, and
+NegativeCache, which remembers the keys that were not found.
+
+"""
+
+from collections import OrderedDict
+
+from twisted.internet import defer, reactor
+
+from riakasaurus.metadata import *
+from riakasaurus.coalesce import copy_result
+
+
+# returned by a transport get(if_modified=...) when the object did not
+# change since the given result
+NOT_MODIFIED = object()
+
+
+class ObjectCache(object):
+    """
+    LRU cache of get results, bounded by the (approximate) number of
+    bytes of the cached values and vclocks.
+
+    An entry younger than ttl seconds is served without asking Riak.
+    Older entries are revalidated with a conditional get, which only
+    transfers the value if it changed: if_modified with the vclock over
+    protocol buffers, If-None-Match with the ETag over HTTP.
+
+    Cached objects are served whatever R and PR the read asks for.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=0):
+        """
+        :param max_bytes: budget for the cached values
+        :type max_bytes: integer
+        :param ttl: seconds an entry is served without revalidation
+        :type ttl: float
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()  # (bucket, key) -> [result, size, validated]
+        self._writes = 0
+
+        self.hits = 0               # served from the cache
+        self.revalidations = 0      # hits that needed a conditional get
+        self.misses = 0             # fetched from Riak
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<ObjectCache entries=%d bytes=%d hits=%d misses=%d>' % (
+            len(self._entries), self.size, self.hits, self.misses)
+
+    def stats(self):
+        return {'entries': len(self._entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'revalidations': self.revalidations,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+    def get(self, bucket, key, fetch):
+        """
+        Get the result of a read for bucket/key, from the cache if
+        possible.
+
+        :param fetch: function called with the cached result to
+         revalidate (or None), returning a deferred of the transport get
+         result or NOT_MODIFIED
+        :returns: a result for RiakObject.populate -- via deferred
+        """
+        k = (bucket, key)
+        entry = self._entries.get(k)
+        if entry is not None:
+            self._entries[k] = self._entries.pop(k)     # most recently used
+            if reactor.seconds() - entry[2] < self.ttl:
+                self.hits += 1
+                return defer.succeed(copy_result(entry[0]))
+
+        writes = self._writes
+
+        def fetched(result):
+            if result is NOT_MODIFIED:
+                self.hits += 1
+                self.revalidations += 1
+                entry[2] = reactor.seconds()
+                return copy_result(entry[0])
+
+            self.misses += 1
+            if self._writes == writes:
+                # only if nothing was written meanwhile, the result
+                # could be older than what the write left in the cache
+                self._put(k, result)
+            else:
+                self._remove(k)
+            return result
+
+        return fetch(entry and entry[0]).addCallback(fetched)
+
+    def stored(self, bucket, key, result):
+        """
+        An object was written, cache what Riak returned for it or forget
+        about it if there is nothing to cache.
+        """
+        self._writes += 1
+        self._put((bucket, key), result)
+
+    def invalidate(self, bucket, key):
+        """
+        Forget about an object.
+        """
+        self._writes += 1
+        self._remove((bucket, key))
+
+    def clear(self):
+        self._writes += 1
+        self._entries.clear()
+        self.size = 0
+
+    def _put(self, k, result):
+        if not self._cacheable(result):
+            self._remove(k)
+            return
+
+        size = self._size(result)
+        self._remove(k)
+        if size > self.max_bytes:
+            return
+        self._entries[k] = [copy_result(result), size, reactor.seconds()]
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, k):
+        entry = self._entries.pop(k, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def _cacheable(self, result):
+        # whole objects only, not missing keys, sibling vtag lists,
+        # heads or tombstones
+        if not isinstance(result, tuple) or not result[1]:
+            return False
+        for metadata, data in result[1]:
+            if data is None or metadata.get(MD_DELETED):
+                return False
+        return True
+
+    def _size(self, result):
+        vclock, contents = result
+        return len(vclock or '') + sum(len(data) for metadata, data in contents)
+
+
+class NegativeCache(object):
+    """
+    Remembers keys that were not found for ttl seconds, so repeated
+    lookups of missing keys are answered without asking Riak. Bounded
+    to max_entries keys, the oldest are forgotten first.
+
+    A key is forgotten as soon as it is stored through the client, but
+    writes by other clients go unnoticed until ttl expires, so keep it
+    short.
+    """
+
+    def __init__(self, max_entries=10000, ttl=1.0):
+        """
+        :param max_entries: number of missing keys to remember
+        :type max_entries: integer
+        :param ttl: seconds a missing key is remembered
+        :type ttl: float
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (bucket, key) -> expiry time
+        self._writes = 0
+
+        self.hits = 0               # lookups answered from the cache
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<NegativeCache entries=%d hits=%d>' % (
+            len(self._entries), self.hits)
+
+    def get(self, bucket, key, fetch):
+        """
+        Look up bucket/key, None straight away if it is known to be
+        missing.
+
+        :param fetch: function returning a deferred of the transport result
+        :returns: the transport result -- via deferred
+        """
+        k = (bucket, key)
+        expires = self._entries.get(k)
+        if expires is not None:
+            if reactor.seconds() < expires:
+                self.hits += 1
+                return defer.succeed(None)
+            del self._entries[k]
+
+        writes = self._writes
+
+        def fetched(result):
+            # a miss that raced with a write is not remembered
+            if result is None and self._writes == writes:
+                self._add(k)
+            return result
+
+        return fetch().addCallback(fetched)
+
+    def invalidate(self, bucket, key):
+        """
+        The key was written, forget that it was missing.
+        """
+        self._writes += 1
+        self._entries.pop((bucket, key), None)
+
+    def clear(self):
+        self._writes += 1
+        self._entries.clear()
+
+    def _add(self, k):
+        self._entries.pop(k, None)
+        self._entries[k] = reactor.seconds() + self.ttl
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
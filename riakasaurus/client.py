@@ -8,13 +8,13 @@ RiakClient class
 import random
 import base64
 import urllib
-import json
 from twisted.internet import defer
 
-from riakasaurus import mapreduce, bucket
+from riakasaurus import mapreduce, bucket, codec
 from riakasaurus.search import RiakSearch
 
 from riakasaurus import transport
+from riakasaurus.coalesce import SingleFlight
 
 
 class RiakClient(object):
@@ -25,14 +25,56 @@ class RiakClient(object):
     def __init__(self, host='127.0.0.1', port=8098,
                 prefix='riak', mapred_prefix='mapred',
                 client_id=None, r_value="default", w_value="default", dw_value="default",
-                transport=transport.HTTPTransport):
+                transport=transport.HTTPTransport, pool_size=None,
+                pool_idle_timeout=None, pool_retry=None, nodes=None,
+                coalesce_reads=False, cache=None, negative_cache=None,
+                resolver=None, json_codec=None):
         """
         Construct a new RiakClient object.
 
         If a client_id is not provided, generate a random one.
-        """
+
+        :param nodes: (host, port) tuples of the cluster nodes to spread
+         requests over, defaults to the single node given by host and port
+        :type nodes: list
+
+        :param pool_size: maximum number of persistent connections kept
+         open per Riak node (transport default if None)
+        :type pool_size: integer
+        :param pool_idle_timeout: seconds an idle persistent connection
+         is kept open (transport default if None)
+        :type pool_idle_timeout: integer
+        :param pool_retry: retry a request once on a fresh connection if
+         a cached connection turns out to be closed (transport default if None)
+        :type pool_retry: bool
+
+        :param coalesce_reads: let concurrent identical gets and heads
+         (same bucket, key, r, pr) share a single request to Riak
+        :type coalesce_reads: bool
+
+        :param cache: cache for the objects read through this client
+        :type cache: :class:`ObjectCache <riakasaurus.cache.ObjectCache>`
+
+        :param negative_cache: cache for the keys found missing through
+         this client
+        :type negative_cache: :class:`NegativeCache <riakasaurus.cache.NegativeCache>`
+
+        :param resolver: default sibling resolver of the buckets, see
+         :func:`set_resolver`
+        :type resolver: function
+
+        :param json_codec: name of the JSON implementation to encode and
+         decode objects with, stdlib json if None (see
+         :mod:`riakasaurus.codec`)
+        :type json_codec: string
+        """
+        if nodes:
+            host, port = nodes[0]
+        else:
+            nodes = [(host, port)]
         self._host = host
         self._port = port
+        self._nodes = list(nodes)
         self._prefix = prefix
         self._mapred_prefix = mapred_prefix
         if client_id:
@@ -48,17 +90,148 @@ class RiakClient(object):
         self._pr = "default"
         self._pw = "default"
 
-        self._encoders = {'application/json': json.dumps,
-                          'text/json': json.dumps}
-        self._decoders = {'application/json': json.loads,
-                          'text/json': json.loads}
+        self._encoders = {}
+        self._decoders = {}
+        self._codecs_generation = 0     # bumped when codecs change
+        for content_type, (encoder, decoder) in codec.CODECS.iteritems():
+            self.set_encoder(content_type, encoder)
+            self.set_decoder(content_type, decoder)
+        self.set_json_codec(json_codec)
         self._solr = None
 
+        self._pool_size = pool_size
+        self._pool_idle_timeout = pool_idle_timeout
+        self._pool_retry = pool_retry
+
+        self._cache = cache
+        self._negative_cache = negative_cache
+        self._resolver = resolver
+        self._resolver_write_back = False
+
+        if coalesce_reads:
+            self._single_flight = SingleFlight()
+        else:
+            self._single_flight = None
+
         self.transport = transport(self) 
 
     def get_transport(self):
         return self.transport
 
+    def get_cache(self):
+        """
+        Get the object cache of this client, None if objects are not
+        cached.
+        """
+        return self._cache
+
+    def set_cache(self, cache):
+        """
+        Cache the objects read through this client.
+
+        :param cache: the cache, None to stop caching
+        :type cache: :class:`ObjectCache <riakasaurus.cache.ObjectCache>`
+        :rtype: self
+        """
+        self._cache = cache
+        return self
+
+    def get_negative_cache(self):
+        """
+        Get the cache of missing keys of this client, None if misses are
+        not cached.
+        """
+        return self._negative_cache
+
+    def set_negative_cache(self, negative_cache):
+        """
+        Remember the keys found missing through this client.
+
+        :param negative_cache: the cache, None to stop caching misses
+        :type negative_cache: :class:`NegativeCache <riakasaurus.cache.NegativeCache>`
+        :rtype: self
+        """
+        self._negative_cache = negative_cache
+        return self
+
+    def get_resolver(self):
+        """
+        Get the default sibling resolver of the buckets.
+
+        :rtype: (resolver, write_back) tuple
+        """
+        return self._resolver, self._resolver_write_back
+
+    def set_resolver(self, resolver, write_back=False):
+        """
+        Set the default sibling resolver of the buckets, see
+        :func:`RiakBucket.set_resolver <riakasaurus.bucket.RiakBucket.set_resolver>`.
+
+        :param resolver: the resolver, None to keep the siblings
+        :type resolver: function
+        :param write_back: store the resolved object right away
+        :type write_back: bool
+        :rtype: self
+        """
+        self._resolver = resolver
+        self._resolver_write_back = write_back
+        return self
+
+    def _fetch(self, robj, r=None, pr=None, vtag=None, head=False):
+        """
+        Get (or head) robj, None straight away if the negative cache of
+        its bucket knows it is missing.
+        """
+        bucket = robj.get_bucket()
+        negative_cache = bucket.get_negative_cache()
+        if negative_cache is None or vtag is not None:
+            return self._fetch_cached(robj, r, pr, vtag, head)
+
+        def fetch():
+            return self._fetch_cached(robj, r, pr, vtag, head)
+        return negative_cache.get(bucket.get_name(), robj.get_key(), fetch)
+
+    def _fetch_cached(self, robj, r, pr, vtag, head):
+        """
+        Get (or head) robj, from the object cache of its bucket if there
+        is one, else over the transport.
+        """
+        cache = robj.get_bucket().get_cache()
+        if cache is None or head or vtag is not None:
+            return self._read(robj, r, pr, vtag, head)
+
+        def fetch(if_modified):
+            return self._read(robj, r, pr, vtag, head, if_modified)
+        return cache.get(robj.get_bucket().get_name(), robj.get_key(), fetch)
+
+    def _read(self, robj, r, pr, vtag, head, if_modified=None):
+        """
+        Get (or head) robj over the transport, sharing the request with
+        identical ones in flight if reads are coalesced.
+        """
+        t = self.get_transport()
+        kwargs = {'r': r, 'pr': pr, 'vtag': vtag}
+        if head:
+            op = t.head
+        else:
+            op = t.get
+            if if_modified is not None:
+                kwargs['if_modified'] = if_modified
+        if self._single_flight is None:
+            return op(robj, **kwargs)
+
+        key = (robj.get_bucket().get_name(), robj.get_key(), r, pr, head, vtag,
+               if_modified and if_modified[0])
+        return self._single_flight.run(key, op, robj, **kwargs)
+
+    def get_nodes(self):
+        """
+        Get the (host, port) tuples of the nodes this client talks to.
+
+        :rtype: list
+        """
+        return self._nodes
+
     def get_r(self):
         """
         Get the R-value setting for this RiakClient. (default 2)
@@ -212,6 +385,7 @@ class RiakClient(object):
         :type encoder: function
         """
         self._encoders[content_type] = encoder
+        self._codecs_generation += 1
         return self
 
     def get_decoder(self, content_type):
@@ -229,6 +403,22 @@ class RiakClient(object):
         :type decoder: function
         """
         self._decoders[content_type] = decoder
+        self._codecs_generation += 1
+        return self
+
+    def set_json_codec(self, name=None):
+        """
+        Encode and decode JSON objects with the given JSON implementation.
+
+        :param name: as registered in :mod:`riakasaurus.codec`, such as
+         ujson, the default (stdlib json) if None
+        :type name: string
+        :rtype: self
+        """
+        dumps, loads = codec.json_codec(name)
+        for content_type in codec.JSON_CONTENT_TYPES:
+            self.set_encoder(content_type, dumps)
+            self.set_decoder(content_type, loads)
         return self
 
     def bucket(self, name):
@@ -239,6 +429,31 @@ class RiakClient(object):
         """
         return bucket.RiakBucket(self, name)
 
+    def multi_get(self, keys, r=None, pr=None, concurrency=20):
+        """
+        Fetch many objects at once, with at most concurrency requests in
+        flight. A failing key does not fail the whole batch.
+
+        :param keys: (bucket, key) tuples, the bucket is either a
+         RiakBucket or a bucket name
+        :type keys: list
+        :param r: R-Value of the requests (defaults to each bucket's R)
+        :type r: integer
+        :param pr: PR-Value of the requests (defaults to each bucket's PR)
+        :type pr: integer
+        :param concurrency: maximum number of requests in flight
+        :type concurrency: integer
+        :returns: list of (success, RiakObject or Failure) tuples in the
+         order of keys, like a DeferredList -- via deferred
+        """
+        sem = defer.DeferredSemaphore(concurrency)
+        ds = []
+        for b, key in keys:
+            if not isinstance(b, bucket.RiakBucket):
+                b = self.bucket(b)
+            ds.append(sem.run(b.get, key, r=r, pr=pr))
+        return defer.DeferredList(ds, consumeErrors=True)
+
     def is_alive(self):
         """
         Check if the Riak server for this RiakClient is alive.
@@ -0,0 +1,80 @@
+"""
+.. module:: coalesce.py
+
+SingleFlight, lets concurrent identical reads share one request to Riak.
+
+"""
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+
+def copy_result(result):
+    """
+    Copy a transport get/head result so it can be handed to another
+    RiakObject. populate() consumes the contents list and keeps the
+    metadata dicts, the values themselves are immutable strings.
+    """
+    if isinstance(result, list):
+        return list(result)
+    if not isinstance(result, tuple):
+        return result
+
+    vclock, contents = result
+    copied = []
+    for metadata, data in contents:
+        metadata = dict(metadata)
+        for name, value in metadata.items():
+            if isinstance(value, dict):
+                metadata[name] = dict(value)
+            elif isinstance(value, list):
+                metadata[name] = list(value)
+        copied.append((metadata, data))
+    return vclock, copied
+
+
+class SingleFlight(object):
+    """
+    While a call for a key is in flight, further calls for the same key
+    wait for its result instead of issuing their own. Every caller gets
+    its own copy of the result.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0          # calls that went out
+        self.shared = 0         # calls that waited for another one
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def run(self, key, f, *args, **kwargs):
+        """
+        Call f(*args, **kwargs), unless a call for key is in flight
+
+        :returns: the result of f -- via deferred
+        """
+        d = defer.Deferred()
+        waiters = self._inflight.get(key)
+        if waiters is not None:
+            self.shared += 1
+            waiters.append(d)
+            return d
+
+        self.calls += 1
+        self._inflight[key] = [d]
+        call = defer.maybeDeferred(f, *args, **kwargs)
+        call.addBoth(self._done, key)
+        return d
+
+    def _done(self, result, key):
+        waiters = self._inflight.pop(key)
+        if isinstance(result, Failure):
+            for d in waiters:
+                d.errback(result)
+        else:
+            # the copies have to be taken before the first caller
+            # consumes the result
+            for d in waiters[1:]:
+                d.callback(copy_result(result))
+            waiters[0].callback(result)
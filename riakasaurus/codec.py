@@ -0,0 +1,182 @@
+"""
+.. module:: codec.py
+
+The JSON implementations the client can encode and decode objects with,
+the other content types it knows (msgpack if it is installed), and the
+compressions it can store them with.
+
+Objects are encoded with the stdlib json module unless a client or
+bucket asks for another JSON implementation by name with set_json_codec,
+ujson or simplejson when they are installed. ujson is the fastest, but
+can't handle everything json does, so values it fails on are left to
+json.
+
+Compressed values are stored with their content encoding, gzip and
+deflate to start with, see RiakBucket.set_compression.
+
+"""
+
+import json
+import zlib
+
+from riakasaurus import RiakError
+
+
+JSON_CONTENT_TYPES = ('application/json', 'text/json')
+
+# name -> (dumps, loads), see register_json
+JSON_CODECS = {}
+
+# in the order they were registered, preferred ones first
+_preferred = []
+
+MSGPACK_CONTENT_TYPES = ('application/x-msgpack', 'application/msgpack')
+
+# content type -> (encode, decode) every client starts with besides
+# JSON, see register_codec
+CODECS = {}
+
+
+def register_json(name, dumps, loads, preferred=False):
+    """
+    Make a JSON implementation available to set_json_codec.
+
+    :param name: name to ask for it by
+    :type name: string
+    :param dumps: function encoding a value to a JSON string
+    :type dumps: function
+    :param loads: function decoding a JSON string
+    :type loads: function
+    :param preferred: use it by default from now on
+    :type preferred: bool
+    """
+    global JSON
+    JSON_CODECS[name] = (dumps, loads)
+    if name in _preferred:
+        _preferred.remove(name)
+    if preferred:
+        _preferred.insert(0, name)
+        JSON = name
+    else:
+        _preferred.append(name)
+
+
+def json_codec(name=None):
+    """
+    The (dumps, loads) functions of a JSON implementation.
+
+    :param name: as registered, the default JSON implementation if None
+    :type name: string
+    :rtype: tuple
+    """
+    try:
+        return JSON_CODECS[name or JSON]
+    except KeyError:
+        raise RiakError('Unknown JSON codec %r, have %s'
+                        % (name, ', '.join(sorted(JSON_CODECS))))
+
+
+register_json('json', json.dumps, json.loads)
+
+try:
+    import ujson
+except ImportError:
+    pass
+else:
+    # ujson raises on integers of 64 bits and more, NaN and infinity,
+    # which json reads and writes
+
+    def ujson_dumps(value):
+        try:
+            return ujson.dumps(value)
+        except (ValueError, OverflowError):
+            return json.dumps(value)
+
+    def ujson_loads(data):
+        try:
+            return ujson.loads(data)
+        except (ValueError, OverflowError):
+            return json.loads(data)
+
+    register_json('ujson', ujson_dumps, ujson_loads)
+
+try:
+    import simplejson
+    from simplejson import _speedups
+except ImportError:
+    pass
+else:
+    # only worth it with the C extension
+    register_json('simplejson', simplejson.dumps, simplejson.loads)
+
+# the default
+JSON = 'json'
+
+
+def register_codec(content_type, encode, decode):
+    """
+    Encode and decode objects of a content type with the given functions
+    in the clients created from now on.
+
+    :param content_type: the content type
+    :type content_type: string
+    :param encode: function encoding a value to a string
+    :type encode: function
+    :param decode: function decoding a string
+    :type decode: function
+    """
+    CODECS[content_type] = (encode, decode)
+
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+else:
+    # str is packed as bin and unpacked as str, unicode as UTF-8 strings,
+    # so values come back as they were stored
+    _packer = msgpack.Packer(use_bin_type=True)
+
+    def msgpack_dumps(value):
+        # a packer is reused rather than made for every value, it calls
+        # no Python code so nothing else can use it meanwhile
+        return _packer.pack(value)
+
+    def msgpack_loads(data):
+        return msgpack.unpackb(data, raw=False)
+
+    for content_type in MSGPACK_CONTENT_TYPES:
+        register_codec(content_type, msgpack_dumps, msgpack_loads)
+
+
+# content encoding -> (compress, decompress), see register_compression
+COMPRESSIONS = {}
+
+
+def register_compression(encoding, compress, decompress):
+    """
+    Make a compression available to RiakBucket.set_compression. Values
+    stored with this content encoding are decompressed when read.
+
+    :param encoding: the content encoding it is stored with
+    :type encoding: string
+    :param compress: function compressing a string
+    :type compress: function
+    :param decompress: function decompressing a string
+    :type decompress: function
+    """
+    COMPRESSIONS[encoding] = (compress, decompress)
+
+
+def gzip_compress(data):
+    # zlib.compress writes a zlib header, gzip needs wbits 16 + 15
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gzip_decompress(data):
+    return zlib.decompress(data, 31)
+
+
+register_compression('gzip', gzip_compress, gzip_decompress)
+register_compression('deflate', zlib.compress, zlib.decompress)
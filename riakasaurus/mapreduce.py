@@ -197,6 +197,45 @@ class RiakMapReduce(object):
         @param integer timeout - Timeout in milliseconds.
         @return array()
         """
+        inputs, query, link_results_flag = self._build_query()
+
+        t = self._client.get_transport()
+        result = yield t.mapred(inputs, query, timeout)
+
+        # If the last phase is NOT a link phase, then return the result.
+        if not link_results_flag:
+            defer.returnValue(result)
+
+        defer.returnValue(self._to_links(result))
+
+    def stream(self, on_phase_result, timeout=None):
+        """
+        Run the map/reduce operation, calling on_phase_result(phase,
+        results) with every chunk of results as it arrives, instead of
+        waiting for the complete result. If on_phase_result returns a
+        Deferred no more results are read until it fires.
+        @param function on_phase_result - Called with the phase number and
+          a list of results (RiakLink objects for the last link phase).
+        @param integer timeout - Timeout in milliseconds.
+        @return deferred, fires with None once all results were handled
+        """
+        inputs, query, link_results_flag = self._build_query()
+        last_phase = len(query) - 1
+
+        def consumer(chunk):
+            phase, results = chunk
+            if link_results_flag and phase == last_phase:
+                results = self._to_links(results)
+            return on_phase_result(phase, results)
+
+        t = self._client.get_transport()
+        return t.stream_mapred(inputs, query, consumer, timeout)
+
+    def _build_query(self):
+        """
+        Get the inputs and phases of the job in the form the transports
+        send them, and whether the results are links.
+        """
         num_phases = len(self._phases)
 
         # If there are no phases, then just echo the inputs back to the user.
@@ -230,17 +269,13 @@ class RiakMapReduce(object):
             self._inputs = {'bucket':       bucket_name,
                             'key_filters':  self._key_filters}
 
-        t = self._client.get_transport()
-        result = yield t.mapred(self._inputs, query, timeout)
-
-        # If the last phase is NOT a link phase, then return the result.
         link_results_flag = link_results_flag or isinstance(self._phases[-1], RiakLinkPhase)
-        if not link_results_flag:
-            defer.returnValue(result)
+        return self._inputs, query, link_results_flag
 
+    def _to_links(self, result):
         # If there are no results, then return an empty list.
         if result == None:
-            defer.returnValue([])
+            return []
 
         # Otherwise, if the last phase IS a link phase, then convert the
         # results to RiakLink objects.
@@ -253,7 +288,7 @@ class RiakMapReduce(object):
             link._client = self._client
             a.append(link)
 
-        defer.returnValue(a)
+        return a
 
     ##
     # Start Shortcuts to built-ins
@@ -393,6 +428,8 @@ class RiakLink(object):
     another.
     """
 
+    __slots__ = ('_bucket', '_key', '_tag', '_client')
+
     def __init__(self, bucket, key, tag=None):
         """
         Construct a RiakLink object.
@@ -0,0 +1,186 @@
+"""
+.. module:: node.py
+
+RiakNode and RiakCluster classes, used by the transports to spread
+requests over the nodes of a Riak cluster.
+
+"""
+
+import time
+
+from twisted.internet import defer, reactor, error
+from twisted.python import log
+try:
+    from twisted.web._newclient import ResponseFailed
+except ImportError:
+    ResponseFailed = error.ConnectionLost
+
+
+class RiakNode(object):
+    """
+    Bookkeeping for a single Riak node: requests in flight, an
+    exponentially weighted moving average of the request latency and
+    the consecutive failures that trip its circuit breaker.
+    """
+
+    EWMA_WEIGHT = 0.2
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.outstanding = 0
+        self.latency = None     # EWMA in seconds, None until measured
+        self.failures = 0
+        self.down_since = None
+        self.version = None         # server version, None until resolved
+        self.capabilities = None    # bitmap of the features of version
+
+    def __repr__(self):
+        return '<RiakNode %s:%s outstanding=%d latency=%s state=%s>' % (
+            self.host, self.port, self.outstanding, self.latency,
+            self.is_available() and 'up' or 'down')
+
+    def start(self):
+        """
+        A request was sent to this node.
+        """
+        self.outstanding += 1
+
+    def finish(self, latency=None):
+        """
+        A request sent to this node finished after latency seconds.
+        """
+        self.outstanding = max(self.outstanding - 1, 0)
+        if latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.EWMA_WEIGHT * (latency - self.latency)
+
+    def is_available(self):
+        return self.down_since is None
+
+    def mark_down(self):
+        if self.down_since is None:
+            self.down_since = time.time()
+
+    def mark_up(self):
+        self.down_since = None
+        self.failures = 0
+
+
+class RiakCluster(object):
+    """
+    The nodes a transport talks to. Requests go to the available node
+    with the fewest outstanding requests, ties are broken by latency.
+
+    After ERROR_THRESHOLD consecutive failures a node is taken out of
+    rotation, and pinged every PROBE_INTERVAL seconds until it answers
+    again.
+    """
+
+    ERROR_THRESHOLD = 3
+    PROBE_INTERVAL = 5      # in seconds
+
+    # errors that say something about the node rather than the request
+    NODE_ERRORS = (error.ConnectError,
+                   error.ConnectionLost,
+                   error.ConnectionDone,
+                   error.TimeoutError,
+                   ResponseFailed)
+
+    def __init__(self, nodes, ping):
+        """
+        :param nodes: list of (host, port) tuples
+        :param ping: function called with a RiakNode, returning a deferred
+         that fires with True if the node is alive
+        """
+        self.nodes = [RiakNode(host, port) for host, port in nodes]
+        self._ping = ping
+        self._probe = None
+        self._stopped = False
+        self.capabilities = None
+
+    def set_version(self, node, version, capabilities):
+        """
+        Record the server version of node and the bitmap of features it
+        supports, or forget them when version is None.
+        """
+        node.version = version
+        node.capabilities = capabilities
+        # only what every known node supports can be relied upon
+        known = [n.capabilities for n in self.nodes
+                 if n.capabilities is not None]
+        if known:
+            self.capabilities = reduce(lambda a, b: a & b, known)
+        else:
+            self.capabilities = None
+
+    def __repr__(self):
+        return '<RiakCluster %s>' % self.nodes
+
+    def pick(self, exclude=()):
+        """
+        Get the node the next request should go to.
+
+        :param exclude: nodes that already failed this request
+        :rtype: RiakNode
+        """
+        candidates = [n for n in self.nodes
+                      if n.is_available() and n not in exclude]
+        if not candidates:
+            # everything is down, try the node that failed first rather
+            # than refusing to send anything
+            candidates = [n for n in self.nodes if n not in exclude] or \
+                         self.nodes
+            return min(candidates, key=lambda n: n.down_since)
+
+        return min(candidates, key=lambda n: (n.outstanding, n.latency or 0))
+
+    def is_node_error(self, failure):
+        return failure.check(*self.NODE_ERRORS) is not None
+
+    def succeeded(self, node):
+        node.failures = 0
+
+    def failed(self, node):
+        node.failures += 1
+        if node.is_available() and node.failures >= self.ERROR_THRESHOLD:
+            log.msg("[%s] taking %r out of rotation" % (self.__class__.__name__, node))
+            node.mark_down()
+            self._schedule_probe()
+
+    def _schedule_probe(self):
+        if self._stopped:
+            return
+        if self._probe is None or not self._probe.active():
+            self._probe = reactor.callLater(self.PROBE_INTERVAL,
+                                            self._probe_nodes)
+
+    @defer.inlineCallbacks
+    def _probe_nodes(self):
+        self._probe = None
+        for node in self.nodes:
+            if node.is_available():
+                continue
+            try:
+                alive = yield self._ping(node)
+            except Exception:
+                alive = False
+            if alive:
+                log.msg("[%s] %r is back" % (self.__class__.__name__, node))
+                node.mark_up()
+                # it may have been upgraded meanwhile
+                self.set_version(node, None, None)
+
+        if [n for n in self.nodes if not n.is_available()]:
+            self._schedule_probe()
+
+    def stop(self):
+        """
+        Stop probing nodes that are down.
+        """
+        self._stopped = True
+        if self._probe is not None and self._probe.active():
+            self._probe.cancel()
+        self._probe = None
@@ -0,0 +1,210 @@
+"""
+.. module:: pbc_decode.py
+
+Turns RpbGetResp messages into the (vclock, [(metadata, value)]) results
+RiakObject.populate takes.
+
+decode_get_response reads the result straight from the wire format. The
+pure Python protobuf implementation spends far longer building the
+message objects than anything else on a get, so it is used instead of
+ParseFromString unless protobuf has its C++ implementation.
+
+Either way, links and index entries are put in the metadata as tuples
+of (bucket, key, tag) and (field, value) tuples. The RiakObject only
+makes RiakLinks and RiakIndexEntries of them when they are asked for.
+
+"""
+
+from google.protobuf.internal import api_implementation
+
+from riakasaurus.metadata import *
+from riakasaurus.cache import NOT_MODIFIED
+from riakasaurus.riak_kv_pb2 import RpbGetResp
+
+
+# RpbContent string fields, by field number
+_CONTENT_STRINGS = {2: MD_CTYPE, 3: MD_CHARSET, 4: MD_ENCODING, 5: MD_VTAG}
+
+
+def _varint(m, pos):
+    result = shift = 0
+    while True:
+        b = ord(m[pos])
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _skip(m, pos, wire):
+    # past the value of a field we don't know about
+    if wire == 0:
+        return _varint(m, pos)[1]
+    if wire == 1:
+        return pos + 8
+    if wire == 2:
+        length, pos = _varint(m, pos)
+        return pos + length
+    if wire == 5:
+        return pos + 4
+    raise ValueError('unsupported wire type %d' % wire)
+
+
+def _strings(m, pos, end, count):
+    # the first count string fields of an RpbLink or RpbPair
+    fields = [''] * count
+    while pos < end:
+        tag, pos = _varint(m, pos)
+        if tag & 7 != 2:
+            pos = _skip(m, pos, tag & 7)
+            continue
+        length, pos = _varint(m, pos)
+        field = tag >> 3
+        if field <= count:
+            fields[field - 1] = m[pos:pos + length].tobytes()
+        pos += length
+    return fields
+
+
+def _decode_content(m, pos, end):
+    metadata = {}
+    value = ''
+    links = []
+    usermeta = {}
+    indexes = []
+    while pos < end:
+        tag = ord(m[pos])
+        if tag < 0x80:
+            pos += 1
+        else:
+            tag, pos = _varint(m, pos)
+        field = tag >> 3
+        wire = tag & 7
+        if wire == 2:
+            length = ord(m[pos])
+            if length < 0x80:
+                pos += 1
+            else:
+                length, pos = _varint(m, pos)
+            stop = pos + length
+            if field == 1:
+                value = m[pos:stop].tobytes()
+            elif field in _CONTENT_STRINGS:
+                metadata[_CONTENT_STRINGS[field]] = m[pos:stop].tobytes()
+            elif field == 6:
+                links.append(tuple(_strings(m, pos, stop, 3)))
+            elif field == 9:
+                k, v = _strings(m, pos, stop, 2)
+                usermeta[k] = v
+            elif field == 10:
+                indexes.append(tuple(_strings(m, pos, stop, 2)))
+            pos = stop
+        elif wire == 0:
+            number, pos = _varint(m, pos)
+            if field == 7:
+                metadata[MD_LASTMOD] = number
+            elif field == 8:
+                metadata[MD_LASTMOD_USECS] = number
+            elif field == 11:
+                metadata[MD_DELETED] = bool(number)
+        else:
+            pos = _skip(m, pos, wire)
+
+    if links:
+        metadata[MD_LINKS] = tuple(links)
+    if usermeta:
+        metadata[MD_USERMETA] = usermeta
+    if indexes:
+        metadata[MD_INDEX] = tuple(indexes)
+    return metadata, value
+
+
+def decode_get_response(body):
+    """
+    The result of a get from the body of its RpbGetResp, without
+    building the protobuf message.
+
+    :param body: the message, after the message code
+    :type body: string or memoryview
+    :returns: (vclock, [(metadata, value)]), None if the key was not
+     found, NOT_MODIFIED if the get was conditional and nothing changed
+    """
+    m = memoryview(body)
+    pos = 0
+    end = len(m)
+    vclock = None
+    contents = []
+    unchanged = False
+    while pos < end:
+        tag = ord(m[pos])
+        if tag < 0x80:
+            pos += 1
+        else:
+            tag, pos = _varint(m, pos)
+        if tag == 0x0a:         # content
+            length, pos = _varint(m, pos)
+            contents.append(_decode_content(m, pos, pos + length))
+            pos += length
+        elif tag == 0x12:       # vclock
+            length, pos = _varint(m, pos)
+            vclock = m[pos:pos + length].tobytes()
+            pos += length
+        elif tag == 0x18:       # unchanged
+            number, pos = _varint(m, pos)
+            unchanged = bool(number)
+        else:
+            pos = _skip(m, pos, tag & 7)
+
+    if unchanged:
+        return NOT_MODIFIED
+    if vclock is None and not contents:
+        return None
+    return vclock, contents
+
+
+def parse_get_response(response):
+    """
+    The result of a get from its RpbGetResp message, like
+    decode_get_response.
+
+    :param response: the parsed message
+    :type response: RpbGetResp
+    """
+    contents = []
+    for content in response.content:
+        metadata = {}
+        if content.HasField('content_type'): metadata[MD_CTYPE] = content.content_type
+        if content.HasField('charset'): metadata[MD_CHARSET] = content.charset
+        if content.HasField('content_encoding'): metadata[MD_ENCODING] = content.content_encoding
+        if content.HasField('vtag'): metadata[MD_VTAG] = content.vtag
+        if content.HasField('last_mod'): metadata[MD_LASTMOD] = content.last_mod
+        if content.HasField('last_mod_usecs'): metadata[MD_LASTMOD_USECS] = content.last_mod_usecs
+        if content.HasField('deleted'): metadata[MD_DELETED] = content.deleted
+        if len(content.links):
+            metadata[MD_LINKS] = tuple([(l.bucket, l.key, l.tag)
+                                        for l in content.links])
+        if len(content.usermeta):
+            metadata[MD_USERMETA] = dict([(md.key, md.value)
+                                          for md in content.usermeta])
+        if len(content.indexes):
+            metadata[MD_INDEX] = tuple([(ie.key, ie.value)
+                                        for ie in content.indexes])
+        contents.append((metadata, content.value))
+    return response.vclock, contents
+
+
+def _parse_and_adapt(body):
+    response = RpbGetResp()
+    response.ParseFromString(body)
+    if response.unchanged:
+        return NOT_MODIFIED
+    if not response.HasField('vclock') and not len(response.content):
+        return None
+    return parse_get_response(response)
+
+
+if api_implementation.Type() == 'python':
+    get_response_decoder = decode_get_response
+else:
+    get_response_decoder = _parse_and_adapt
@@ -0,0 +1,126 @@
+"""
+.. module:: pbc_encode.py
+
+Request templates for gets, puts and deletes over protocol buffers.
+
+The fields that are the same for every request on a bucket, its name and
+the quorum values, are serialized once into a template. A request is the
+template followed by its key, vclock and content, which is valid as
+protobuf allows the fields of a message in any order. No message object
+is built for the request, the content is serialized by hand as well.
+
+"""
+
+# lengths and tags below 128 are a single byte
+_BYTES = [chr(i) for i in xrange(128)]
+
+
+def _varint(n):
+    if n < 0x80:
+        return _BYTES[n]
+    out = []
+    while n >= 0x80:
+        out.append(chr(0x80 | (n & 0x7f)))
+        n >>= 7
+    out.append(chr(n))
+    return ''.join(out)
+
+
+def _pairs(tag, pairs, out):
+    # RpbLinks or RpbPairs, as their string fields 1, 2, 3 in order
+    for pair in pairs:
+        fields = []
+        for i, value in enumerate(pair):
+            if value is not None:
+                fields.append(_BYTES[(i + 1) << 3 | 2] + _varint(len(value)) + value)
+        message = ''.join(fields)
+        out.append(tag + _varint(len(message)) + message)
+
+
+# RpbContent fields of the put payload: string fields by key, with their tag
+_CONTENT_STRINGS = (('content_type', '\x12'), ('charset', '\x1a'),
+                    ('content_encoding', '\x22'), ('vtag', '\x2a'))
+
+
+def encode_content(content):
+    """
+    Serialize the content of a put as a RpbContent message.
+
+    :param content: the value, or a dict with the value and the other
+     RpbContent fields as RiakPBC.put takes it
+    :type content: string or dict
+    :rtype: string
+    """
+    if isinstance(content, str):
+        return '\x0a' + _varint(len(content)) + content
+
+    value = content['value']
+    out = ['\x0a' + _varint(len(value)) + value]
+    for name, tag in _CONTENT_STRINGS:
+        if name in content:
+            value = content[name]
+            out.append(tag + _varint(len(value)) + value)
+    links = content.get('links')
+    if isinstance(links, list):
+        _pairs('\x32', links, out)
+    if 'last_mod' in content:
+        out.append('\x38' + _varint(content['last_mod']))
+    if 'last_mod_usecs' in content:
+        out.append('\x40' + _varint(content['last_mod_usecs']))
+    usermeta = content.get('usermeta')
+    if isinstance(usermeta, list):
+        _pairs('\x4a', usermeta, out)
+    indexes = content.get('indexes')
+    if isinstance(indexes, list):
+        _pairs('\x52', indexes, out)
+    if 'deleted' in content:
+        out.append(content['deleted'] and '\x58\x01' or '\x58\x00')
+    return ''.join(out)
+
+
+class RequestTemplate(object):
+    """
+    A get, put or delete request on a bucket, serialized but for the key,
+    vclock and content. See RiakPBC.prepareGet, preparePut and
+    prepareDelete.
+    """
+
+    __slots__ = ('code', 'prefix', 'vclock_tag', 'content_tag')
+
+    def __init__(self, code, request, vclock_field, content_field=None):
+        """
+        :param code: the message code of the request
+        :type code: integer
+        :param request: the request without its key, vclock and content
+        :type request: protobuf message
+        :param vclock_field: number of the field the vclock goes in
+        :type vclock_field: integer
+        :param content_field: number of the RpbContent field, None if the
+         request has no content
+        :type content_field: integer
+        """
+        self.code = chr(code)
+        self.prefix = request.SerializePartialToString()
+        self.vclock_tag = _BYTES[vclock_field << 3 | 2]
+        self.content_tag = content_field and _BYTES[content_field << 3 | 2]
+
+    def body(self, key, vclock=None, content=None):
+        """
+        The serialized request for key.
+
+        :param key: the key, it is field 2 of all the requests
+        :type key: string
+        :param vclock: the vclock, if any
+        :type vclock: string
+        :param content: the content of a put, see encode_content
+        :rtype: string
+        """
+        body = self.prefix + '\x12' + _varint(len(key)) + key
+        if vclock:
+            body += self.vclock_tag + _varint(len(vclock)) + vclock
+        if content is not None:
+            content = encode_content(content)
+            body += self.content_tag + _varint(len(content)) + content
+        if not isinstance(body, str):
+            raise TypeError('request fields have to be str, not unicode')
+        return body
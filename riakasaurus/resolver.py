@@ -0,0 +1,78 @@
+"""
+.. module:: resolver.py
+
+Sibling resolvers for :func:`RiakBucket.set_resolver
+<riakasaurus.bucket.RiakBucket.set_resolver>`.
+
+A resolver is called with the siblings of an object, RiakObjects with
+decoded data, and returns either the sibling that wins or the merged
+value.
+
+"""
+
+import json
+from email.utils import parsedate_tz, mktime_tz
+
+from riakasaurus.metadata import *
+
+
+def last_modified(obj):
+    """
+    When obj was last modified, in seconds since the epoch. 0 if Riak
+    did not tell.
+
+    :rtype: float
+    """
+    metadata = obj.get_metadata()
+    lastmod = metadata.get(MD_LASTMOD)
+    if lastmod is None:
+        return 0
+    if isinstance(lastmod, basestring):
+        # HTTP gives a Last-Modified date, protocol buffers seconds
+        parsed = parsedate_tz(lastmod)
+        if parsed is None:
+            return 0
+        lastmod = mktime_tz(parsed)
+    return lastmod + metadata.get(MD_LASTMOD_USECS, 0) / 1e6
+
+
+def _live(siblings):
+    # tombstones only count if there is nothing else
+    return [s for s in siblings
+            if not s.get_metadata().get(MD_DELETED)] or siblings
+
+
+def last_write_wins(siblings):
+    """
+    The sibling modified last wins.
+    """
+    return max(_live(siblings), key=last_modified)
+
+
+def union(siblings):
+    """
+    Merge siblings holding JSON lists into a list of every item that is
+    in any of them, in the order they first appear.
+    """
+    merged = []
+    seen = set()
+    for sibling in _live(siblings):
+        for item in sibling.get_data() or []:
+            k = json.dumps(item, sort_keys=True)
+            if k not in seen:
+                seen.add(k)
+                merged.append(item)
+    return merged
+
+
+def merge(function):
+    """
+    A resolver that merges the values of the siblings pairwise with
+    function(a, b), like reduce().
+
+    :param function: called with two values, returns the merged value
+    :type function: function
+    """
+    def resolver(siblings):
+        return reduce(function, [s.get_data() for s in _live(siblings)])
+    return resolver
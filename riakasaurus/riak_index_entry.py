@@ -18,7 +18,9 @@ specific language governing permissions and limitations
 under the License.
 """
 
-class RiakIndexEntry:
+class RiakIndexEntry(object):
+    __slots__ = ('_field', '_value')
+
     def __init__(self, field, value):
         self._field = field
         self._value = str(value)
@@ -17,11 +17,11 @@ KIND, either express or implied.  See the License for the
 specific language governing permissions and limitations
 under the License.
 """
-import types, copy
+import types
 
 from twisted.internet import defer
 
-from riakasaurus import RiakError
+from riakasaurus import RiakError, codec
 from riakasaurus.riak_index_entry import RiakIndexEntry
 from riakasaurus.metadata import *
 
@@ -30,6 +30,11 @@ class RiakObject(object):
     The RiakObject holds meta information about a Riak object, plus the
     object's data.
     """
+
+    # bulk reads create a lot of these
+    __slots__ = ('_client', '_bucket', '_key', '_encode_data', '_vclock',
+                 '_data', '_encoded', '_decoded', '_metadata', '_siblings',
+                 '_exists', '__weakref__')
     def __init__(self, client, bucket, key=None):
         """
         Construct a new RiakObject.
@@ -54,9 +59,10 @@ class RiakObject(object):
         self._encode_data = True
         self._vclock = None
         self._data = None
-        self._metadata = {MD_USERMETA: {}, MD_INDEX: []}
-        self._links = []
-        self._siblings = []
+        self._encoded = None    # the data as read from Riak
+        self._decoded = True    # False until _encoded is decoded into _data
+        self._metadata = {}     # usermeta, indexes and links added when used
+        self._siblings = ()
         self._exists = False
 
     def get_bucket(self):
@@ -84,8 +90,13 @@ class RiakObject(object):
         :func:`RiakBucket.get_binary <riak.bucket.RiakBucket.get_binary>`,
         in which case this will return a string.
 
+        Data read from Riak is decoded on the first call.
+
         :rtype: array or string
         """
+        if not self._decoded:
+            self._data = self._decode(self._encoded)
+            self._decoded = True
         return self._data
 
     def set_data(self, data):
@@ -101,6 +112,8 @@ class RiakObject(object):
         :rtype: data
         """
         self._data = data
+        self._encoded = None
+        self._decoded = True
         if MD_CTYPE not in self._metadata:
             if self._encode_data:
                 self.set_content_type("application/json")
@@ -112,6 +125,9 @@ class RiakObject(object):
         """
         Get the data encoded for storing
         """
+        if not self._decoded:
+            # untouched since it was read, as it came
+            return self._encoded
         if self._encode_data == True:
             content_type = self.get_content_type()
             encoder = self._bucket.get_encoder(content_type)
@@ -130,19 +146,68 @@ class RiakObject(object):
     def set_encoded_data(self, data):
         """
         Set the object data from an encoded string. Make sure
-        the metadata has been set correctly first.
+        the metadata has been set correctly first. It is decoded when
+        :func:`get_data` is first called, but decompressed right away if
+        its content encoding is one of the compressions in
+        :mod:`riakasaurus.codec`.
+        """
+        encoding = self._metadata.get(MD_ENCODING)
+        if encoding in codec.COMPRESSIONS and data:
+            data = codec.COMPRESSIONS[encoding][1](data)
+            del self._metadata[MD_ENCODING]
+        self._encoded = data
+        self._data = None
+        self._decoded = False
+        return self
+
+    def get_raw_data(self):
         """
+        Get the data as it was read from Riak, without decoding it. If
+        the data was set since, it is encoded.
+
+        :rtype: string
+        """
+        if self._encoded is not None:
+            return self._encoded
+        return self.get_encoded_data()
+
+    def get_stored_data(self):
+        """
+        Get the data as it is sent to Riak, compressed if the bucket
+        says so, and its content encoding.
+
+        :rtype: (string, string or None)
+        """
+        data = self.get_encoded_data()
+        encoding = self._metadata.get(MD_ENCODING)
+        if encoding is not None:
+            # set by the application, the data is encoded already
+            return data, encoding
+        compression = self._bucket.get_compression()
+        if compression is not None and data and len(data) >= compression[1]:
+            encoding = compression[0]
+            data = codec.COMPRESSIONS[encoding][0](data)
+        return data, encoding
+
+    def _set_stored_metadata(self, metadata):
+        # metadata of what was just stored, which the data here is the
+        # uncompressed version of
+        encoding = self._metadata.get(MD_ENCODING)
+        if metadata is not None:
+            metadata.pop(MD_ENCODING, None)
+            if encoding is not None:
+                metadata[MD_ENCODING] = encoding
+        self.set_metadata(metadata)
+
+    def _decode(self, data):
         if self._encode_data == True:
             content_type = self.get_content_type()
             decoder = self._bucket.get_decoder(content_type)
             if decoder is None:
                 # if no decoder, just set as string data for application to handle
-                self._data = data
-            else:
-                self._data = decoder(data)
-        else:
-            self._data = data
-        return self
+                return data
+            return decoder(data)
+        return data
 
 
     def get_metadata(self):
@@ -152,8 +217,36 @@ class RiakObject(object):
 
         :rtype: dict
         """
+        self._links()
+        self._indexes(create=True)
+        self._metadata.setdefault(MD_USERMETA, {})
         return self._metadata
 
+    def _links(self, create=False):
+        # the links of the metadata, None if there are none. A get over
+        # protocol buffers leaves (bucket, key, tag) tuples in a tuple,
+        # they only become RiakLinks when they are asked for
+        links = self._metadata.get(MD_LINKS)
+        if links is None:
+            if create:
+                links = self._metadata[MD_LINKS] = []
+        elif type(links) is tuple:
+            links = self._metadata[MD_LINKS] = [RiakLink(*link)
+                                                for link in links]
+        return links
+
+    def _indexes(self, create=False):
+        # the index entries of the metadata, like _links with (field,
+        # value) tuples
+        indexes = self._metadata.get(MD_INDEX)
+        if indexes is None:
+            if create:
+                indexes = self._metadata[MD_INDEX] = []
+        elif type(indexes) is tuple:
+            indexes = self._metadata[MD_INDEX] = [RiakIndexEntry(*entry)
+                                                  for entry in indexes]
+        return indexes
+
     def set_metadata(self, metadata):
         """
         Set the metadata stored in this object.
@@ -166,10 +259,7 @@ class RiakObject(object):
         return self
 
     def get_usermeta(self):
-        if MD_USERMETA in self._metadata:
-          return self._metadata[MD_USERMETA]
-        else:
-          return {}
+        return self._metadata.setdefault(MD_USERMETA, {})
 
     def set_usermeta(self, usermeta):
         """
@@ -195,8 +285,9 @@ class RiakObject(object):
         :rtype: self
         """
         rie = RiakIndexEntry(field, value)
-        if not rie in self._metadata[MD_INDEX]:
-            self._metadata[MD_INDEX].append(rie)
+        indexes = self._indexes(True)
+        if not rie in indexes:
+            indexes.append(rie)
 
         return self
 
@@ -210,18 +301,19 @@ class RiakObject(object):
         :type value: string or integer
         :rtype: self
         """
+        indexes = self._indexes() or []
         if not field and not value:
-            ries = self._metadata[MD_INDEX][:]
+            ries = indexes[:]
         elif field and not value:
-            ries = [x for x in self._metadata[MD_INDEX] if x.get_field() == field]
+            ries = [x for x in indexes if x.get_field() == field]
         elif field and value:
             ries = [RiakIndexEntry(field, value)]
         else:
             raise Exception("Cannot pass value without a field name while removing index")
 
         for rie in ries:
-            if rie in self._metadata[MD_INDEX]:
-                self._metadata[MD_INDEX].remove(rie)
+            if rie in indexes:
+                indexes.remove(rie)
         return self
 
     remove_indexes = remove_index
@@ -251,9 +343,12 @@ class RiakObject(object):
         :rtype: (array of RiakIndexEntry) or (array of string or integer)
         """
         if field == None:
-            return self._metadata[MD_INDEX]
-        else:
-            return [x.get_value() for x in self._metadata[MD_INDEX] if x.get_field() == field]
+            return self._indexes(True)
+        indexes = self._metadata.get(MD_INDEX, ())
+        if type(indexes) is tuple:
+            # still as read, no need for RiakIndexEntries
+            return [str(v) for f, v in indexes if f == field]
+        return [x.get_value() for x in indexes if x.get_field() == field]
 
     def exists(self):
         """
@@ -337,7 +432,7 @@ class RiakObject(object):
             newlink = RiakLink(obj._bucket._name, obj._key, tag)
 
         self.remove_link(newlink)
-        links = self._metadata[MD_LINKS]
+        links = self._links(True)
         links.append(newlink)
         return self
 
@@ -358,7 +453,7 @@ class RiakObject(object):
             oldlink = RiakLink(obj._bucket._name, obj._key, tag)
 
         a = []
-        links = self._metadata.get(MD_LINKS, [])
+        links = self._links() or []
         for link in links:
             if not link.isEqual(oldlink):
                 a.append(link)
@@ -373,8 +468,8 @@ class RiakObject(object):
         :rtype: array()
         """
         # Set the clients before returning...
-        if MD_LINKS in self._metadata:
-            links = self._metadata[MD_LINKS]
+        links = self._links()
+        if links is not None:
             for link in links:
                 link._client = self._client
             return links
@@ -382,7 +477,8 @@ class RiakObject(object):
             return []
 
     @defer.inlineCallbacks
-    def store(self, w=None, dw=None, pw=None, return_body=True, if_none_match=False):
+    def store(self, w=None, dw=None, pw=None, return_body=True, if_none_match=False,
+              if_not_modified=False, return_head=False):
         """
         Store the object in Riak. When this operation completes, the
         object could contain new metadata and possibly new data if Riak
@@ -403,6 +499,15 @@ class RiakObject(object):
         :param if_none_match: Should the object be stored only if there is no
          key previously defined
         :type if_none_match: bool
+        :param if_not_modified: Should the object be stored only if it was
+         not modified since it was read (needs its ETag over HTTP,
+         RiakError if it has none).
+         :class:`RiakConflictError <riakasaurus.RiakConflictError>` is
+         raised if it was.
+        :type if_not_modified: bool
+        :param return_head: only retrieve the new vclock and metadata,
+         rather than the whole object, the data is kept as it is
+        :type return_head: bool
         :rtype: self
         """
         # Use defaults if not specified...
@@ -418,15 +523,33 @@ class RiakObject(object):
             self._exists = True
             self._key = key
             self._vclock = vclock
-            self.set_metadata(metadata)
+            self._set_stored_metadata(metadata)
         else:
-            Result = yield t.put(self, w=w, dw=dw, pw=pw, return_body=return_body, if_none_match=if_none_match)
-            if Result is not None:
+            Result = yield t.put(self, w=w, dw=dw, pw=pw, return_body=return_body,
+                                 if_none_match=if_none_match,
+                                 if_not_modified=if_not_modified,
+                                 return_head=return_head)
+            cache = self._bucket.get_cache()
+            if cache is not None:
+                if return_head:
+                    cache.invalidate(self._bucket.get_name(), self._key)
+                else:
+                    cache.stored(self._bucket.get_name(), self._key, Result)
+            negative_cache = self._bucket.get_negative_cache()
+            if negative_cache is not None:
+                negative_cache.invalidate(self._bucket.get_name(), self._key)
+            if return_head and isinstance(Result, tuple) and \
+                    len(Result[1]) == 1:
+                # keep the data, it is what was stored
+                self._vclock = Result[0]
+                self._set_stored_metadata(Result[1][0][0])
+                self._exists = True
+            elif Result is not None:
+                # siblings, only their metadata is known
                 self.populate(Result)
 
         defer.returnValue(self)
 
-    @defer.inlineCallbacks
     def reload(self, r=None, pr=None, vtag=None):
         """
         Reload the object from Riak. When this operation completes, the
@@ -441,16 +564,52 @@ class RiakObject(object):
         # Do the request...
         r = self._bucket.get_r(r)
         pr = self._bucket.get_pr(pr)
-        t = self._client.get_transport()
-        Result = yield t.get(self, r=r, pr=pr, vtag=vtag)
+        d = self._client._fetch(self, r=r, pr=pr, vtag=vtag)
+        d.addCallback(self.populate)
+        if vtag is None:
+            d.addCallback(self._auto_resolve)
+        return d
+
+    def _auto_resolve(self, ignored=None):
+        resolver, write_back = self._bucket.get_resolver()
+        if resolver is None or self.get_sibling_count() < 2:
+            return self
+        return self.resolve(resolver, write_back)
 
-        self.clear()
-        if Result is not None:
-            self.populate(Result)
+    @defer.inlineCallbacks
+    def resolve(self, resolver, write_back=False):
+        """
+        Replace the siblings of this object by the value resolver picks
+        or merges from them. The vclock of the siblings is kept, so
+        storing the object settles the conflict.
+
+        :param resolver: called with the siblings, returns the sibling
+         that wins or the merged value
+        :type resolver: function
+        :param write_back: store the resolved object
+        :type write_back: bool
+        :rtype: self -- via deferred
+        """
+        if self.get_sibling_count() < 2:
+            defer.returnValue(self)
+
+        siblings = yield self.get_siblings()
+        winner = resolver(list(siblings))
+        if isinstance(winner, RiakObject):
+            metadata, data = winner._metadata, winner.get_data()
+        else:
+            metadata, data = self._metadata, winner
 
+        metadata = dict(metadata)
+        metadata.pop(MD_VTAG, None)
+        self._metadata = metadata
+        self.set_data(data)
+        self._siblings = ()
+
+        if write_back:
+            yield self.store()
         defer.returnValue(self)
 
-    @defer.inlineCallbacks
     def head(self, r=None, pr=None, vtag=None):
         """
         Loads the metadata from Riak. When this operation completes, the
@@ -465,14 +624,8 @@ class RiakObject(object):
         # Do the request...
         r = self._bucket.get_r(r)
         pr = self._bucket.get_pr(pr)
-        t = self._client.get_transport()
-        Result = yield t.head(self, r=r, pr=pr, vtag=vtag)
-
-        self.clear()
-        if Result is not None:
-            self.populate(Result)
-
-        defer.returnValue(self)
+        d = self._client._fetch(self, r=r, pr=pr, vtag=vtag, head=True)
+        return d.addCallback(self.populate)
 
     @defer.inlineCallbacks
     def delete(self, rw=None, r=None, w=None, dw=None, pr=None, pw=None):
@@ -508,6 +661,9 @@ class RiakObject(object):
         pw = self._bucket.get_pw(pw)
         t = self._client.get_transport()
         Result = yield t.delete(self, rw=rw, r=r, w=w, dw=dw, pr=pr, pw=pw)
+        cache = self._bucket.get_cache()
+        if cache is not None:
+            cache.invalidate(self._bucket.get_name(), self._key)
         self.clear()
         defer.returnValue(self)
 
@@ -517,11 +673,11 @@ class RiakObject(object):
 
         :rtype: self
         """
-        self._headers = []
-        self._links = []
         self._data = None
+        self._encoded = None
+        self._decoded = True
         self._exists = False
-        self._siblings = []
+        self._siblings = ()
         return self
 
     def vclock(self) :
@@ -544,7 +700,7 @@ class RiakObject(object):
         """
         self.clear()
         if Result is None:
-            return self
+            pass
         elif type(Result) == types.ListType:
             self.set_siblings(Result)
         elif type(Result) == types.TupleType:
@@ -553,23 +709,27 @@ class RiakObject(object):
             if len(contents) > 0:
                 (metadata, data) = contents.pop(0)
                 self._exists = True
-                if not metadata.has_key(MD_INDEX):
-                    metadata[MD_INDEX] = []
                 self.set_metadata(metadata)
                 if data:        # needed for HEAD support
                     self.set_encoded_data(data)
-                # Create objects for all siblings
-                siblings = [self]
-                for (metadata, data) in contents:
-                    sibling = copy.copy(self)
-                    sibling.set_metadata(metadata)
-                    sibling.set_encoded_data(data)
-                    siblings.append(sibling)
-                for sibling in siblings:
-                    sibling.set_siblings(siblings)
+                if contents:
+                    # Create objects for all siblings
+                    siblings = [self]
+                    for (metadata, data) in contents:
+                        sibling = RiakObject(self._client, self._bucket, self._key)
+                        sibling._encode_data = self._encode_data
+                        sibling._vclock = vclock
+                        sibling._exists = True
+                        sibling.set_metadata(metadata)
+                        sibling.set_encoded_data(data)
+                        siblings.append(sibling)
+                    for sibling in siblings:
+                        sibling.set_siblings(siblings)
         else:
             raise RiakError("do not know how to handle type " + str(type(Result)))
 
+        return self
+
     def has_siblings(self):
         """
         Return True if this object has siblings.
@@ -652,7 +812,7 @@ class RiakObject(object):
         if len(siblings) > 1:
             self._siblings = siblings
         else:
-            self._siblings = []
+            self._siblings = ()
 
     def add(self, *args):
         """
@@ -702,7 +862,7 @@ class RiakObject(object):
         """
         Riakasaurus function for adding metadata
         """
-        self._metadata[MD_USERMETA][key] = data 
+        self._metadata.setdefault(MD_USERMETA, {})[key] = data
         return self
 
     def get_all_meta_data(self):
@@ -710,7 +870,7 @@ class RiakObject(object):
         Return dictionary of meta data.
         """
 
-        return self._metadata.get(MD_USERMETA, {})
+        return self._metadata.setdefault(MD_USERMETA, {})
 
     def remove_meta_data(self, data):
         """
@@ -0,0 +1,91 @@
+"""
+.. module:: stream.py
+
+ResultStream, hands the results of a streamed response (key listings,
+map/reduce phases) to a consumer while they arrive.
+
+"""
+
+from collections import deque
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+
+class ResultStream(object):
+    """
+    Delivers batches of results to consumer, in order, one at a time.
+    While a deferred returned by consumer is pending the producer (the
+    connection the response arrives on) is paused, so a slow consumer
+    holds back the server instead of piling up results in memory.
+
+    d fires with None once the response is complete and every batch has
+    been consumed, or with the first failure of the consumer or the
+    response. Batches arriving after a failure are dropped.
+    """
+
+    def __init__(self, consumer, producer=None):
+        self.consumer = consumer
+        self.producer = producer
+        self.d = defer.Deferred()
+        self._batches = deque()
+        self._busy = False
+        self._paused = False
+        self._done = False
+        self._failure = None
+
+    def deliver(self, batch):
+        """
+        A batch of results arrived.
+        """
+        if self._failure is None:
+            self._batches.append(batch)
+            self._drain()
+
+    def finish(self, ignored=None):
+        """
+        The response is complete.
+        """
+        self._done = True
+        self._drain()
+
+    def fail(self, failure):
+        """
+        The response failed, nothing more will arrive.
+        """
+        self._setFailure(failure)
+        self.finish()
+
+    def _setFailure(self, failure):
+        if self._failure is None:
+            self._failure = failure
+        self._batches.clear()
+
+    def _drain(self):
+        while self._batches and not self._busy:
+            batch = self._batches.popleft()
+            self._busy = True
+            d = defer.maybeDeferred(self.consumer, batch)
+            d.addBoth(self._consumed)
+            if self._busy:
+                # wait for the consumer before reading any further
+                self._paused = True
+                if self.producer is not None:
+                    self.producer.pauseProducing()
+                return
+
+        if self._done and not self._busy and not self.d.called:
+            if self._failure is not None:
+                self.d.errback(self._failure)
+            else:
+                self.d.callback(None)
+
+    def _consumed(self, result):
+        self._busy = False
+        if isinstance(result, Failure):
+            self._setFailure(result)
+        if self._paused:
+            self._paused = False
+            if self.producer is not None:
+                self.producer.resumeProducing()
+            self._drain()
@@ -4,31 +4,47 @@ from twisted.protocols.basic import LineReceiver
 LineReceiver.MAX_LENGTH = 1024*1024*64
 
 from twisted.internet import defer, reactor, protocol
+from twisted.internet.error import ConnectError
 from twisted.web.http_headers import Headers
 from twisted.web.iweb import IBodyProducer
 from twisted.python import log
+from twisted.python.failure import Failure
 import logging
 
 from distutils.version import StrictVersion
 
 import urllib
+import json
 import sys
 import re, csv
 import time
+from collections import deque
 from cStringIO import StringIO
 
 from xml.etree import ElementTree
 
 # MD_ resources
 from riakasaurus.metadata import *
-from twisted.web.client import Agent
+from twisted.web.client import Agent, ResponseDone
+try:
+    from twisted.web.client import HTTPConnectionPool
+except ImportError:
+    # Twisted < 12.1 has no connection pooling, fall back to a new
+    # connection per request
+    HTTPConnectionPool = None
 
 
 from riakasaurus.riak_index_entry import RiakIndexEntry
 from riakasaurus.mapreduce import RiakLink
 
 # protobuf
-from riakasaurus.tx_riak_pb import RiakPBCClient
+from riakasaurus import RiakError, RiakConflictError
+from riakasaurus.node import RiakCluster
+from riakasaurus.cache import NOT_MODIFIED
+from riakasaurus.stream import ResultStream
+from riakasaurus.pbc_decode import parse_get_response, get_response_decoder
+from riakasaurus.tx_riak_pb import RiakPBC, RiakPBCClient, RiakPBCException
+from riakasaurus.tx_riak_pb import MSG_CODE_PUT_REQ, MSG_CODE_DEL_REQ
 from riakasaurus.riak_kv_pb2 import *
 from riakasaurus.riak_pb2 import *
 
@@ -44,6 +60,46 @@ versions = {
     1.2: StrictVersion("1.2.0")
     }
 
+# capability flags, see FeatureDetection
+PHASELESS_MAPRED  = 1
+PB_INDEXES        = 2
+PB_SEARCH         = 4
+PB_CONDITIONALS   = 8
+QUORUM_CONTROLS   = 16
+TOMBSTONE_VCLOCKS = 32
+PB_HEAD           = 64
+
+# the release part of versions like 1.4.2-0-g61ac9d8 or 2.0.0pre5
+VERSION_RE = re.compile(r'\d+\.\d+(\.\d+)?')
+
+def parse_version(version):
+    """
+    StrictVersion of the leading x.y or x.y.z of a server version, None
+    if it doesn't start with one
+    """
+    m = VERSION_RE.match(version or '')
+    if m is None:
+        return None
+    return StrictVersion(m.group(0))
+
+def capabilities(version):
+    """
+    Bitmap of the capability flags of a server version, None if the
+    version can't be made sense of
+    :rtype int
+    """
+    v = parse_version(version)
+    if v is None:
+        return None
+    caps = 0
+    if v >= versions[1]:
+        caps |= PB_CONDITIONALS | QUORUM_CONTROLS | TOMBSTONE_VCLOCKS | PB_HEAD
+    if v >= versions[1.1]:
+        caps |= PHASELESS_MAPRED
+    if v >= versions[1.2]:
+        caps |= PB_INDEXES | PB_SEARCH
+    return caps
+
 
 class ITransport(Interface):
     def get_keys(self, bucket):
@@ -51,9 +107,16 @@ class ITransport(Interface):
         list keys for a given bucket
         """
 
-    def put(self, robj, w = None, dw = None, pw = None, return_body = True, if_none_match=False):
+    def stream_keys(self, bucket, consumer):
         """
-        store a riak_object
+        list keys for a given bucket, handing them to consumer as they
+        arrive
+        """
+
+    def put(self, robj, w = None, dw = None, pw = None, return_body = True, if_none_match=False, if_not_modified=False, return_head=False):
+        """
+        store a riak_object, RiakConflictError if a condition fails.
+        With return_head the result holds the vclock and metadata only.
         """
 
     def put_new(self, robj, w=None, dw=None, pw=None, return_body=True, if_none_match=False):
@@ -61,9 +124,10 @@ class ITransport(Interface):
         store a riak_object and generate a key for it
         """
 
-    def get(self, robj, r = None, pr = None, vtag = None):
+    def get(self, robj, r = None, pr = None, vtag = None, if_modified = None):
         """
-        fetch a key from the server
+        fetch a key from the server, NOT_MODIFIED if it did not change
+        since the result if_modified
         """
 
     def delete(self, robj, rw=None, r = None, w = None, dw = None, pr = None, pw = None):
@@ -71,6 +135,32 @@ class ITransport(Interface):
         delete a key from the bucket
         """
 
+    def put_many(self, robjs, w = None, dw = None, pw = None, return_body = False, concurrency = 50):
+        """
+        store many riak_objects, a (success, result) tuple per object
+        """
+
+    def delete_many(self, robjs, rw=None, r = None, w = None, dw = None, pr = None, pw = None, concurrency = 50):
+        """
+        delete many keys, a (success, result) tuple per object
+        """
+
+    def get_index(self, bucket, index, startkey, endkey=None):
+        """
+        secondary index query, returning keys
+        """
+
+    def mapred(self, inputs, query, timeout=None):
+        """
+        run a map/reduce query
+        """
+
+    def stream_mapred(self, inputs, query, consumer, timeout=None):
+        """
+        run a map/reduce query, handing (phase, results) to consumer as
+        they arrive
+        """
+
     def server_version(self):
         """
         return cached server version
@@ -102,8 +192,19 @@ class ITransport(Interface):
         get bucket properties
         """
 
+    def quit(self):
+        """
+        Close all connections held by the transport
+        """
+
 
 class FeatureDetection(object):
+    """
+    The features of a node are resolved from its server version when
+    the transport first connects to it, and again after it was out of
+    rotation. Hot paths read them synchronously with _supports(), the
+    Deferred methods are there for the first requests and for callers.
+    """
     _s_version = None
 
     def _server_version(self):
@@ -114,16 +215,50 @@ class FeatureDetection(object):
         """
         raise NotImplementedError
 
+    def _set_node_version(self, node, version):
+        if not self._s_version:
+            self._s_version = version
+        self._cluster.set_version(node, version, capabilities(version))
+
+    def _supports(self, capability):
+        """
+        Whether the nodes support capability, None if no node has been
+        resolved yet.
+        :rtype bool
+        """
+        caps = self._cluster.capabilities
+        if caps is None:
+            return None
+        return bool(caps & capability)
+
     @defer.inlineCallbacks
+    def capabilities(self):
+        """
+        Bitmap of the capability flags the nodes support
+        :rtype int
+        """
+        caps = self._cluster.capabilities
+        if caps is None:
+            yield self.server_version()
+            caps = self._cluster.capabilities
+            if caps is None:
+                caps = capabilities(self._s_version)
+            if caps is None:
+                # a version we can't read, rely on no optional feature
+                caps = 0
+        defer.returnValue(caps)
+
+    def _has(self, capability):
+        d = self.capabilities()
+        return d.addCallback(lambda caps: bool(caps & capability))
+
     def phaseless_mapred(self):
         """
         Whether MapReduce requests can be submitted without phases.
         :rtype bool
         """
-        d = yield self.server_version()
-        defer.returnValue(d >= versions[1.1])
+        return self._has(PHASELESS_MAPRED)
 
-    @defer.inlineCallbacks
     def pb_indexes(self):
         """
         Whether secondary index queries are supported over Protocol
@@ -131,63 +266,52 @@ class FeatureDetection(object):
 
         :rtype bool
         """
-        d = yield self.server_version()
-        defer.returnValue(d >= versions[1.2])
+        return self._has(PB_INDEXES)
 
-    @defer.inlineCallbacks
     def pb_search(self):
         """
         Whether search queries are supported over Protocol Buffers
         :rtype bool
         """
-        d = yield self.server_version()
-        defer.returnValue(d >= versions[1.2])
+        return self._has(PB_SEARCH)
 
-    @defer.inlineCallbacks
     def pb_conditionals(self):
         """
         Whether conditional fetch/store semantics are supported over
         Protocol Buffers
         :rtype bool
         """
-        d = yield self.server_version()
-        defer.returnValue(d >= versions[1])
+        return self._has(PB_CONDITIONALS)
 
-    @defer.inlineCallbacks
     def quorum_controls(self):
         """
         Whether additional quorums and FSM controls are available,
         e.g. primary quorums, basic_quorum, notfound_ok
         :rtype bool
         """
-        d = yield self.server_version()
-        defer.returnValue(d >= versions[1])
+        return self._has(QUORUM_CONTROLS)
 
-    @defer.inlineCallbacks
     def tombstone_vclocks(self):
         """
         Whether 'not found' responses might include vclocks
         :rtype bool
         """
-        d = yield self.server_version()
-        defer.returnValue(d >= versions[1])
+        return self._has(TOMBSTONE_VCLOCKS)
 
-    @defer.inlineCallbacks
     def pb_head(self):
         """
         Whether partial-fetches (vclock and metadata only) are
         supported over Protocol Buffers
         :rtype bool
         """
-        d = yield self.server_version()
-        defer.returnValue(d >= versions[1])
+        return self._has(PB_HEAD)
 
     @defer.inlineCallbacks
     def server_version(self):
         if not self._s_version:
             self._s_version = yield self._server_version()
 
-        defer.returnValue(StrictVersion(self._s_version))
+        defer.returnValue(parse_version(self._s_version))
 
 class BodyReceiver(protocol.Protocol):
     """ Simple buffering consumer for body objects """
@@ -202,6 +326,179 @@ class BodyReceiver(protocol.Protocol):
         self.buffer.seek(0)
         self.finished.callback(self.buffer)
 
+class KeyStreamReceiver(protocol.Protocol):
+    """
+    Parses the {"keys": [...]} JSON objects of a keys=stream response
+    as they arrive and hands their keys to a ResultStream
+
+    Only the new data is scanned for where an object ends, an object
+    is decoded once it is complete, however many reads it spans.
+    """
+    TOKEN = re.compile(r'[{}"]')
+    STRING_TOKEN = re.compile(r'["\\]')
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.pending = []       # data of the object not complete yet
+        self.depth = 0          # of the {} nesting
+        self.in_string = False
+        self.escaped = False    # the last read ended in a string's backslash
+        self.failed = False     # the rest of the response is ignored
+
+    def connectionMade(self):
+        self.stream.producer = self.transport
+
+    def dataReceived(self, data):
+        if self.failed:
+            return
+        start = 0               # where the pending object goes on in data
+        pos = 0
+        if self.escaped and data:
+            pos = 1
+            self.escaped = False
+        while True:
+            if self.in_string:
+                m = self.STRING_TOKEN.search(data, pos)
+                if m is None:
+                    break
+                pos = m.end()
+                if m.group() == '\\':
+                    if pos == len(data):
+                        self.escaped = True
+                        break
+                    pos += 1
+                else:
+                    self.in_string = False
+                continue
+
+            m = self.TOKEN.search(data, pos)
+            if m is None:
+                break
+            pos = m.end()
+            token = m.group()
+            if token == '"':
+                self.in_string = True
+            elif token == '{':
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth <= 0:
+                    self.pending.append(data[start:pos])
+                    start = pos
+                    self.pending, text = [], ''.join(self.pending)
+                    self.depth = 0
+                    self.objectReceived(text)
+                    if self.failed:
+                        return
+        if start < len(data):
+            self.pending.append(data[start:])
+
+    def objectReceived(self, text):
+        try:
+            obj = json.loads(text)
+        except ValueError:
+            self.failed = True
+            self.stream.fail(Failure())
+            self.transport.stopProducing()
+            return
+        if obj.get('keys'):
+            self.stream.deliver(obj['keys'])
+
+    def connectionLost(self, reason):
+        rest = ''.join(self.pending).strip()
+        if not reason.check(ResponseDone):
+            self.stream.fail(reason)
+        elif rest:
+            self.stream.fail(Failure(RiakError(
+                'incomplete key stream, %r left over' % rest[:100])))
+        else:
+            self.stream.finish()
+
+class MultipartParser(object):
+    """
+    Incremental multipart/mixed parser, calls on_part(headers, body) for
+    every part as soon as it is complete. Header names are lowercased.
+    """
+    def __init__(self, boundary, on_part):
+        self.delimiter = '\r\n--' + boundary
+        self.on_part = on_part
+        self.buffer = '\r\n'       # the first delimiter has no CRLF before it
+        self.scanned = 0
+        self.started = False
+        self.done = False
+
+    def feed(self, data):
+        self.buffer += data
+        while not self.done:
+            i = self.buffer.find(self.delimiter, self.scanned)
+            end = i + len(self.delimiter)
+            if i < 0 or len(self.buffer) < end + 2:
+                # resume the search where a delimiter could start
+                self.scanned = max(0, len(self.buffer) - len(self.delimiter) - 2)
+                break
+            if self.started:
+                self.part(self.buffer[:i])
+            self.started = True
+            if self.buffer[end:end + 2] == '--':
+                self.done = True
+                self.buffer = ''
+            else:
+                self.buffer = self.buffer[end:]
+            self.scanned = 0
+
+    def part(self, data):
+        # strip the rest of the delimiter line
+        data = data[data.find('\r\n') + 2:]
+        if data.startswith('\r\n'):
+            head, body = '', data[2:]
+        else:
+            head, _, body = data.partition('\r\n\r\n')
+        headers = {}
+        for line in head.split('\r\n'):
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        self.on_part(headers, body)
+
+    @staticmethod
+    def boundary(content_type):
+        """
+        The boundary parameter of a multipart content type, or None
+        """
+        m = re.search(r'boundary="?([^";]+)"?', content_type or '')
+        return m and m.group(1)
+
+class MultipartStreamReceiver(protocol.Protocol):
+    """
+    Parses a multipart/mixed response body as it arrives and hands
+    convert(headers, body) of every part to a ResultStream
+    """
+    def __init__(self, stream, boundary, convert):
+        self.stream = stream
+        self.convert = convert
+        self.parser = MultipartParser(boundary, self.partReceived)
+
+    def connectionMade(self):
+        self.stream.producer = self.transport
+
+    def dataReceived(self, data):
+        self.parser.feed(data)
+
+    def partReceived(self, headers, body):
+        try:
+            batch = self.convert(headers, body)
+        except Exception:
+            self.stream.fail(Failure())
+            self.transport.stopProducing()
+        else:
+            self.stream.deliver(batch)
+
+    def connectionLost(self, reason):
+        if reason.check(ResponseDone):
+            self.stream.finish()
+        else:
+            self.stream.fail(reason)
+
 class StringProducer(object):
     """
     Body producer for t.w.c.Agent
@@ -227,6 +524,11 @@ class HTTPTransport(FeatureDetection):
     implements(ITransport)
 
     """ HTTP Transport for Riak """
+
+    MAX_PERSISTENT_PER_HOST   = 10
+    CACHED_CONNECTION_TIMEOUT = 240     # in seconds
+    RETRY_AUTOMATICALLY       = True
+
     def __init__(self, client, prefix=None):
         if prefix:
             self._prefix = prefix
@@ -237,6 +539,48 @@ class HTTPTransport(FeatureDetection):
         self.client = client
         self._client_id = None
 
+        # other transports of the same client (ie. solr) share the
+        # persistent connections and node states of the main transport
+        shared = getattr(client, 'transport', None)
+        if isinstance(shared, HTTPTransport):
+            self._pool = shared._pool
+            self._cluster = shared._cluster
+        else:
+            self._pool = self._create_pool(client)
+            self._cluster = RiakCluster(client.get_nodes(), self._ping_node)
+        self._agent = Agent(reactor, pool=self._pool) if self._pool else None
+        self._resolving = set()     # nodes whose version is being fetched
+
+    def _create_pool(self, client):
+        """
+        Create the persistent connection pool used for every request
+        made through this transport.
+        """
+        if HTTPConnectionPool is None:
+            return None
+
+        pool = HTTPConnectionPool(reactor, persistent=True)
+        pool.maxPersistentPerHost = self.MAX_PERSISTENT_PER_HOST
+        pool.cachedConnectionTimeout = self.CACHED_CONNECTION_TIMEOUT
+        pool.retryAutomatically = self.RETRY_AUTOMATICALLY
+
+        if getattr(client, '_pool_size', None) is not None:
+            pool.maxPersistentPerHost = client._pool_size
+        if getattr(client, '_pool_idle_timeout', None) is not None:
+            pool.cachedConnectionTimeout = client._pool_idle_timeout
+        if getattr(client, '_pool_retry', None) is not None:
+            pool.retryAutomatically = client._pool_retry
+        return pool
+
+    def quit(self):
+        """
+        Close all cached persistent connections.
+        """
+        self._cluster.stop()
+        if self._pool is None:
+            return defer.succeed(None)
+        return self._pool.closeCachedConnections()
+
     def http_response(self, response):
         def haveBody(body):
             headers = {"http_code": response.code}
@@ -252,9 +596,17 @@ class HTTPTransport(FeatureDetection):
         else:
             return haveBody(StringIO(""))
 
-    def http_request(self, method, path, headers={}, body=None):
-        url = "http://%s:%s%s" % (self.host, self.port, path)
+    def http_request(self, method, path, headers={}, body=None, node=None,
+                     receiver=None):
+        """
+        Send a request to a node of the cluster, the least busy one
+        unless node is given. Requests that could not be sent because
+        the node refused the connection are retried on the other nodes.
 
+        The response body is buffered and returned with the headers,
+        unless a receiver function is given: it is called with the
+        response instead and its result is returned.
+        """
         h = {}
         for k, v in headers.items():
             if not isinstance(v, list):
@@ -270,9 +622,66 @@ class HTTPTransport(FeatureDetection):
         else:
             bodyProducer = None
 
-        return Agent(reactor).request(
-                method, str(url), Headers(h), bodyProducer
-            ).addCallback(self.http_response)
+        if node is not None:
+            return self._node_request(node, method, path, h, bodyProducer,
+                                      receiver)
+
+        tried = []
+        def retry(failure, node):
+            tried.append(node)
+            if failure.check(ConnectError) and \
+                    len(tried) < len(self._cluster.nodes):
+                return send()
+            return failure
+
+        def send():
+            node = self._cluster.pick(exclude=tried)
+            d = self._node_request(node, method, path, h, bodyProducer,
+                                   receiver)
+            return d.addErrback(retry, node)
+
+        return send()
+
+    def _node_request(self, node, method, path, headers, bodyProducer,
+                      receiver=None):
+        if node.capabilities is None and node not in self._resolving:
+            self._resolve_node(node)
+
+        url = "http://%s:%s%s" % (node.host, node.port, path)
+        agent = self._agent or Agent(reactor)
+        started = time.time()
+        node.start()
+
+        def done(response):
+            node.finish(time.time() - started)
+            self._cluster.succeeded(node)
+            return response
+
+        def failed(failure):
+            node.finish()
+            if self._cluster.is_node_error(failure):
+                self._cluster.failed(node)
+            return failure
+
+        return agent.request(
+                method, str(url), Headers(headers), bodyProducer
+            ).addCallback(receiver or self.http_response
+            ).addCallbacks(done, failed)
+
+    @defer.inlineCallbacks
+    def _ping_node(self, node):
+        response = yield self.http_request('GET', '/ping', node=node)
+        defer.returnValue(response[1] == 'OK')
+
+    def _resolve_node(self, node):
+        """
+        Fetch the version of node in the background, on the first request
+        sent to it. Agent does not tell when it connects.
+        """
+        self._resolving.add(node)
+        d = self._node_server_version(node)
+        d.addErrback(lambda failure: None)      # retried on the next request
+        d.addBoth(lambda ignored: self._resolving.discard(node))
 
     def build_rest_path(self, bucket=None, key=None, params=None, prefix=None) :
         """
@@ -324,6 +733,25 @@ class HTTPTransport(FeatureDetection):
 
         defer.returnValue(props['keys'])
 
+    def stream_keys(self, bucket, consumer):
+        """
+        List the keys of a bucket with keys=stream, handing each chunk of
+        keys to consumer as it arrives. While a deferred returned by
+        consumer is pending no more of the response is read.
+        """
+        params = {'props' : 'false', 'keys' : 'stream'}
+        url = self.build_rest_path(bucket, params=params)
+
+        def receive(response):
+            if response.code != 200:
+                d = self.http_response(response)
+                return d.addCallback(self.check_http_code, [200])
+            stream = ResultStream(consumer)
+            response.deliverBody(KeyStreamReceiver(stream))
+            return stream.d
+
+        return self.http_request('GET', url, receiver=receive)
+
     @defer.inlineCallbacks
     def set_bucket_props(self, bucket, props):
         """
@@ -364,47 +792,57 @@ class HTTPTransport(FeatureDetection):
         defer.returnValue(res)
 
     @defer.inlineCallbacks
-    def stats(self):
+    def stats(self, node=None):
         """
         Gets performance statistics and server information
         """
         # TODO: use resource detection
-        response = yield self.http_request('GET', '/stats', {'Accept':'application/json'})
+        response = yield self.http_request('GET', '/stats', {'Accept':'application/json'},
+                                           node=node)
         if response[0]['http_code'] is 200:
             defer.returnValue(self.decodeJson(response[1]))
         else:
             defer.returnValue(None)
 
     # FeatureDetection API - private
-    @defer.inlineCallbacks
     def _server_version(self):
-        stats = yield self.stats()
+        return self._node_server_version(self._cluster.pick())
+
+    @defer.inlineCallbacks
+    def _node_server_version(self, node):
+        stats = yield self.stats(node)
         if stats is not None:
-            defer.returnValue(stats['riak_kv_version'])
+            version = stats['riak_kv_version']
         # If stats is disabled, we can't assume the Riak version
         # is >= 1.1. However, we can assume the new URL scheme is
         # at least version 1.0
-        elif 'riak_kv_wm_buckets' in (yield self.get_resources()):
-            defer.returnValue("1.0.0")
+        elif 'riak_kv_wm_buckets' in (yield self.get_resources(node)):
+            version = "1.0.0"
         else:
-            defer.returnValue("0.14.0")
+            version = "0.14.0"
+        self._set_node_version(node, version)
+        defer.returnValue(version)
 
     @defer.inlineCallbacks
-    def get_resources(self):
+    def get_resources(self, node=None):
         """
         Gets a JSON mapping of server-side resource names to paths
         :rtype dict
         """
-        response = yield self.http_request('GET', '/', {'Accept':'application/json'})
+        response = yield self.http_request('GET', '/', {'Accept':'application/json'},
+                                           node=node)
         if response[0]['http_code'] is 200:
             defer.returnValue(self.decodeJson(response[1]))
         else:
             defer.returnValue({})
 
     @defer.inlineCallbacks
-    def get(self, robj, r = None, pr = None, vtag = None) :
+    def get(self, robj, r = None, pr = None, vtag = None, if_modified = None) :
         """
         Get a bucket/key from the server
+
+        if_modified is a previous result of get(), NOT_MODIFIED is
+        returned if its ETag still matches
         """
         # We could detect quorum_controls here but HTTP ignores
         # unknown flags/params.
@@ -413,7 +851,16 @@ class HTTPTransport(FeatureDetection):
             params['vtag'] = vtag
         url = self.build_rest_path(robj.get_bucket(), robj.get_key(),
                                    params=params)
-        response = yield self.http_request('GET', url)
+        # siblings come back in one multipart/mixed response rather
+        # than as a list of vtags to fetch one by one
+        headers = {'Accept': 'multipart/mixed, */*;q=0.5'}
+        if if_modified is not None and len(if_modified[1]) == 1:
+            etag = if_modified[1][0][0].get(MD_VTAG)
+            if etag:
+                headers['If-None-Match'] = etag
+        response = yield self.http_request('GET', url, headers)
+        if response[0]['http_code'] == 304:
+            defer.returnValue(NOT_MODIFIED)
         defer.returnValue(
             self.parse_body(response, [200, 300, 404])
         )
@@ -436,10 +883,16 @@ class HTTPTransport(FeatureDetection):
         )
 
 
-    def put(self, robj, w = None, dw = None, pw = None, return_body = True, if_none_match=False):
+    def put(self, robj, w = None, dw = None, pw = None, return_body = True, if_none_match=False, if_not_modified=False, return_head=False):
         """
         Serialize put request and deserialize response
+
+        Riak only sends the vclock back with the body, so return_head
+        asks for the body too. A HEAD request after the write could
+        answer with the vclock of a later write.
         """
+        if return_head:
+            return_body = True
         # We could detect quorum_controls here but HTTP ignores
         # unknown flags/params.
         params = {'returnbody' : str(return_body).lower(), 'w' : w, 'dw' : dw, 'pw' : pw }
@@ -451,7 +904,17 @@ class HTTPTransport(FeatureDetection):
         # which is a superset of the if_none_match semantics.
         if if_none_match:
             headers["If-None-Match"] = "*"
-        content = robj.get_encoded_data()
+        if if_not_modified:
+            vtag = robj.get_metadata().get(MD_VTAG)
+            if not vtag:
+                # an unconditional write is not what was asked for
+                return defer.fail(RiakError(
+                    'if_not_modified needs the ETag the object was read '
+                    'with over HTTP, %r has none' % robj.get_key()))
+            headers["If-Match"] = vtag
+        content, encoding = robj.get_stored_data()
+        if encoding:
+            headers['Content-Encoding'] = encoding
         return self.do_put(url, headers, content, return_body, key=robj.get_key())
 
     @defer.inlineCallbacks
@@ -461,6 +924,8 @@ class HTTPTransport(FeatureDetection):
         else:
             response = yield self.http_request('PUT', url, headers, content)
 
+        if response[0]['http_code'] == 412:
+            raise RiakConflictError(response[1])
         if return_body:
             defer.returnValue(self.parse_body(response, [200, 201, 300]))
         else:
@@ -479,7 +944,9 @@ class HTTPTransport(FeatureDetection):
         # which is a superset of the if_none_match semantics.
         if if_none_match:
             headers["If-None-Match"] = "*"
-        content = robj.get_encoded_data()
+        content, encoding = robj.get_stored_data()
+        if encoding:
+            headers['Content-Encoding'] = encoding
         response = yield self.http_request('POST', url, headers, content)
         location = response[0]['location']
         idx = location.rindex('/')
@@ -502,13 +969,41 @@ class HTTPTransport(FeatureDetection):
         headers = {}
         url = self.build_rest_path(robj.get_bucket(), robj.get_key(),
                                    params=params)
-        ts = yield self.tombstone_vclocks()
+        ts = self._supports(TOMBSTONE_VCLOCKS)
+        if ts is None:
+            ts = yield self.tombstone_vclocks()
         if ts and robj.vclock() is not None:
             headers['X-Riak-Vclock'] = robj.vclock()
         response = yield self.http_request('DELETE', url, headers)
         self.check_http_code(response, [204, 404])
         defer.returnValue(self)
 
+    def put_many(self, robjs, w = None, dw = None, pw = None, return_body = False, concurrency = 50):
+        """
+        Store many objects that already have a key, with no more than
+        concurrency requests in flight.
+
+        :returns: list of (success, result or Failure) tuples in the order
+         of robjs, result as returned by put() -- via deferred
+        """
+        sem = defer.DeferredSemaphore(concurrency)
+        ds = [sem.run(self.put, robj, w=w, dw=dw, pw=pw, return_body=return_body)
+              for robj in robjs]
+        return defer.DeferredList(ds, consumeErrors=True)
+
+    def delete_many(self, robjs, rw=None, r = None, w = None, dw = None, pr = None, pw = None, concurrency = 50):
+        """
+        Delete many objects, with no more than concurrency requests in
+        flight.
+
+        :returns: list of (success, result or Failure) tuples in the order
+         of robjs -- via deferred
+        """
+        sem = defer.DeferredSemaphore(concurrency)
+        ds = [sem.run(self.delete, robj, rw=rw, r=r, w=w, dw=dw, pr=pr, pw=pw)
+              for robj in robjs]
+        return defer.DeferredList(ds, consumeErrors=True)
+
     @defer.inlineCallbacks
     def get_buckets(self):
         """
@@ -549,9 +1044,12 @@ class HTTPTransport(FeatureDetection):
         """
         Run a MapReduce query.
         """
-        plm = yield self.phaseless_mapred()
-        if not plm and (query is None or len(query) is 0):
-            raise Exception('Phase-less MapReduce is not supported by this Riak node')
+        if query is None or len(query) is 0:
+            plm = self._supports(PHASELESS_MAPRED)
+            if plm is None:
+                plm = yield self.phaseless_mapred()
+            if not plm:
+                raise Exception('Phase-less MapReduce is not supported by this Riak node')
 
         # Construct the job, optionally set the timeout...
         job = {'inputs':inputs, 'query':query}
@@ -574,6 +1072,39 @@ class HTTPTransport(FeatureDetection):
         result = self.decodeJson(response[1])
         defer.returnValue(result)
 
+    def stream_mapred(self, inputs, query, consumer, timeout=None):
+        """
+        Run a MapReduce query with chunked=true, handing a (phase,
+        results) tuple to consumer for every part of the multipart
+        response as it arrives.
+        """
+        job = {'inputs':inputs, 'query':query}
+        if timeout is not None:
+            job['timeout'] = timeout
+
+        content = self.encodeJson(job)
+        url = "/" + self.client._mapred_prefix + "?chunked=true"
+        headers = {'Content-Type': 'application/json'}
+
+        def receive(response):
+            if response.code != 200:
+                d = self.http_response(response)
+                return d.addCallback(self.check_http_code, [200])
+            content_type = response.headers.getRawHeaders('content-type', [''])[0]
+            stream = ResultStream(consumer)
+            response.deliverBody(MultipartStreamReceiver(
+                    stream, MultipartParser.boundary(content_type),
+                    self._mapred_chunk))
+            return stream.d
+
+        return self.http_request('POST', url, headers, content, receiver=receive)
+
+    def _mapred_chunk(self, headers, body):
+        chunk = self.decodeJson(body)
+        if 'error' in chunk:
+            raise RiakError(chunk['error'])
+        return chunk.get('phase', 0), chunk.get('data', [])
+
     @defer.inlineCallbacks
     def get_index(self, bucket, index, startkey, endkey=None):
         """
@@ -581,9 +1112,9 @@ class HTTPTransport(FeatureDetection):
         """
         # TODO: use resource detection
         segments = ["buckets", bucket, "index", index, str(startkey)]
-        if endkey:
+        if endkey is not None:
             segments.append(str(endkey))
-        uri = '/%s' % ('/'.join(segments))
+        uri = '/'.join(segments)
         headers, data = response = yield self.get_request(uri)
         self.check_http_code(response, [200])
         jsonData = self.decodeJson(data)
@@ -651,16 +1182,28 @@ class HTTPTransport(FeatureDetection):
         if status == 404:
             return None
 
-        # If 300(Siblings), then return the list of siblings
+        # If 300(Siblings), then return the siblings
         elif status == 300:
+            boundary = MultipartParser.boundary(headers.get('content-type'))
+            if boundary is not None:
+                contents = []
+                parser = MultipartParser(boundary, lambda part_headers, body:
+                    contents.append((self.parse_metadata(part_headers), body)))
+                parser.feed(data)
+                return headers.get('x-riak-vclock'), contents
+
             # Parse and get rid of 'Siblings:' string in element 0
             siblings = data.strip().split('\n')
             siblings.pop(0)
             return siblings
 
-        # Parse the headers...
-        vclock = None
-        metadata = {MD_USERMETA: {}, MD_INDEX: []}
+        return headers.get('x-riak-vclock'), [(self.parse_metadata(headers), data)]
+
+    def parse_metadata(self, headers):
+        """
+        Get the metadata of an object (or a sibling) from its headers.
+        """
+        metadata = {}
         links = []
         for header, value in headers.iteritems():
             if header == 'content-type':
@@ -676,22 +1219,20 @@ class HTTPTransport(FeatureDetection):
             elif header == 'last-modified':
                 metadata[MD_LASTMOD] = value
             elif header.startswith('x-riak-meta-'):
-                metadata[MD_USERMETA][header.replace('x-riak-meta-', '')] = value
+                metadata.setdefault(MD_USERMETA, {})[header.replace('x-riak-meta-', '')] = value
             elif header.startswith('x-riak-index-'):
                 field = header.replace('x-riak-index-', '')
                 reader = csv.reader([value], skipinitialspace=True)
                 for line in reader:
                     for token in line:
                         rie = RiakIndexEntry(field, token)
-                        metadata[MD_INDEX].append(rie)
-            elif header == 'x-riak-vclock':
-                vclock = value
+                        metadata.setdefault(MD_INDEX, []).append(rie)
             elif header == 'x-riak-deleted':
                 metadata[MD_DELETED] = True
         if links:
             metadata[MD_LINKS] = links
 
-        return vclock, [(metadata, data)]
+        return metadata
 
     def to_link_header(self, link):
         """
@@ -933,36 +1474,295 @@ class XMLSearchResult(object):
 
 class StatefulTransport(object):
 
-    def __init__(self,transport):
+    def __init__(self,transport, pool=None):
         self.__transport = transport
-        self.__state = 'idle'
+        self.__pool = pool
+        self.__requests = deque()   # start times of the pipelined requests
+        self.__exclusive = False
         self.__created = time.time()
         self.__used = time.time()
 
     def __repr__(self):
-        return '<StatefulTransport idle=%.2fs state=\'%s\' transport=%s>' % (time.time() - self.__used, self.__state, self.__transport)
+        return '<StatefulTransport idle=%.2fs state=\'%s\' requests=%d transport=%s>' % (time.time() - self.__used, self.state(), len(self.__requests), self.__transport)
+
+    def state(self):
+        if self.__exclusive:
+            return 'exclusive'
+        elif self.__requests:
+            return 'active'
+        return 'idle'
 
     def isActive(self):
-        return self.__state == 'active'
+        return len(self.__requests) > 0
 
-    def setActive(self):
-        self.__state = 'active'
+    def setActive(self, exclusive=False):
         self.__used = time.time()
+        self.__requests.append(self.__used)
+        self.__exclusive = exclusive
 
     def isIdle(self):
-        return self.__state == 'idle'
+        return not self.__requests
 
     def setIdle(self):
-        self.__state = 'idle'
+        """
+        mark the oldest request as done and return how long it took,
+        pipelined requests are answered in the order they were sent
+        """
+        self.__exclusive = False
         self.__used = time.time()
+        if self.__requests:
+            return self.__used - self.__requests.popleft()
+
+    def isExclusive(self):
+        return self.__exclusive
+
+    def load(self):
+        return len(self.__requests)
 
     def getTransport(self):
         return self.__transport
 
+    def getPool(self):
+        return self.__pool
+
     def age(self):
         return time.time() - self.__used
 
 
+class PBCConnectionPool(object):
+    """
+    Bounded pool of RiakPBC connections to one riak node.
+
+    Connections that can take another pipelined request are kept in a
+    free list, so checking one out is O(1). When every connection is
+    saturated and the pool is full, acquire() queues a Deferred that is
+    served in FIFO order as soon as a connection is released, or fails
+    after acquire_timeout seconds.
+    """
+
+    debug = 0
+    logToLevel = logging.INFO
+    connector = RiakPBCClient
+
+    def __init__(self, host, port, max_connections=50, pipeline_depth=8,
+                 min_idle=0, acquire_timeout=None, timeout=None, node=None,
+                 on_connect=None):
+        """
+        :param on_connect: function called with the node and every new
+         connection, returning a deferred that fires when the connection
+         can be used
+        """
+        self.host = host
+        self.port = port
+        self.node = node
+        self.on_connect = on_connect
+        self.max_connections = max_connections
+        self.pipeline_depth = pipeline_depth
+        self.min_idle = min_idle
+        self.acquire_timeout = acquire_timeout
+        self.timeout = timeout
+
+        self._transports = []       # every open connection
+        self._free = deque()        # connections with pipeline capacity
+        self._waiters = deque()     # (deferred, exclusive, timeout call)
+        self._connecting = 0
+
+    def __repr__(self):
+        return '<PBCConnectionPool %s:%s connections=%d free=%d waiters=%d>' % (
+            self.host, self.port, len(self._transports), len(self._free),
+            len(self._waiters))
+
+    def size(self):
+        return len(self._transports) + self._connecting
+
+    def _usable(self, stp):
+        return stp.getTransport().connected
+
+    def _hasCapacity(self, stp):
+        return not stp.isExclusive() and stp.load() < self.pipeline_depth
+
+    def _discard(self, stp):
+        if stp in self._transports:
+            self._transports.remove(stp)
+        if stp in self._free:
+            self._free.remove(stp)
+
+    def _checkout(self, stp, exclusive):
+        stp.setActive(exclusive)
+        if self.debug & LOGLEVEL_TRANSPORT_VERBOSE:
+            log.msg("[%s] aquired transport: %s" % (self.__class__.__name__, stp), logLevel = self.logToLevel)
+        return stp
+
+    def _checkoutFree(self, stp, exclusive):
+        self._checkout(stp, exclusive)
+        # round robin: a connection that still has capacity goes to the
+        # back of the free list
+        if self._hasCapacity(stp):
+            self._free.append(stp)
+        return stp
+
+    def _popFree(self, exclusive):
+        """
+        Take a usable connection from the free list, or None
+        """
+        if exclusive:
+            # streaming responses need a connection nobody else is using
+            for stp in list(self._free):
+                if not self._usable(stp):
+                    self._discard(stp)
+                elif stp.isIdle():
+                    self._free.remove(stp)
+                    return stp
+            return None
+
+        while self._free:
+            stp = self._free.popleft()
+            if self._usable(stp):
+                return stp
+            self._discard(stp)
+        return None
+
+    def acquire(self, exclusive=False):
+        """
+        Get a connection to send a request on.
+
+        :param exclusive: the connection must not be shared with other
+         requests, ie. for streaming responses
+        :returns: StatefulTransport -- via deferred
+        """
+        stp = self._popFree(exclusive)
+        if stp is not None:
+            return defer.succeed(self._checkoutFree(stp, exclusive))
+
+        if self.size() < self.max_connections:
+            return self._connect().addCallback(self._checkoutFree, exclusive)
+
+        d = defer.Deferred()
+        waiter = [d, exclusive, None]
+        if self.acquire_timeout:
+            waiter[2] = reactor.callLater(self.acquire_timeout,
+                                          self._waiterTimeout, waiter)
+        self._waiters.append(waiter)
+        return d
+
+    def _waiterTimeout(self, waiter):
+        self._waiters.remove(waiter)
+        waiter[0].errback(RiakError(
+            'timeout waiting for a connection to %s:%s' % (self.host, self.port)))
+
+    def _connect(self):
+        self._connecting += 1
+
+        def connected(transport):
+            self._connecting -= 1
+            if self.timeout:
+                transport.setTimeout(self.timeout)
+            stp = StatefulTransport(transport, self)
+            self._transports.append(stp)
+            if self.debug & LOGLEVEL_TRANSPORT:
+                log.msg("[%s] allocate new transport[%d]: %s" % (self.__class__.__name__, len(self._transports),stp), logLevel = self.logToLevel)
+            return stp
+
+        def failed(reason):
+            self._connecting -= 1
+            return reason
+
+        def setup(transport):
+            d = self.on_connect(self.node, transport)
+            return d.addCallback(lambda ignored: transport)
+
+        d = self.connector().connect(self.host, self.port)
+        if self.on_connect is not None:
+            d.addCallback(setup)
+        return d.addCallbacks(connected, failed)
+
+    def release(self, stp):
+        """
+        Hand a connection back after a request finished on it. Queued
+        waiters are served first.
+
+        :returns: how long the request took, None if the connection
+         was lost
+        """
+        # a connection is on the free list as long as it has capacity
+        queued = self._hasCapacity(stp)
+        latency = stp.setIdle()
+
+        if not self._usable(stp):
+            self._discard(stp)
+            # the pool has room for a new connection now
+            self._serveWaitersWithNewConnection()
+            return None
+
+        served = []
+        while self._waiters and self._hasCapacity(stp):
+            d, exclusive, timeoutCall = self._waiters[0]
+            if exclusive and not stp.isIdle():
+                break
+            self._waiters.popleft()
+            if timeoutCall is not None and timeoutCall.active():
+                timeoutCall.cancel()
+            self._checkout(stp, exclusive)
+            served.append(d)
+
+        if queued and not self._hasCapacity(stp):
+            self._free.remove(stp)
+        elif not queued and self._hasCapacity(stp):
+            self._free.append(stp)
+
+        for d in served:
+            d.callback(stp)
+        return latency
+
+    def _serveWaitersWithNewConnection(self):
+        if not self._waiters or self.size() >= self.max_connections:
+            return
+        d, exclusive, timeoutCall = self._waiters.popleft()
+        if timeoutCall is not None and timeoutCall.active():
+            timeoutCall.cancel()
+        self._connect().addCallback(self._checkoutFree, exclusive).chainDeferred(d)
+
+    def warm(self):
+        """
+        Open connections until min_idle connections are available.
+        """
+        ds = []
+        while self.size() < min(self.min_idle, self.max_connections):
+            d = self._connect()
+            d.addCallback(self._free.append)
+            ds.append(d)
+        return defer.DeferredList(ds, consumeErrors=True)
+
+    @defer.inlineCallbacks
+    def garbageCollect(self, max_idletime):
+        """
+        Close connections that have been idle for more than max_idletime
+        seconds, keeping min_idle of them open.
+        """
+        for stp in list(self._transports):
+            if not self._usable(stp):
+                self._discard(stp)
+            elif stp.isIdle() and stp.age() > max_idletime and \
+                    len(self._transports) > self.min_idle:
+                self._discard(stp)
+                if self.debug & LOGLEVEL_TRANSPORT:
+                    log.msg("[%s] expire idle transport %s" % (self.__class__.__name__, stp), logLevel = self.logToLevel)
+                yield stp.getTransport().quit()
+
+    @defer.inlineCallbacks
+    def quit(self):
+        for waiter in self._waiters:
+            if waiter[2] is not None and waiter[2].active():
+                waiter[2].cancel()
+        self._waiters.clear()
+        transports, self._transports = self._transports, []
+        self._free.clear()
+        for stp in transports:
+            if self.debug & LOGLEVEL_DEBUG:
+                log.msg("[%s] transport.quit() %s" % (self.__class__.__name__, stp), logLevel = self.logToLevel)
+            yield stp.getTransport().quit()
+
+
 class PBCTransport(FeatureDetection):
     """ Protocoll buffer transport for Riak """
 
@@ -971,6 +1771,10 @@ class PBCTransport(FeatureDetection):
     debug = 0
     logToLevel = logging.INFO
     MAX_TRANSPORTS = 50
+    MIN_IDLE       = 0          # connections opened on startup
+    PIPELINE_DEPTH = 8          # requests in flight on one connection
+    BATCH_SIZE     = 10         # requests put_many/delete_many write at once
+    ACQUIRE_TIMEOUT = 30        # seconds to wait for a free connection
     MAX_IDLETIME   = 5*60     # in seconds
     GC_TIME        = 120        # how often (in seconds) the garbage collection should run
     timeout        = None
@@ -981,73 +1785,119 @@ class PBCTransport(FeatureDetection):
         self.port = client._port
         self.client = client
         self._client_id = None
-        self._transports = []    # list of transports, empty on start
+
+        max_connections = self.MAX_TRANSPORTS
+        if getattr(client, '_pool_size', None) is not None:
+            max_connections = client._pool_size
+        if getattr(client, '_pool_idle_timeout', None) is not None:
+            self.MAX_IDLETIME = client._pool_idle_timeout
+
+        # one connection pool per node
+        self._cluster = RiakCluster(client.get_nodes(), self._ping_node)
+        self._pools = {}
+        for node in self._cluster.nodes:
+            pool = PBCConnectionPool(node.host, node.port,
+                                     max_connections=max_connections,
+                                     pipeline_depth=self.PIPELINE_DEPTH,
+                                     min_idle=self.MIN_IDLE,
+                                     acquire_timeout=self.ACQUIRE_TIMEOUT,
+                                     timeout=self.timeout,
+                                     node=node,
+                                     on_connect=self._connected)
+            pool.debug = self.debug
+            pool.warm()
+            self._pools[node] = pool
         self._gc = reactor.callLater(self.GC_TIME, self._garbageCollect)
 
     def setTimeout(self,t):
         self.timeout = t
+        for pool in self._pools.values():
+            pool.timeout = t
 
     @defer.inlineCallbacks
-    def _getFreeTransport(self):
-        foundOne = False
-        for stp in self._transports:
-            if stp.isIdle():
-                stp.setActive()
-                foundOne = True
-                if self.debug & LOGLEVEL_TRANSPORT_VERBOSE:
-                    log.msg("[%s] aquired idle transport[%d]: %s" % (self.__class__.__name__, len(self._transports),stp), logLevel = self.logToLevel)
+    def _getFreeTransport(self, exclusive=False):
+        """
+        Get a connection to send a request on, from the node with the
+        fewest outstanding requests. Requests are pipelined onto
+        connections that are already busy before new ones are opened.
+        Has to be handed back with _releaseTransport().
+
+        Exclusive requests (streaming responses) always get a connection
+        of their own.
+        """
+        tried = []
+        while True:
+            node = self._cluster.pick(exclude=tried)
+            try:
+                stp = yield self._pools[node].acquire(exclusive)
+            except ConnectError:
+                self._cluster.failed(node)
+                tried.append(node)
+                if len(tried) >= len(self._cluster.nodes):
+                    raise
+            else:
+                node.start()
                 defer.returnValue(stp)
-        if not foundOne:
-            if len(self._transports) > self.MAX_TRANSPORTS:
-                raise Exception("to many transports, aborting")
 
-            # nothin free, create a new protocol instance, append
-            # it to self._transports and return it
-            transport = yield RiakPBCClient().connect(self.host, self.port)
-            if self.timeout:
-                transport.setTimeout(self.timeout)
-            stp = StatefulTransport(transport)
-            idx = len(self._transports)
-            self._transports.append(stp)
-            stp.setActive()
-            if self.debug & LOGLEVEL_TRANSPORT:
-                log.msg("[%s] allocate new transport[%d]: %s" % (self.__class__.__name__, len(self._transports),stp), logLevel = self.logToLevel)
-            defer.returnValue(stp)
+    def _releaseTransport(self, stp):
+        pool = stp.getPool()
+        latency = pool.release(stp)
+        pool.node.finish(latency)
+        if latency is None:
+            self._cluster.failed(pool.node)
+        else:
+            self._cluster.succeeded(pool.node)
+
+    def _connected(self, node, transport):
+        """
+        Resolve the version of node on the first connection to it, and
+        on the first one after it was out of rotation.
+        """
+        if node.capabilities is not None:
+            return defer.succeed(None)
+
+        def resolved(info):
+            self._set_node_version(node, info.server_version)
+
+        # a node that can't tell is asked again on the next connection
+        return transport.getServerInfo().addCallbacks(resolved,
+                                                      lambda failure: None)
+
+    @defer.inlineCallbacks
+    def _ping_node(self, node):
+        pool = self._pools[node]
+        stp = yield pool.acquire()
+        try:
+            ret = yield stp.getTransport().ping()
+        finally:
+            pool.release(stp)
+        defer.returnValue(ret == True)
 
     @defer.inlineCallbacks
     def _garbageCollect(self):
         self._gc = reactor.callLater(self.GC_TIME, self._garbageCollect)
-        for idx, stp in enumerate(self._transports):
-            if (stp.isIdle() and stp.age() > self.MAX_IDLETIME):
-                yield stp.getTransport().quit()
-                if self.debug & LOGLEVEL_TRANSPORT:
-                    log.msg("[%s] expire idle transport[%d] %s" % (self.__class__.__name__, idx,stp), logLevel = self.logToLevel)
-                    log.msg("[%s] %s" % (self.__class__.__name__, self._transports), logLevel = self.logToLevel)
-                self._transports.remove(stp)
-            elif self.timeout and stp.isActive() and stp.age() > self.timeout:
-                yield stp.getTransport().quit()
-                if self.debug & LOGLEVEL_TRANSPORT:
-                    log.msg("[%s] expire timeouted transport[%d] %s" % (self.__class__.__name__, idx,stp), logLevel = self.logToLevel)
-                    log.msg("[%s] %s" % (self.__class__.__name__, self._transports), logLevel = self.logToLevel)
-                self._transports.remove(stp)
-
+        for pool in self._pools.values():
+            yield pool.garbageCollect(self.MAX_IDLETIME)
 
     @defer.inlineCallbacks
     def quit(self):
-        self._gc.cancel()      # cancel the garbage collector
+        if self._gc.active():
+            self._gc.cancel()      # cancel the garbage collector
+        self._cluster.stop()
 
-        for stp in self._transports:
-            if self.debug & LOGLEVEL_DEBUG:
-                log.msg("[%s] transport[%d].quit() %s" % (self.__class__.__name__, len(self._transports),stp), logLevel = self.logToLevel)
-            yield stp.getTransport().quit()
+        for pool in self._pools.values():
+            yield pool.quit()
 
     def __del__(self):
         """on shutdown, close all transports"""
         self.quit()
 
-    def put(self, robj, w = None, dw = None, pw = None, return_body = True, if_none_match=False):
-        ret = self.__put(robj, w, dw, pw, return_body = return_body, if_none_match = if_none_match)
-        if return_body:
+    def put(self, robj, w = None, dw = None, pw = None, return_body = True, if_none_match=False, if_not_modified=False, return_head=False):
+        if return_head:
+            return_body = False
+        ret = self.__put(robj, w, dw, pw, return_body = return_body, if_none_match = if_none_match,
+                         if_not_modified = if_not_modified, return_head = return_head)
+        if return_body or return_head:
             return ret
         else:
             return None
@@ -1061,7 +1911,8 @@ class PBCTransport(FeatureDetection):
 
 
     @defer.inlineCallbacks
-    def __put(self, robj, w = None, dw = None, pw = None, return_body=True, if_none_match=False):
+    def __put(self, robj, w = None, dw = None, pw = None, return_body=True, if_none_match=False,
+              if_not_modified=False, return_head=False):
         # std kwargs
         kwargs = {'w'             : w,
                   'dw'            : dw,
@@ -1069,13 +1920,50 @@ class PBCTransport(FeatureDetection):
                   'return_body'   : return_body,
                   'if_none_match' : if_none_match
                   }
+        if if_not_modified:
+            kwargs['if_not_modified'] = True
+        if return_head:
+            kwargs['return_head'] = True
         # vclock
         vclock = robj.vclock() or None
 
+        payload = self._putPayload(robj)
+        template = None
+        if robj.get_key() is not None:
+            template = self._template(robj.get_bucket(), RiakPBC.preparePut, kwargs)
+
+        # aquire transport, fire, release
+        stp = yield self._getFreeTransport()
+        try:
+            transport = stp.getTransport()
+            if template is not None:
+                ret = yield transport.sendPrepared(template, robj.get_key(),
+                                                   vclock, payload)
+            else:
+                ret = yield transport.put(robj.get_bucket().get_name(),
+                                          robj.get_key(),
+                                          payload,
+                                          vclock,
+                                          **kwargs
+                                          )
+        except RiakPBCException, e:
+            # the error messages of failed if_not_modified and
+            # if_none_match conditions
+            if str(e).startswith(('modified', 'match_found')):
+                raise RiakConflictError(str(e))
+            raise
+        finally:
+            self._releaseTransport(stp)
+        defer.returnValue(self.parseRpbGetResp(ret))
+
+    def _putPayload(self, robj):
+        value, encoding = robj.get_stored_data()
         payload = {
-            'value' : robj.get_encoded_data(),
+            'value' : value,
             'content_type' : robj.get_content_type(),
             }
+        if encoding:
+            payload['content_encoding'] = encoding
 
         # links
         links = robj.get_links()
@@ -1096,47 +1984,201 @@ class PBCTransport(FeatureDetection):
             for index in robj.get_indexes():
                 payload['indexes'].append((index.get_field(), index.get_value()))
 
+        return payload
 
-        # aquire transport, fire, release
-        stp = yield self._getFreeTransport()
-        transport = stp.getTransport()
-        ret = yield transport.put(robj.get_bucket().get_name(),
-                                  robj.get_key(),
-                                  payload,
-                                  vclock,
-                                  **kwargs
-                                  )
-        stp.setIdle()
-        defer.returnValue(self.parseRpbGetResp(ret))
+    def put_many(self, robjs, w = None, dw = None, pw = None, return_body = False, concurrency = 50):
+        """
+        Store many objects that already have a key. They are written in
+        batches of up to BATCH_SIZE requests, each batch with a single
+        write on one connection.
 
+        :returns: list of (success, result or Failure) tuples in the order
+         of robjs, result as returned by put() -- via deferred
+        """
+        kwargs = {'w'             : w,
+                  'dw'            : dw,
+                  'pw'            : pw,
+                  'return_body'   : return_body,
+                  }
+        template = self._batchTemplate(robjs, RiakPBC.preparePut, kwargs)
+
+        def build(robj):
+            payload = self._putPayload(robj)
+            if template is not None:
+                return template.body(robj.get_key(), robj.vclock() or None,
+                                     payload)
+            return RiakPBC._putRequest(robj.get_bucket().get_name(),
+                                       robj.get_key(), payload,
+                                       robj.vclock() or None, **kwargs)
+
+        def send(transport, batch):
+            return [d.addCallback(self.parseRpbGetResp)
+                    for d in transport.sendRequests(MSG_CODE_PUT_REQ, batch)]
+
+        return self._sendBatched(self._buildRequests(robjs, build), send,
+                                 concurrency)
+
+    @defer.inlineCallbacks
+    def delete_many(self, robjs, rw=None, r = None, w = None, dw = None, pr = None, pw = None, concurrency = 50):
+        """
+        Delete many objects, batched like put_many().
+
+        :returns: list of (success, True or Failure) tuples in the order of
+         robjs -- via deferred
+        """
+        kwargs = {'rw' : rw, 'r': r, 'w': w, 'dw': dw, 'pr': pr, 'pw': pw}
+
+        ts = self._supports(TOMBSTONE_VCLOCKS)
+        if ts is None:
+            ts = yield self.tombstone_vclocks()
+        template = self._batchTemplate(robjs, RiakPBC.prepareDelete, kwargs)
+
+        def build(robj):
+            vclock = ts and robj.vclock() or None
+            if template is not None:
+                return template.body(robj.get_key(), vclock)
+            return RiakPBC._deleteRequest(robj.get_bucket().get_name(),
+                                          robj.get_key(), vclock=vclock,
+                                          **kwargs)
+
+        def send(transport, batch):
+            return transport.sendRequests(MSG_CODE_DEL_REQ, batch)
+
+        ret = yield self._sendBatched(self._buildRequests(robjs, build), send,
+                                      concurrency)
+        defer.returnValue(ret)
+
+    def _template(self, bucket, prepare, kwargs):
+        """
+        The template prepare makes for the requests on bucket with
+        kwargs, made the first time it is needed. None if the requests
+        of bucket are not prepared.
+        """
+        templates = bucket.get_prepared()
+        if templates is None:
+            return None
+        key = (prepare, tuple(sorted(kwargs.iteritems())))
+        template = templates.get(key)
+        if template is None:
+            template = templates[key] = prepare(bucket.get_name(), **kwargs)
+        return template
+
+    def _batchTemplate(self, robjs, prepare, kwargs):
+        """
+        The template for a batch of requests, if they are all on the
+        same prepared bucket.
+        """
+        buckets = set([robj.get_bucket() for robj in robjs])
+        if len(buckets) != 1:
+            return None
+        return self._template(buckets.pop(), prepare, kwargs)
+
+    def _buildRequests(self, robjs, build):
+        """
+        build(robj) for each of robjs, with the Failure in place of the
+        request of an object it raised on.
+        """
+        requests = []
+        for robj in robjs:
+            try:
+                requests.append(build(robj))
+            except Exception:
+                requests.append(Failure())
+        return requests
+
+    def _sendBatched(self, requests, send, concurrency):
+        """
+        Split requests into batches, send(transport, batch) writes a batch
+        to a connection and returns a deferred per request. No more than
+        concurrency requests are in flight. Requests that are a Failure,
+        as they could not be built, are not sent, their result is
+        (False, failure).
+        """
+        good = [request for request in requests
+                if not isinstance(request, Failure)]
+        size = max(1, min(self.BATCH_SIZE, concurrency))
+        sem = defer.DeferredSemaphore(max(1, concurrency // size))
+        ds = [sem.run(self._sendBatch, good[i:i + size], send)
+              for i in xrange(0, len(good), size)]
+
+        def merge(batches):
+            results = iter([r for batch in batches for r in batch])
+            return [isinstance(request, Failure) and (False, request)
+                    or results.next() for request in requests]
+        return defer.gatherResults(ds).addCallback(merge)
 
     @defer.inlineCallbacks
-    def get(self, robj, r = None, pr = None, vtag = None):
+    def _sendBatch(self, batch, send):
+        try:
+            stp = yield self._getFreeTransport()
+        except Exception:
+            failure = Failure()
+            defer.returnValue([(False, failure)] * len(batch))
+
+        try:
+            try:
+                ds = send(stp.getTransport(), batch)
+            except Exception:
+                failure = Failure()
+                defer.returnValue([(False, failure)] * len(batch))
+            ret = yield defer.DeferredList(ds, consumeErrors=True)
+        finally:
+            self._releaseTransport(stp)
+        defer.returnValue(ret)
+
+    @defer.inlineCallbacks
+    def get(self, robj, r = None, pr = None, vtag = None, if_modified = None):
 
         # ***FIXME*** whats vtag for? ignored for now
 
-        stp = yield self._getFreeTransport()
-        transport = stp.getTransport()
-        ret = yield transport.get(robj.get_bucket().get_name(),
-                                  robj.get_key(),
-                                  r = r,
-                                  pr = pr)
+        kwargs = {'r': r, 'pr': pr}
+        if if_modified is not None and if_modified[0]:
+            kwargs['if_modified'] = if_modified[0]
 
-        stp.setIdle()
-        defer.returnValue(self.parseRpbGetResp(ret))
+        template = None
+        if robj.get_key() is not None:
+            template = self._template(robj.get_bucket(), RiakPBC.prepareGet,
+                                      {'r': r, 'pr': pr})
+
+        stp = yield self._getFreeTransport()
+        try:
+            transport = stp.getTransport()
+            if template is not None:
+                ret = yield transport.sendPrepared(template, robj.get_key(),
+                                                   kwargs.get('if_modified'),
+                                                   decoder=get_response_decoder)
+            else:
+                ret = yield transport.get(robj.get_bucket().get_name(),
+                                          robj.get_key(),
+                                          decoder=get_response_decoder,
+                                          **kwargs)
+        finally:
+            self._releaseTransport(stp)
+        defer.returnValue(ret)
 
     @defer.inlineCallbacks
     def head(self, robj, r = None, pr = None, vtag = None):
+        template = None
+        if robj.get_key() is not None:
+            template = self._template(robj.get_bucket(), RiakPBC.prepareGet,
+                                      {'r': r, 'pr': pr, 'head': True})
+
         stp = yield self._getFreeTransport()
-        transport = stp.getTransport()
-        ret = yield transport.get(robj.get_bucket().get_name(),
-                                  robj.get_key(),
-                                  r = r,
-                                  pr = pr,
-                                  head = True)
-
-        stp.setIdle()
-        defer.returnValue(self.parseRpbGetResp(ret))
+        try:
+            transport = stp.getTransport()
+            if template is not None:
+                ret = yield transport.sendPrepared(template, robj.get_key(),
+                                                   decoder=get_response_decoder)
+            else:
+                ret = yield transport.get(robj.get_bucket().get_name(),
+                                          robj.get_key(),
+                                          r = r,
+                                          pr = pr,
+                                          head = True,
+                                          decoder=get_response_decoder)
+        finally:
+            self._releaseTransport(stp)
+        defer.returnValue(ret)
 
 
     @defer.inlineCallbacks
@@ -1149,27 +2191,40 @@ class PBCTransport(FeatureDetection):
         kwargs = {'rw' : rw, 'r': r, 'w': w, 'dw': dw, 'pr': pr, 'pw': pw}
         headers = {}
 
-        ts = yield self.tombstone_vclocks()
-        if ts and robj.vclock() is not None:
-            kwargs['vclock'] = robj.vclock()
+        # resolving it takes a connection of its own, so not while
+        # holding one
+        ts = self._supports(TOMBSTONE_VCLOCKS)
+        if ts is None:
+            ts = yield self.tombstone_vclocks()
 
         stp = yield self._getFreeTransport()
-        transport = stp.getTransport()
-        ret = yield transport.delete(robj.get_bucket().get_name(),
-                                     robj.get_key(),
-                                     **kwargs
-                                     )
-
-        stp.setIdle()
+        try:
+            template = self._template(robj.get_bucket(), RiakPBC.prepareDelete, kwargs)
+            if ts and robj.vclock() is not None:
+                kwargs['vclock'] = robj.vclock()
+
+            transport = stp.getTransport()
+            if template is not None:
+                ret = yield transport.sendPrepared(template, robj.get_key(),
+                                                   kwargs.get('vclock'))
+            else:
+                ret = yield transport.delete(robj.get_bucket().get_name(),
+                                             robj.get_key(),
+                                             **kwargs
+                                             )
+        finally:
+            self._releaseTransport(stp)
         defer.returnValue(ret)
 
 
     @defer.inlineCallbacks
     def get_buckets(self):
         stp = yield self._getFreeTransport()
-        transport = stp.getTransport()
-        ret = yield transport.getBuckets()
-        stp.setIdle()
+        try:
+            transport = stp.getTransport()
+            ret = yield transport.getBuckets()
+        finally:
+            self._releaseTransport(stp)
         defer.returnValue([x for x in ret.buckets])
 
 
@@ -1178,20 +2233,21 @@ class PBCTransport(FeatureDetection):
         if not self._s_version:
             self._s_version = yield self._server_version()
 
-        defer.returnValue(StrictVersion(self._s_version))
+        defer.returnValue(parse_version(self._s_version))
 
     @defer.inlineCallbacks
     def _server_version(self):
         stp = yield self._getFreeTransport()
-        transport = stp.getTransport()
-
-        stats = yield transport.getServerInfo()
-        stp.setIdle()
-
+        try:
+            transport = stp.getTransport()
+            stats = yield transport.getServerInfo()
+        finally:
+            self._releaseTransport(stp)
 
         if stats is not None:
             if self.debug % LOGLEVEL_DEBUG:
                 log.msg("[%s] fetched server version: %s" % (self.__class__.__name__, stats.server_version), logLevel = self.logToLevel)
+            self._set_node_version(stp.getPool().node, stats.server_version)
             defer.returnValue(stats.server_version)
         else:
             defer.returnValue("0.14.0")
@@ -1202,9 +2258,11 @@ class PBCTransport(FeatureDetection):
         Check server is alive
         """
         stp = yield self._getFreeTransport()
-        transport = stp.getTransport()
-        ret = yield transport.ping()
-        stp.setIdle()
+        try:
+            transport = stp.getTransport()
+            ret = yield transport.ping()
+        finally:
+            self._releaseTransport(stp)
         defer.returnValue(ret == True)
 
 
@@ -1214,9 +2272,11 @@ class PBCTransport(FeatureDetection):
         Set bucket properties
         """
         stp = yield self._getFreeTransport()
-        transport = stp.getTransport()
-        ret = yield transport.setBucketProperties(bucket.get_name(), **props)
-        stp.setIdle()
+        try:
+            transport = stp.getTransport()
+            ret = yield transport.setBucketProperties(bucket.get_name(), **props)
+        finally:
+            self._releaseTransport(stp)
         defer.returnValue(ret == True)
 
 
@@ -1226,20 +2286,88 @@ class PBCTransport(FeatureDetection):
         get bucket properties
         """
         stp = yield self._getFreeTransport()
-        transport = stp.getTransport()
-        ret = yield transport.getBucketProperties(bucket.get_name())
-        stp.setIdle()
+        try:
+            transport = stp.getTransport()
+            ret = yield transport.getBucketProperties(bucket.get_name())
+        finally:
+            self._releaseTransport(stp)
         defer.returnValue({'n_val'      : ret.props.n_val,
                            'allow_mult' : ret.props.allow_mult})
 
     @defer.inlineCallbacks
     def get_keys(self, bucket):
-        stp = yield self._getFreeTransport()
-        transport = stp.getTransport()
-        ret = yield transport.getKeys(bucket.get_name())
-        stp.setIdle()
+        stp = yield self._getFreeTransport(exclusive=True)
+        try:
+            transport = stp.getTransport()
+            ret = yield transport.getKeys(bucket.get_name())
+        finally:
+            self._releaseTransport(stp)
         defer.returnValue(ret)
 
+    @defer.inlineCallbacks
+    def stream_keys(self, bucket, consumer):
+        stp = yield self._getFreeTransport(exclusive=True)
+        try:
+            transport = stp.getTransport()
+            yield transport.streamKeys(bucket.get_name(), consumer)
+        finally:
+            self._releaseTransport(stp)
+
+    @defer.inlineCallbacks
+    def get_index(self, bucket, index, startkey, endkey=None):
+        """
+        Performs a secondary index query, an exact match or a range
+        query if endkey is given.
+        """
+        stp = yield self._getFreeTransport()
+        try:
+            transport = stp.getTransport()
+            ret = yield transport.getIndex(bucket, index, startkey, endkey)
+        finally:
+            self._releaseTransport(stp)
+        defer.returnValue(list(ret.keys))
+
+    @defer.inlineCallbacks
+    def mapred(self, inputs, query, timeout=None):
+        """
+        Run a MapReduce query, collecting the streamed results. Like over
+        HTTP the result is a list, or a list of lists when more than one
+        phase returned results.
+        """
+        phases = {}
+        def collect(chunk):
+            phase, data = chunk
+            if isinstance(data, list):
+                phases.setdefault(phase, []).extend(data)
+            else:
+                phases.setdefault(phase, []).append(data)
+
+        yield self.stream_mapred(inputs, query, collect, timeout)
+        if len(phases) == 1:
+            defer.returnValue(phases.values()[0])
+        defer.returnValue([phases[phase] for phase in sorted(phases)])
+
+    @defer.inlineCallbacks
+    def stream_mapred(self, inputs, query, consumer, timeout=None):
+        """
+        Run a MapReduce query, handing a (phase, results) tuple to
+        consumer for every response message as it arrives.
+        """
+        job = {'inputs':inputs, 'query':query}
+        if timeout is not None:
+            job['timeout'] = timeout
+
+        def decode(chunk):
+            phase, data = chunk
+            return consumer((phase, self.decodeJson(data)))
+
+        stp = yield self._getFreeTransport(exclusive=True)
+        try:
+            transport = stp.getTransport()
+            yield transport.streamMapReduce(self.encodeJson(job), decode)
+        finally:
+            self._releaseTransport(stp)
+
     def parseRpbGetResp(self,res):
         """
         adaptor for a RpbGetResp message
@@ -1251,34 +2379,10 @@ class PBCTransport(FeatureDetection):
         """
         if res == True:         # empty response
             return None
-        vclock = res.vclock
-        resList = []
-        for content in res.content: # iterate over RpbContent field
-            metadata = {MD_USERMETA: {}, MD_INDEX: []}
-            data = content.value
-            if content.HasField('content_type'): metadata[MD_CTYPE] = content.content_type
-            if content.HasField('charset'): metadata[MD_CHARSET] = content.charset
-            if content.HasField('content_encoding'): metadata[MD_ENCODING] = content.content_encoding
-            if content.HasField('vtag'): metadata[MD_VTAG] = content.vtag
-            if content.HasField('last_mod'): metadata[MD_LASTMOD] = content.last_mod
-            if content.HasField('deleted'): metadata[MD_DELETED] = content.deleted
-
-            if len(content.links):
-                metadata[MD_LINKS] = []
-                for l in content.links:
-                    metadata[MD_LINKS].append(RiakLink(l.bucket,l.key,l.tag))
-
-            if len(content.usermeta):
-                metadata[MD_USERMETA] = {}
-                for md in content.usermeta:
-                    metadata[MD_USERMETA][md.key] = md.value
-
-            if len(content.indexes):
-                metadata[MD_INDEX] = []
-                for ie in content.indexes:
-                    metadata[MD_INDEX].append(RiakIndexEntry(ie.key, ie.value))
-            resList.append((metadata, data))
-        return vclock, resList
+        if not res.HasField('vclock') and not len(res.content):
+            # what riak answers for a key that does not exist
+            return None
+        return parse_get_response(res)
 
 
     def decodeJson(self, s):
@@ -5,9 +5,13 @@ from twisted.internet import defer, reactor
 from twisted.python.failure import Failure
 
 from struct import pack, unpack
+from collections import deque
 
 from pprint import pformat
 
+from riakasaurus.stream import ResultStream
+from riakasaurus.pbc_encode import RequestTemplate
+
 # generated code from *.proto message definitions
 from riak_kv_pb2 import *
 from riak_pb2 import *
@@ -58,7 +62,111 @@ def toHex(s):
 
     return reduce(lambda x,y:x+y, lst)
 
-class RiakPBC(Int32StringReceiver):
+class RiakPBCRequest(object):
+    """
+    a request that has been written to a RiakPBC connection and is
+    waiting for its response
+    """
+    def __init__(self):
+        self.d = Deferred()
+        self.keys = []          # collects multi-message responses
+        self.stream = None      # or hands them to a ResultStream
+        self.decoder = None     # decodes the response body instead of protobuf
+        self.timeoutd = None
+
+    def cancelTimeout(self):
+        if self.timeoutd and self.timeoutd.active():
+            self.timeoutd.cancel()
+        self.timeoutd = None
+
+
+class FrameReceiver(Int32StringReceiver):
+    """
+    Int32StringReceiver that does not copy the frames it receives and
+    sends.
+
+    Int32StringReceiver appends every chunk read to the unprocessed data
+    and slices each frame out of it, so a frame of several megabytes is
+    copied over and over while it arrives. Here the chunks are kept as
+    they are until the whole frame is in, then joined once at most, and
+    stringReceived is called with a memoryview of it. A frame within a
+    single chunk is not copied at all.
+    """
+
+    def __init__(self):
+        self._chunks = deque()  # received, not yet handed on
+        self._offset = 0        # into the first chunk
+        self._buffered = 0      # bytes in the chunks past the offset
+        self._length = None     # of the frame being received
+
+    def dataReceived(self, data):
+        if data:
+            self._chunks.append(data)
+            self._buffered += len(data)
+
+        while not self.paused:
+            if self._length is None:
+                if self._buffered < self.prefixLength:
+                    return
+                length, = unpack(self.structFormat,
+                                 self._take(self.prefixLength).tobytes())
+                if length > self.MAX_LENGTH:
+                    self.lengthLimitExceeded(length)
+                    return
+                self._length = length
+            if self._buffered < self._length:
+                return
+            frame = self._take(self._length)
+            self._length = None
+            self.stringReceived(frame)
+
+    def _take(self, length):
+        """
+        the next length bytes received, as a memoryview
+        """
+        if not length:
+            return memoryview('')
+        chunk = self._chunks[0]
+        start = self._offset
+        if len(chunk) - start >= length:
+            view = memoryview(chunk)[start:start + length]
+            self._consumed(length)
+            return view
+
+        # spread over several chunks, copy them together once
+        frame = bytearray(length)
+        filled = 0
+        while filled < length:
+            chunk = self._chunks[0]
+            start = self._offset
+            size = min(len(chunk) - start, length - filled)
+            frame[filled:filled + size] = memoryview(chunk)[start:start + size]
+            filled += size
+            self._consumed(size)
+        return memoryview(frame)
+
+    def _consumed(self, length):
+        self._buffered -= length
+        self._offset += length
+        if self._offset == len(self._chunks[0]):
+            self._chunks.popleft()
+            self._offset = 0
+
+    def sendFrames(self, frames):
+        """
+        send a list of frames, (header, body) tuples which are written
+        one after the other with a single writeSequence, without joining
+        them. the length prefix goes in front of each header
+        """
+        data = []
+        for header, body in frames:
+            data.append(pack(self.structFormat, len(header) + len(body)) + header)
+            if body:
+                data.append(body)
+        self.transport.writeSequence(data)
+
+
+class RiakPBC(FrameReceiver):
 
     MAX_LENGTH = 9999999
 
@@ -71,6 +179,8 @@ class RiakPBC(Int32StringReceiver):
         MSG_CODE_LIST_KEYS_RESP       : RpbListKeysResp,
         MSG_CODE_LIST_BUCKETS_RESP    : RpbListBucketsResp,
         MSG_CODE_GET_BUCKET_RESP      : RpbGetBucketResp,
+        MSG_CODE_MAPRED_RESP          : RpbMapRedResp,
+        MSG_CODE_INDEX_RESP           : RpbIndexResp,
         MSG_CODE_GET_SERVER_INFO_RESP : RpbGetServerInfoResp,
         }
 
@@ -120,9 +230,15 @@ class RiakPBC(Int32StringReceiver):
         }
 
     timeout = None
-    timeoutd = None
     debug = 0
 
+    def __init__(self):
+        FrameReceiver.__init__(self)
+        # requests are answered by riak in the order they were sent, so
+        # many requests can be written back-to-back and the responses
+        # matched against this FIFO
+        self._pending = deque()
+
     # ------------------------------------------------------------------
     # Server Operations .. setClientId, getClientId, getServerInfo, ping
     # ------------------------------------------------------------------
@@ -147,32 +263,60 @@ class RiakPBC(Int32StringReceiver):
     # ------------------------------------------------------------------
     # Object/Key Operations .. get(fetch), put(store), delete
     # ------------------------------------------------------------------
-    def get(self,bucket,key, **kwargs):
+    def get(self,bucket,key, decoder=None, **kwargs):
+        """
+        the response is a RpbGetResp, or whatever decoder returns when
+        it is called with the body of the message
+        """
         code = pack('B',MSG_CODE_GET_REQ)
+        return self.__send(code, self._getRequest(bucket, key, **kwargs), decoder=decoder)
+
+    @classmethod
+    def _getRequest(cls,bucket,key, **kwargs):
         request = RpbGetReq()
         request.bucket = bucket
-        request.key = key
+        if key is not None:
+            request.key = key
 
-        if 'r' in kwargs            : request.r = self._resolveNums(kwargs['r'])
-        if 'pr' in kwargs           : request.pr = self._resolveNums(kwargs['pr'])
+        if 'r' in kwargs            : request.r = cls._resolveNums(kwargs['r'])
+        if 'pr' in kwargs           : request.pr = cls._resolveNums(kwargs['pr'])
         if 'basic_quorum' in kwargs : request.basic_quorum = kwargs['basic_quorum']
         if 'notfound_ok' in kwargs  : request.notfound_ok = kwargs['notfound_ok']
         if 'if_modified' in kwargs  : request.if_modified = kwargs['if_modified']
         if 'head' in kwargs         : request.head = kwargs['head']
         if 'deletedvclock' in kwargs: request.deletedvclock = kwargs['deletedvclock']
 
-        return self.__send(code,request)
+        return request
 
     def put_new(self,bucket,key,content, vclock = None, **kwargs):
         return put(bucket,key,content, vclock, kwargs)
 
     def put(self,bucket,key,content, vclock = None, **kwargs):
         code = pack('B',MSG_CODE_PUT_REQ)
+        return self.__send(code, self._putRequest(bucket, key, content, vclock, **kwargs))
+
+    def putMany(self, puts, **kwargs):
+        """
+        pipeline several puts, their frames are written to the connection
+        in one go
+
+        puts is a list of (bucket, key, content, vclock) tuples, the kwargs
+        apply to all of them. returns a list of deferreds, one per put
+        """
+        code = pack('B',MSG_CODE_PUT_REQ)
+        return self.__sendMany([(code, self._putRequest(bucket, key, content, vclock, **kwargs))
+                                for bucket, key, content, vclock in puts])
+
+    @classmethod
+    def _putRequest(cls,bucket,key,content, vclock = None, **kwargs):
         request = RpbPutReq()
         request.bucket = bucket
-        request.key = key
+        if key is not None:
+            request.key = key
 
-        if isinstance(content, str):
+        if content is None:
+            pass
+        elif isinstance(content, str):
             request.content.value = content
         else:
             # assume its a dict
@@ -204,10 +348,10 @@ class RiakPBC(Int32StringReceiver):
                     indexes.key,indexes.value = l
 
 
-        if 'w' in kwargs               : request.w = self._resolveNums(kwargs['w'])
-        if 'dw' in kwargs              : request.dw = self._resolveNums(kwargs['dw'])
+        if 'w' in kwargs               : request.w = cls._resolveNums(kwargs['w'])
+        if 'dw' in kwargs              : request.dw = cls._resolveNums(kwargs['dw'])
         if 'return_body' in kwargs     : request.return_body = kwargs['return_body']
-        if 'pw' in kwargs              : request.pw = self._resolveNums(kwargs['pw'])
+        if 'pw' in kwargs              : request.pw = cls._resolveNums(kwargs['pw'])
         if 'if_modified' in kwargs     : request.if_modified = kwargs['if_modified']
         if 'if_not_modified' in kwargs : request.if_not_modified = kwargs['if_not_modified']
         if 'if_none_match' in kwargs   : request.if_none_match = kwargs['if_none_match']
@@ -216,25 +360,95 @@ class RiakPBC(Int32StringReceiver):
         if vclock:
             request.vclock = vclock
 
-        return self.__send(code,request)
+        return request
 
     def delete(self,bucket,key, **kwargs):
         code = pack('B',MSG_CODE_DEL_REQ)
+        return self.__send(code, self._deleteRequest(bucket, key, **kwargs))
+
+    def deleteMany(self, deletes, **kwargs):
+        """
+        pipeline several deletes, their frames are written to the connection
+        in one go
+
+        deletes is a list of (bucket, key, vclock) tuples, the kwargs apply
+        to all of them. returns a list of deferreds, one per delete
+        """
+        code = pack('B',MSG_CODE_DEL_REQ)
+        return self.__sendMany([(code, self._deleteRequest(bucket, key, vclock=vclock, **kwargs))
+                                for bucket, key, vclock in deletes])
+
+    def sendRequests(self, code, requests):
+        """
+        pipeline requests of one message code that are already built,
+        protobuf messages or serialized bodies, like putMany(). returns a
+        list of deferreds
+        """
+        code = pack('B',code)
+        return self.__sendMany([(code, request) for request in requests])
+
+    @classmethod
+    def _deleteRequest(cls,bucket,key, **kwargs):
         request = RpbDelReq()
         request.bucket = bucket
-        request.key = key
+        if key is not None:
+            request.key = key
 
         if 'vclock' in kwargs and kwargs['vclock']:
             request.vclock = kwargs['vclock']
-        if 'rw' in kwargs     : request.rw = self._resolveNums(kwargs['rw'])
-        if 'r' in kwargs      : request.r = self._resolveNums(kwargs['r'])
-        if 'w' in kwargs      : request.w = self._resolveNums(kwargs['w'])
-        if 'pr' in kwargs     : request.pr = self._resolveNums(kwargs['pr'])
-        if 'pw' in kwargs     : request.pw = self._resolveNums(kwargs['pw'])
-        if 'dw' in kwargs     : request.dw = self._resolveNums(kwargs['dw'])
+        if 'rw' in kwargs     : request.rw = cls._resolveNums(kwargs['rw'])
+        if 'r' in kwargs      : request.r = cls._resolveNums(kwargs['r'])
+        if 'w' in kwargs      : request.w = cls._resolveNums(kwargs['w'])
+        if 'pr' in kwargs     : request.pr = cls._resolveNums(kwargs['pr'])
+        if 'pw' in kwargs     : request.pw = cls._resolveNums(kwargs['pw'])
+        if 'dw' in kwargs     : request.dw = cls._resolveNums(kwargs['dw'])
 
-        return self.__send(code,request)
+        return request
+
+    # ------------------------------------------------------------------
+    # Prepared Requests .. templates for get, put, delete on a bucket
+    # ------------------------------------------------------------------
+    @classmethod
+    def prepareGet(cls, bucket, **kwargs):
+        """
+        template for gets from bucket, kwargs as for get(). if_modified
+        is the vclock given to sendPrepared()
+        """
+        return RequestTemplate(MSG_CODE_GET_REQ,
+                               cls._getRequest(bucket, None, **kwargs), 7)
+
+    @classmethod
+    def preparePut(cls, bucket, **kwargs):
+        """
+        template for puts to bucket, kwargs as for put()
+        """
+        return RequestTemplate(MSG_CODE_PUT_REQ,
+                               cls._putRequest(bucket, None, None, **kwargs), 3, 4)
 
+    @classmethod
+    def prepareDelete(cls, bucket, **kwargs):
+        """
+        template for deletes from bucket, kwargs as for delete()
+        """
+        return RequestTemplate(MSG_CODE_DEL_REQ,
+                               cls._deleteRequest(bucket, None, **kwargs), 4)
+
+    def sendPrepared(self, template, key, vclock=None, content=None, decoder=None):
+        """
+        send the request of template for key, the response is the same
+        as for the request sent without the template
+        """
+        return self.__send(template.code, template.body(key, vclock, content),
+                           decoder=decoder)
+
+    def sendPreparedMany(self, template, requests, decoder=None):
+        """
+        pipeline the requests of template for a list of (key, vclock,
+        content) tuples, like putMany(). returns a list of deferreds
+        """
+        code = template.code
+        return self.__sendMany([(code, template.body(key, vclock, content))
+                                for key, vclock, content in requests], decoder=decoder)
 
     # ------------------------------------------------------------------
     # Bucket Operations .. getKeys, getBuckets, get/set Bucket properties
@@ -247,9 +461,23 @@ class RiakPBC(Int32StringReceiver):
         code = pack('B',MSG_CODE_LIST_KEYS_REQ)
         request = RpbListKeysReq()
         request.bucket = bucket
-        self.__keyList = []
         return self.__send(code,request)
 
+    def streamKeys(self, bucket, consumer):
+        """
+        like getKeys(), but consumer is called with the keys of every
+        response message as it arrives instead of collecting them all.
+        while a deferred returned by consumer is pending the connection
+        stops reading. the returned deferred fires when all keys have
+        been consumed
+        """
+        code = pack('B',MSG_CODE_LIST_KEYS_REQ)
+        request = RpbListKeysReq()
+        request.bucket = bucket
+        stream = ResultStream(consumer, self)
+        self.__send(code, request, stream).addCallbacks(stream.finish, stream.fail)
+        return stream.d
+
     def getBuckets(self):
         """
         operates different than the other messages, as it returns more than
@@ -275,6 +503,43 @@ class RiakPBC(Int32StringReceiver):
         return self.__send(code,request)
 
 
+    # ------------------------------------------------------------------
+    # Query Operations .. getIndex, mapReduce
+    # ------------------------------------------------------------------
+    def getIndex(self, bucket, index, startkey, endkey=None):
+        """
+        secondary index query, an exact match on startkey, or a range
+        query if endkey is given
+        """
+        code = pack('B',MSG_CODE_INDEX_REQ)
+        request = RpbIndexReq()
+        request.bucket = bucket
+        request.index = index
+        if endkey is None:
+            request.qtype = RpbIndexReq.eq
+            request.key = str(startkey)
+        else:
+            request.qtype = RpbIndexReq.range
+            request.range_min = str(startkey)
+            request.range_max = str(endkey)
+        return self.__send(code,request)
+
+    def streamMapReduce(self, job, consumer, content_type='application/json'):
+        """
+        run an encoded map/reduce job. consumer is called with a
+        (phase, response) tuple for every response message carrying
+        results, as they arrive. while a deferred returned by consumer is
+        pending the connection stops reading. the returned deferred fires
+        when all results have been consumed
+        """
+        code = pack('B',MSG_CODE_MAPRED_REQ)
+        request = RpbMapRedReq()
+        request.request = job
+        request.content_type = content_type
+        stream = ResultStream(consumer, self)
+        self.__send(code, request, stream).addCallbacks(stream.finish, stream.fail)
+        return stream.d
+
     # ------------------------------------------------------------------
     # helper functions, message parser
     # ------------------------------------------------------------------
@@ -285,32 +550,103 @@ class RiakPBC(Int32StringReceiver):
         """
         self.factory.connected.callback(self)
 
+    def connectionLost(self, reason):
+        """
+        nothing will answer the outstanding requests anymore, fail them
+        """
+        self.connected = 0
+        self._failAll(reason)
+
     def setTimeout(self,t):
         self.timeout = t
 
-    def __send(self, code, request=None):
+    def outstanding(self):
+        """
+        number of requests sent on this connection still waiting for
+        a response
+        """
+        return len(self._pending)
+
+    def __send(self, code, request=None, stream=None, decoder=None):
         """
         helper method for logging, sending and returning the deferred
         """
-        if self.debug:
-            print "[%s] %s %s" % (self.__class__.__name__,  request.__class__.__name__, str(request).replace('\n',' ' ))
-        if request:
-            msg = code + request.SerializeToString()
-        else:
-            msg = code
-        self.sendString(msg)
-        self.factory.d = Deferred()
-        if self.timeout:
-            self.timeoutd = reactor.callLater(self.timeout, self._triggerTimeout)
+        return self.__sendMany([(code, request)], stream, decoder)[0]
+
+    def __sendMany(self, messages, stream=None, decoder=None):
+        """
+        frame a list of (code, request) messages and write them with a
+        single transport.writeSequence, returns the list of their deferreds
+        """
+        frames = []
+        sent = []
+        for code, request in messages:
+            if self.debug:
+                print "[%s] %s %s" % (self.__class__.__name__,  request.__class__.__name__, str(request).replace('\n',' ' ))
+            if isinstance(request, str):
+                # already serialized, from a RequestTemplate
+                frames.append((code, request))
+            elif request:
+                frames.append((code, request.SerializeToString()))
+            else:
+                frames.append((code, ''))
+            pending = RiakPBCRequest()
+            pending.stream = stream
+            pending.decoder = decoder
+            sent.append(pending)
 
-        return self.factory.d
+        idle = not self._pending
+        self._pending.extend(sent)
+        self.sendFrames(frames)
+        if idle:
+            self._armTimeout()
 
-    def _triggerTimeout(self):
-        if not self.factory.d.called:
-            try:
-                self.factory.d.errback(RiakPBCException('timeout'))
-            except Exception, e:
-                print "Unable to handle Timeout: %s" % e
+        return [pending.d for pending in sent]
+
+    def _armTimeout(self):
+        """
+        start the timeout of the oldest outstanding request. only that
+        one is timed, a request waiting behind it in the FIFO is not, and
+        neither is it while reading is paused by the consumer of a stream
+        """
+        if self.timeout and self._pending and not self.paused:
+            pending = self._pending[0]
+            if pending.timeoutd is None:
+                pending.timeoutd = reactor.callLater(self.timeout, self._triggerTimeout, pending)
+
+    def pauseProducing(self):
+        if self._pending:
+            self._pending[0].cancelTimeout()
+        FrameReceiver.pauseProducing(self)
+
+    def resumeProducing(self):
+        FrameReceiver.resumeProducing(self)
+        self._armTimeout()
+
+    def _triggerTimeout(self, pending):
+        pending.timeoutd = None
+        # a late response would be matched against the requests queued
+        # behind this one, so the whole connection has to be given up
+        self._failAll(Failure(RiakPBCException('timeout')))
+        self.transport.loseConnection()
+
+    def _failAll(self, reason):
+        while self._pending:
+            pending = self._pending.popleft()
+            pending.cancelTimeout()
+            pending.d.errback(reason)
+
+    def _finish(self, result):
+        """
+        fire the deferred of the oldest outstanding request
+        """
+        pending = self._pending.popleft()
+        pending.cancelTimeout()
+        self._armTimeout()
+        if isinstance(result, Exception):
+            pending.d.errback(Failure(result))
+        else:
+            pending.d.callback(result)
 
     def stringReceived(self, data):
         """
@@ -319,34 +655,33 @@ class RiakPBC(Int32StringReceiver):
 
         messages that dont have a body to parse return True, those are
         listed in self.nonMessages
-        """
-        if self.timeoutd and not self.timeoutd.called:
-            self.timeoutd.cancel()  # stop timeout from beeing raised
 
-        def returOrRaiseException(msg):
-            exc = RiakPBCException(msg)
-            if self.factory.d.called:
-                raise exc
-            else:
-                self.factory.d.errback(Failure(exc))
+        every response belongs to the oldest outstanding request, it is
+        removed from the FIFO once its last response message arrived
+        """
+        # decode messagetype, data is a memoryview of the frame, the body
+        # is parsed from it without copying
+        code = ord(data[0])
+        if self.debug:
+            print "[%s] stringReceived code %s" % (self.__class__.__name__,self.PBMessageTypes.get(code, code))
 
+        if not self._pending:
+            # nobody is waiting for this one (request timed out)
+            if self.debug:
+                print "[%s] dropping unexpected message %s" % (self.__class__.__name__, self.PBMessageTypes.get(code, code))
+            return
 
-        # decode messagetype
-        code = unpack('B',data[:1])[0]
-        if self.debug:
-            print "[%s] stringReceived code %s" % (self.__class__.__name__,self.PBMessageTypes[code])
+        pending = self._pending[0]
+        pending.cancelTimeout()         # stop timeout from beeing raised
 
         if code not in self.riakResponses and code not in self.nonMessages:
-            #raise RiakPBCException('unknown messagetype: %d' % code)
-            returnOrRaiseException('unknown messagetype: %d' % code)
+            self._finish(RiakPBCException('unknown messagetype: %d' % code))
 
         elif code in self.nonMessages:
             # for instance ping doesnt have a message, so we just return True
             if self.debug:
                 print "[%s] stringReceived empty message type %s" % (self.__class__.__name__, self.PBMessageTypes[code])
-            if not self.factory.d.called:
-                self.factory.d.callback(True)
-            return
+            self._finish(True)
 
         elif code == MSG_CODE_LIST_KEYS_RESP:
             # listKeys is special as it returns multiple response messages
@@ -359,11 +694,38 @@ class RiakPBC(Int32StringReceiver):
             if self.debug:
                 print "[%s] %s %s" % (self.__class__.__name__,  response.__class__.__name__, str(response).replace('\n',' ' ))
 
-            self.__keyList.extend([x for x in response.keys])
+            if pending.stream is not None:
+                if len(response.keys):
+                    pending.stream.deliver(list(response.keys))
+            else:
+                pending.keys.extend(response.keys)
+            if response.HasField('done') and response.done:
+                self._finish(pending.keys)
+            else:
+                self._armTimeout()      # until the next message
+
+        elif code == MSG_CODE_MAPRED_RESP:
+            # map/reduce results come in many messages as well, each one
+            # goes straight to the stream of the request
+            response = RpbMapRedResp()
+            response.ParseFromString(data[1:])
+            if self.debug:
+                print "[%s] %s %s" % (self.__class__.__name__,  response.__class__.__name__, str(response).replace('\n',' ' ))
+
+            if response.HasField('response') and pending.stream is not None:
+                pending.stream.deliver((response.phase, response.response))
             if response.HasField('done') and response.done:
-                if not self.factory.d.called:
-                    self.factory.d.callback(self.__keyList)
-                    self.__keyList = []
+                self._finish(True)
+            else:
+                self._armTimeout()
+
+        elif pending.decoder is not None and code != MSG_CODE_ERROR_RESP:
+            # the request knows better than protobuf what to do with it
+            try:
+                result = pending.decoder(data[1:])
+            except Exception, e:
+                result = e
+            self._finish(result)
 
         else:
             # normal handling, pick the message code, call ParseFromString()
@@ -375,18 +737,17 @@ class RiakPBC(Int32StringReceiver):
                 if self.debug:
                     print "[%s] %s %s" % (self.__class__.__name__,  response.__class__.__name__, str(response).replace('\n',' ' ))
 
-                if code == MSG_CODE_ERROR_RESP:
-                    returnOrRaiseException('%s (%d)' % (response.errmsg, response.errcode))
-                    #raise RiakPBCException('%s (%d)' % (response.errmsg, response.errcode))
-
-            if not self.factory.d.called:
-                self.factory.d.callback(response)
+            if code == MSG_CODE_ERROR_RESP:
+                self._finish(RiakPBCException('%s (%d)' % (response.errmsg, response.errcode)))
+            else:
+                self._finish(response)
 
-    def _resolveNums(self,val):
+    @classmethod
+    def _resolveNums(cls,val):
         if isinstance(val, str):
             val = val.lower()
-            if val in self.rwNums:
-                return self.rwNums[val]
+            if val in cls.rwNums:
+                return cls.rwNums[val]
             else:
                 raise RiakPBCException('invalid value %s' % (val))
         else:
@@ -404,9 +765,11 @@ class RiakPBCClientFactory(ClientFactory):
     noisy    = False
 
     def __init__(self):
-        self.d = Deferred()
         self.connected = Deferred()
 
+    def clientConnectionFailed(self, connector, reason):
+        self.connected.errback(reason)
+
 class RiakPBCClient(object):
 
     def connect(self,host,port):
@@ -9,7 +9,7 @@ setup(name='riakasaurus',
       license="Apache 2.0",
       url="http://github.com/calston/riakasaurus",
       platforms="Linux",
-      long_description="""Currently tested under Python 2.6, Python 2.7, and Linux.""",
+      long_description="""Currently tested under Python 2.7 and Linux.""",
       keywords="twisted riak riakasaurus",
       packages=find_packages(),
       package_data={
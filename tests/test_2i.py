@@ -55,6 +55,8 @@ class Tests(unittest.TestCase):
     def tearDown(self):
         yield self.bucket.disable_search()
         yield self.bucket.purge_keys()
+        # close the persistent http connections
+        yield self.client.get_transport().quit()
 
     @defer.inlineCallbacks
     def test_secondary_index(self):
@@ -88,5 +90,11 @@ class Tests(unittest.TestCase):
         self.assertEqual(sorted(r1),
                          ['foo1', 'foo2'])
 
+        keys = yield self.bucket.get_index('field1_bin', 'val2')
+        self.assertEqual(keys, [u'foo2'])
+
+        keys = yield self.bucket.get_index('field2_int', 1, 2000)
+        self.assertEqual(sorted(keys), [u'foo1', u'foo2'])
+
         log.msg("done secondary_index")
 
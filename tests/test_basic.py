@@ -42,6 +42,8 @@ class Tests(unittest.TestCase):
     def tearDown(self):
         yield self.bucket.disable_search()
         yield self.bucket.purge_keys()
+        # close the persistent http connections
+        yield self.client.get_transport().quit()
 
     @defer.inlineCallbacks
     def test_head(self):
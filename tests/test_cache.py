@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+tests for the read-through object cache, trial
+
+no riak node needed
+"""
+
+from struct import pack
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.test.proto_helpers import StringTransport
+
+from riakasaurus import riak, cache
+from riakasaurus.transport import PBCTransport
+from riakasaurus.tx_riak_pb import *
+from riakasaurus.cache import ObjectCache, NegativeCache, NOT_MODIFIED
+from riakasaurus.metadata import *
+
+
+class FakeTransport(object):
+    """a riak in a dict, vclocks count the writes"""
+
+    def __init__(self, client):
+        self.data = {}
+        self.gets = []
+
+    def result(self, key):
+        if key not in self.data:
+            return None
+        vclock, value = self.data[key]
+        return vclock, [({MD_CTYPE: 'application/json', MD_USERMETA: {},
+                          MD_INDEX: []}, value)]
+
+    def get(self, robj, r=None, pr=None, vtag=None, if_modified=None):
+        key = robj.get_key()
+        self.gets.append((key, if_modified is not None))
+        if if_modified is not None and key in self.data and \
+                if_modified[0] == self.data[key][0]:
+            return defer.succeed(NOT_MODIFIED)
+        return defer.succeed(self.result(key))
+
+    def put(self, robj, w=None, dw=None, pw=None, return_body=True,
+            if_none_match=False, if_not_modified=False, return_head=False):
+        key = robj.get_key()
+        vclock = str(int(self.data.get(key, ('0',))[0]) + 1)
+        self.data[key] = (vclock, robj.get_encoded_data())
+        if return_body:
+            return defer.succeed(self.result(key))
+        return defer.succeed(None)
+
+    def delete(self, robj, **kwargs):
+        self.data.pop(robj.get_key(), None)
+        return defer.succeed(None)
+
+
+class Test_ObjectCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(cache, 'reactor', self.clock)
+        self.cache = ObjectCache(max_bytes=100, ttl=10)
+        self.client = riak.RiakClient(transport=FakeTransport, cache=self.cache)
+        self.transport = self.client.get_transport()
+        self.bucket = self.client.bucket('bucket')
+
+    @defer.inlineCallbacks
+    def test_hit_within_ttl(self):
+        yield self.bucket.new('key', 'value').store()
+        obj = yield self.bucket.get('key')
+        self.assertEqual(obj.get_data(), 'value')
+        self.assertEqual(self.transport.gets, [])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 0))
+
+        # every caller gets its own copy
+        obj.set_usermeta({'a': '1'})
+        other = yield self.bucket.get('key')
+        self.assertEqual(other.get_usermeta(), {})
+
+    @defer.inlineCallbacks
+    def test_revalidation(self):
+        self.transport.data['key'] = ('1', '"value"')
+        obj = yield self.bucket.get('key')
+        self.assertEqual(self.cache.misses, 1)
+
+        self.clock.advance(11)
+        obj = yield self.bucket.get('key')
+        self.assertEqual(obj.get_data(), 'value')
+        self.assertEqual(self.transport.gets, [('key', False), ('key', True)])
+        self.assertEqual((self.cache.hits, self.cache.revalidations), (1, 1))
+
+        # changed behind our back, picked up on the next revalidation
+        self.transport.data['key'] = ('2', '"new"')
+        self.clock.advance(11)
+        obj = yield self.bucket.get('key')
+        self.assertEqual(obj.get_data(), 'new')
+        self.assertEqual(self.cache.misses, 2)
+
+    @defer.inlineCallbacks
+    def test_delete_invalidates(self):
+        obj = yield self.bucket.new('key', 'value').store()
+        yield obj.delete()
+        self.assertEqual(len(self.cache), 0)
+        obj = yield self.bucket.get('key')
+        self.assertFalse(obj.exists())
+        self.assertEqual(len(self.cache), 0)
+
+    @defer.inlineCallbacks
+    def test_byte_budget(self):
+        for key in 'abc':
+            yield self.bucket.new(key, 'x' * 40).store()
+        self.assertEqual(len(self.cache), 2)
+        self.assertTrue(self.cache.size <= 100)
+        self.assertEqual(self.cache.evictions, 1)
+
+        # the least recently used one went
+        yield self.bucket.get('a')
+        self.assertEqual(self.transport.gets, [('a', False)])
+
+    @defer.inlineCallbacks
+    def test_bucket_cache(self):
+        own = ObjectCache()
+        bucket = self.client.bucket('other').set_cache(own)
+        yield bucket.new('key', 'value').store()
+        self.assertEqual((len(own), len(self.cache)), (1, 0))
+
+
+class Test_NegativeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(cache, 'reactor', self.clock)
+        self.negative = NegativeCache(max_entries=2, ttl=1)
+        self.client = riak.RiakClient(transport=FakeTransport,
+                                      negative_cache=self.negative)
+        self.transport = self.client.get_transport()
+        self.bucket = self.client.bucket('bucket')
+
+    @defer.inlineCallbacks
+    def test_miss_remembered(self):
+        for i in range(3):
+            obj = yield self.bucket.get('missing')
+            self.assertFalse(obj.exists())
+        obj = yield self.bucket.head('missing')
+        self.assertFalse(obj.exists())
+        self.assertEqual(len(self.transport.gets), 1)
+        self.assertEqual(self.negative.hits, 3)
+
+        self.clock.advance(1)
+        yield self.bucket.get('missing')
+        self.assertEqual(len(self.transport.gets), 2)
+
+    @defer.inlineCallbacks
+    def test_store_invalidates(self):
+        yield self.bucket.get('key')
+        yield self.bucket.new('key', 'value').store()
+        obj = yield self.bucket.get('key')
+        self.assertEqual(obj.get_data(), 'value')
+
+    @defer.inlineCallbacks
+    def test_bounded(self):
+        for key in 'abc':
+            yield self.bucket.get(key)
+        self.assertEqual(len(self.negative), 2)
+        yield self.bucket.get('a')
+        self.assertEqual(len(self.transport.gets), 4)
+
+
+class Connection(object):
+    """stands in for a pooled connection, one RiakPBC in memory"""
+
+    def __init__(self):
+        self.wire = StringTransport()
+        self.protocol = RiakPBCClientFactory().buildProtocol(None)
+        self.protocol.makeConnection(self.wire)
+
+    def getTransport(self):
+        return self.protocol
+
+
+class Test_NegativeCachePBC(unittest.TestCase):
+
+    def setUp(self):
+        self.negative = NegativeCache(ttl=60)
+        self.client = riak.RiakClient(transport=PBCTransport,
+                                      negative_cache=self.negative)
+        self.transport = self.client.get_transport()
+        self.connection = Connection()
+        self.transport._getFreeTransport = \
+            lambda exclusive=False: defer.succeed(self.connection)
+        self.transport._releaseTransport = lambda stp: None
+        self.bucket = self.client.bucket('bucket')
+
+    def tearDown(self):
+        return self.transport.quit()
+
+    def test_miss_remembered(self):
+        d = self.bucket.get('missing')
+        # riak answers a get of a missing key with an empty RpbGetResp
+        self.connection.protocol.dataReceived(pack('!IB', 1, MSG_CODE_GET_RESP))
+        self.assertFalse(self.successResultOf(d).exists())
+
+        self.connection.wire.clear()
+        self.assertFalse(self.successResultOf(self.bucket.get('missing')).exists())
+        self.assertEqual(self.connection.wire.value(), '')
+        self.assertEqual(self.negative.hits, 1)
+
+    def test_empty_message(self):
+        d = self.connection.protocol.get('bucket', 'missing')
+        self.connection.protocol.dataReceived(pack('!IB', 1, MSG_CODE_GET_RESP))
+        self.assertIdentical(self.transport.parseRpbGetResp(self.successResultOf(d)),
+                             None)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+tests for single-flight coalescing of reads, trial
+
+no riak node needed
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from riakasaurus import riak
+from riakasaurus.coalesce import SingleFlight
+from riakasaurus.metadata import *
+
+
+class FakeTransport(object):
+    """answers gets with deferreds the test fires"""
+
+    def __init__(self, client):
+        self.requests = []
+
+    def get(self, robj, r=None, pr=None, vtag=None):
+        d = defer.Deferred()
+        self.requests.append((robj.get_key(), d))
+        return d
+
+    head = get
+
+
+def response(value):
+    metadata = {MD_CTYPE: 'application/json', MD_USERMETA: {'a': '1'},
+                MD_INDEX: []}
+    return 'vclock', [(metadata, value)]
+
+
+class Test_SingleFlight(unittest.TestCase):
+
+    def test_shared_call(self):
+        flight = SingleFlight()
+        call = defer.Deferred()
+        d1 = flight.run('k', lambda: call)
+        d2 = flight.run('k', lambda: self.fail('not shared'))
+        self.assertEqual((flight.calls, flight.shared, len(flight)), (1, 1, 1))
+
+        call.callback(response('1'))
+        r1, r2 = self.successResultOf(d1), self.successResultOf(d2)
+        self.assertEqual(r1, r2)
+        self.assertNotIdentical(r1[1], r2[1])
+        self.assertNotIdentical(r1[1][0][0][MD_USERMETA],
+                                r2[1][0][0][MD_USERMETA])
+        self.assertEqual(len(flight), 0)
+
+    def test_failure_shared(self):
+        flight = SingleFlight()
+        call = defer.Deferred()
+        d1 = flight.run('k', lambda: call)
+        d2 = flight.run('k', lambda: call)
+        call.errback(ValueError('bad'))
+        self.failureResultOf(d1, ValueError)
+        self.failureResultOf(d2, ValueError)
+
+
+class Test_CoalescedReads(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient(transport=FakeTransport,
+                                      coalesce_reads=True)
+        self.transport = self.client.get_transport()
+        self.bucket = self.client.bucket('bucket')
+
+    def test_identical_gets_share_a_request(self):
+        d1 = self.bucket.get('key')
+        d2 = self.bucket.get('key')
+        d3 = self.bucket.get('other')
+        d4 = self.bucket.get('key', r=1)
+        self.assertEqual([k for k, d in self.transport.requests],
+                         ['key', 'other', 'key'])
+
+        self.transport.requests[0][1].callback(response('42'))
+        o1, o2 = self.successResultOf(d1), self.successResultOf(d2)
+        self.assertNotIdentical(o1, o2)
+        self.assertEqual(o1.get_data(), 42)
+        self.assertEqual(o2.get_data(), 42)
+
+        o1.set_usermeta({'b': '2'})
+        self.assertEqual(o2.get_usermeta(), {'a': '1'})
+        self.assertFalse(d3.called)
+        self.assertFalse(d4.called)
+
+    def test_not_coalesced_by_default(self):
+        client = riak.RiakClient(transport=FakeTransport)
+        bucket = client.bucket('bucket')
+        bucket.get('key')
+        bucket.get('key')
+        self.assertEqual(len(client.get_transport().requests), 2)
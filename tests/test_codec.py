@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+tests for the JSON codec selection, trial
+
+no riak node needed
+"""
+
+import json
+import zlib
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from riakasaurus import riak, codec, RiakError
+from riakasaurus.metadata import *
+from riakasaurus.coalesce import copy_result
+
+
+class Test_Codec(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient()
+        self.bucket = self.client.bucket('bucket')
+
+    def tearDown(self):
+        return self.client.get_transport().quit()
+
+    def test_default(self):
+        dumps, loads = codec.json_codec()
+        self.assertEqual(codec.JSON, 'json')
+        self.assertIdentical(loads, json.loads)
+        self.assertIdentical(self.client.get_encoder('application/json'), dumps)
+        self.assertIdentical(self.bucket.get_decoder('text/json'), loads)
+
+    def test_unknown(self):
+        self.assertRaises(RiakError, codec.json_codec, 'nope')
+        self.assertRaises(RiakError, riak.RiakClient, json_codec='nope')
+
+    def test_stdlib(self):
+        client = riak.RiakClient(json_codec='json')
+        self.addCleanup(client.get_transport().quit)
+        self.assertIdentical(client.get_decoder('application/json'), json.loads)
+        self.assertIdentical(client.bucket('b').get_encoder('application/json'),
+                             json.dumps)
+
+    def test_client_change_seen_by_bucket(self):
+        self.bucket.get_decoder('application/json')
+        self.client.set_decoder('application/json', len)
+        self.assertIdentical(self.bucket.get_decoder('application/json'), len)
+
+    def test_bucket_override(self):
+        self.bucket.set_encoder('application/json', repr)
+        self.client.set_encoder('application/json', str)
+        self.client.set_encoder('text/plain', str)
+        self.assertIdentical(self.bucket.get_encoder('application/json'), repr)
+        self.assertIdentical(self.bucket.get_encoder('text/plain'), str)
+        self.assertIdentical(self.bucket.get_encoder('image/png'), None)
+        self.assertIdentical(self.client.bucket('other').get_encoder(
+                             'application/json'), str)
+
+    def test_register(self):
+        self.addCleanup(codec.JSON_CODECS.pop, 'mine')
+        self.addCleanup(codec._preferred.remove, 'mine')
+        self.addCleanup(setattr, codec, 'JSON', codec.JSON)
+
+        codec.register_json('mine', repr, eval)
+        self.bucket.set_json_codec('mine')
+        obj = self.bucket.new('key', {'a': 1})
+        self.assertEqual(obj.get_encoded_data(), "{'a': 1}")
+        self.assertEqual(self.client.get_encoder('application/json'),
+                         codec.json_codec()[0])
+
+        codec.register_json('mine', repr, eval, preferred=True)
+        self.assertEqual(codec.JSON, 'mine')
+
+
+class Test_UjsonFallback(unittest.TestCase):
+
+    if 'ujson' not in codec.JSON_CODECS:
+        skip = 'ujson is not installed'
+
+    def test_values_ujson_rejects(self):
+        dumps, loads = codec.json_codec('ujson')
+        value = {'big': 2 ** 64, 'small': -2 ** 70, 'n': 1}
+        self.assertEqual(json.loads(dumps(value)), value)
+        self.assertEqual(loads(json.dumps(value)), value)
+        self.assertEqual(json.loads(dumps([float('inf')])), [float('inf')])
+        nan, = loads('[NaN]')
+        self.assertNotEqual(nan, nan)
+        self.assertRaises(ValueError, loads, '{"a": ')
+
+    def test_opt_in(self):
+        client = riak.RiakClient(json_codec='ujson')
+        self.addCleanup(client.get_transport().quit)
+        obj = client.bucket('b').new('key', {'big': 2 ** 64})
+        self.assertEqual(json.loads(obj.get_encoded_data()), {'big': 2 ** 64})
+
+
+class FakeTransport(object):
+    """keeps what is stored as Riak would, returns it with the body"""
+
+    def __init__(self, client):
+        self.stored = {}
+
+    def get(self, robj, r=None, pr=None, vtag=None, if_modified=None):
+        return defer.succeed(copy_result(self.stored.get(robj.get_key())))
+
+    def put(self, robj, w=None, dw=None, pw=None, return_body=True,
+            if_none_match=False, if_not_modified=False, return_head=False):
+        value, encoding = robj.get_stored_data()
+        metadata = {MD_CTYPE: robj.get_content_type()}
+        if encoding:
+            metadata[MD_ENCODING] = encoding
+        result = self.stored[robj.get_key()] = ('vclock', [(metadata, value)])
+        if return_head:
+            return defer.succeed(('vclock', [(dict(metadata), '')]))
+        if return_body:
+            return defer.succeed(('vclock', [(dict(metadata), value)]))
+        return defer.succeed(None)
+
+
+class Test_Compression(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient(transport=FakeTransport)
+        self.bucket = self.client.bucket('bucket').set_compression('gzip', 100)
+        self.value = {'text': 'abc' * 100}
+
+    def stored(self, key):
+        return self.client.get_transport().stored[key][1][0]
+
+    @defer.inlineCallbacks
+    def test_store(self):
+        obj = yield self.bucket.new('big', self.value).store()
+        metadata, value = self.stored('big')
+        self.assertEqual(metadata[MD_ENCODING], 'gzip')
+        self.assertEqual(json.loads(codec.gzip_decompress(value)), self.value)
+        self.assertNotIn(MD_ENCODING, obj.get_metadata())
+        self.assertEqual(obj.get_data(), self.value)
+
+        obj = yield self.bucket.new('small', {'text': 'abc'}).store()
+        self.assertNotIn(MD_ENCODING, self.stored('small')[0])
+
+    @defer.inlineCallbacks
+    def test_read_uncompressed_by_any_bucket(self):
+        yield self.bucket.new('big', self.value).store(return_body=False)
+        obj = yield self.client.bucket('bucket').get('big')
+        self.assertEqual(obj.get_data(), self.value)
+        self.assertEqual(json.loads(obj.get_encoded_data()), self.value)
+        self.assertNotIn(MD_ENCODING, obj.get_metadata())
+
+        # compressed again when stored back
+        obj = yield self.bucket.get('big')
+        yield obj.store()
+        self.assertEqual(self.stored('big')[0][MD_ENCODING], 'gzip')
+
+    @defer.inlineCallbacks
+    def test_return_head(self):
+        obj = yield self.bucket.new('big', self.value).store(return_head=True)
+        self.assertNotIn(MD_ENCODING, obj.get_metadata())
+        self.assertEqual(obj.get_data(), self.value)
+
+    @defer.inlineCallbacks
+    def test_application_encoding(self):
+        # compressed by the application, stored as it is
+        obj = self.bucket.new_binary('raw', zlib.compress('x' * 1000))
+        obj.get_metadata()[MD_ENCODING] = 'deflate'
+        yield obj.store(return_body=False)
+        metadata, value = self.stored('raw')
+        self.assertEqual(metadata[MD_ENCODING], 'deflate')
+        self.assertEqual(zlib.decompress(value), 'x' * 1000)
+
+        # unknown encodings are left to the application
+        obj = self.bucket.new_binary('raw', 'x' * 1000)
+        obj.get_metadata()[MD_ENCODING] = 'mine'
+        yield obj.store()
+        self.assertEqual(obj.get_metadata()[MD_ENCODING], 'mine')
+        self.assertEqual(obj.get_data(), 'x' * 1000)
+
+    def test_settings(self):
+        self.assertEqual(self.bucket.get_compression(), ('gzip', 100))
+        self.assertEqual(self.client.bucket('other').get_compression(), None)
+        self.assertRaises(RiakError, self.bucket.set_compression, 'nope')
+        self.bucket.set_compression(None)
+        self.assertEqual(self.bucket.get_compression(), None)
+
+
+class Test_Msgpack(unittest.TestCase):
+
+    if codec.msgpack is None:
+        skip = 'msgpack is not installed'
+
+    def setUp(self):
+        self.client = riak.RiakClient(transport=FakeTransport)
+        self.bucket = self.client.bucket('bucket')
+
+    @defer.inlineCallbacks
+    def test_roundtrip(self):
+        value = {'name': u'b\xf6b', 'raw': '\xff', 'list': [1, 2.5, None],
+                 'nested': {'a': True}}
+        obj = self.bucket.new('key', value, 'application/x-msgpack')
+        yield obj.store(return_body=False)
+        stored = self.client.get_transport().stored['key'][1][0][1]
+        self.assertEqual(stored, codec.msgpack_dumps(value))
+
+        obj = yield self.bucket.get('key')
+        self.assertEqual(obj.get_content_type(), 'application/x-msgpack')
+        self.assertEqual(obj.get_data(), value)
+        self.assertIsInstance(obj.get_data()['raw'], str)
+        self.assertIsInstance(obj.get_data()['name'], unicode)
+
+    def test_unpackable(self):
+        obj = self.bucket.new('key', {'a': object()}, 'application/msgpack')
+        self.assertRaises(TypeError, obj.get_encoded_data)
+        # the packer is not left with half a value
+        self.assertEqual(codec.msgpack_loads(codec.msgpack_dumps([1])), [1])
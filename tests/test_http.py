@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+tests for parsing HTTP responses, trial
+
+no riak node needed
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from riakasaurus import riak
+from riakasaurus.metadata import *
+
+
+SIBLINGS = '\r\n'.join([
+    '',
+    '--XYZ',
+    'Content-Type: application/json',
+    'Etag: 1a',
+    'Last-Modified: Tue, 01 May 2012 10:00:00 GMT',
+    'X-Riak-Meta-Color: red',
+    '',
+    '"one"',
+    '--XYZ',
+    'Content-Type: text/plain',
+    'Etag: 2b',
+    'Link: </riak/b/other>; riaktag="tag"',
+    '',
+    'two',
+    '--XYZ--',
+    ''])
+
+
+class Test_HTTPSiblings(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient()
+        self.transport = self.client.get_transport()
+
+    def tearDown(self):
+        return self.transport.quit()
+
+    def test_multipart_siblings(self):
+        headers = {'http_code': 300,
+                   'content-type': 'multipart/mixed; boundary=XYZ',
+                   'x-riak-vclock': 'vclock'}
+        vclock, contents = self.transport.parse_body((headers, SIBLINGS),
+                                                     [300])
+        self.assertEqual(vclock, 'vclock')
+        self.assertEqual([data for metadata, data in contents],
+                         ['"one"', 'two'])
+        first, second = [metadata for metadata, data in contents]
+        self.assertEqual((first[MD_VTAG], first[MD_USERMETA]),
+                         ('1a', {'color': 'red'}))
+        self.assertEqual((second[MD_CTYPE], len(second[MD_LINKS])),
+                         ('text/plain', 1))
+
+        obj = self.client.bucket('b').new('key')
+        obj.populate((vclock, contents))
+        self.assertEqual(obj.get_data(), 'one')
+        self.assertEqual(sorted(s.get_data() for s in obj._siblings),
+                         ['one', 'two'])
+
+    def test_vtag_siblings(self):
+        headers = {'http_code': 300, 'content-type': 'text/plain'}
+        self.assertEqual(self.transport.parse_body(
+            (headers, 'Siblings:\n1a\n2b\n'), [300]), ['1a', '2b'])
+
+
+class Test_HTTPPut(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient()
+        self.transport = self.client.get_transport()
+        self.bucket = self.client.bucket('b')
+        self.requests = []
+        self.responses = []
+
+        def http_request(method, path, headers={}, body=None, node=None,
+                         receiver=None):
+            self.requests.append((method, path, dict(headers), body))
+            return defer.succeed(self.responses.pop(0))
+        self.transport.http_request = http_request
+
+    def tearDown(self):
+        return self.transport.quit()
+
+    @defer.inlineCallbacks
+    def test_return_head_from_put_response(self):
+        self.responses.append(({'http_code': 200,
+                                'content-type': 'application/json',
+                                'x-riak-vclock': 'vclock2',
+                                'etag': 'tag2'}, '{"a": 1}'))
+        obj = self.bucket.new('key', {'a': 1})
+        yield obj.store(return_head=True)
+        [(method, path, headers, body)] = self.requests
+        self.assertEqual(method, 'PUT')
+        self.assertIn('returnbody=true', path)
+        self.assertEqual(obj.vclock(), 'vclock2')
+        self.assertEqual(obj.get_metadata()[MD_VTAG], 'tag2')
+        self.assertEqual(obj.get_data(), {'a': 1})
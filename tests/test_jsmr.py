@@ -55,6 +55,8 @@ class Tests(unittest.TestCase):
     def tearDown(self):
         yield self.bucket.disable_search()
         yield self.bucket.purge_keys()
+        # close the persistent http connections
+        yield self.client.get_transport().quit()
 
     @defer.inlineCallbacks
     def test_javascript_source_map(self):
@@ -71,6 +73,27 @@ class Tests(unittest.TestCase):
         self.assertEqual(result, [2])
         log.msg('done javascript_source_map')
 
+    @defer.inlineCallbacks
+    def test_javascript_stream(self):
+        """javascript mapping with streamed results"""
+        log.msg('*** javascript_stream')
+        for i in range(1, 4):
+            yield self.bucket.new("foo%d" % i, i).store()
+
+        results = []
+        def on_phase_result(phase, data):
+            self.assertEqual(phase, 0)
+            results.extend(data)
+
+        job = self.client \
+                .add(self.bucket_name, "foo1") \
+                .add(self.bucket_name, "foo2") \
+                .add(self.bucket_name, "foo3") \
+                .map("function (v) { return [JSON.parse(v.values[0].data)]; }")
+        yield job.stream(on_phase_result)
+        self.assertEqual(sorted(results), [1, 2, 3])
+        log.msg('done javascript_stream')
+
     @defer.inlineCallbacks
     def test_javascript_named_map(self):
         """javascript mapping with named map"""
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+tests for node selection and the circuit breaker, trial
+
+no riak node needed
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from riakasaurus import node
+from riakasaurus.node import RiakCluster
+
+
+class Test_RiakCluster(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(node, 'reactor', self.clock)
+        self.alive = set()
+        self.cluster = RiakCluster([('a', 1), ('b', 1), ('c', 1)], self.ping)
+        self.a, self.b, self.c = self.cluster.nodes
+
+    def ping(self, node):
+        return defer.succeed(node in self.alive)
+
+    def test_least_outstanding(self):
+        self.a.start()
+        self.a.start()
+        self.b.start()
+        self.assertIdentical(self.cluster.pick(), self.c)
+        self.c.start()
+        self.c.start()
+        self.assertIdentical(self.cluster.pick(), self.b)
+
+    def test_latency_breaks_ties(self):
+        self.a.finish(0.5)
+        self.b.finish(0.1)
+        self.c.finish(0.3)
+        self.assertIdentical(self.cluster.pick(), self.b)
+
+    def test_exclude(self):
+        self.assertIdentical(self.cluster.pick(exclude=[self.a, self.b]),
+                             self.c)
+
+    def test_circuit_breaker(self):
+        for i in range(RiakCluster.ERROR_THRESHOLD):
+            self.cluster.failed(self.a)
+        self.assertFalse(self.a.is_available())
+        for i in range(10):
+            self.assertNotIdentical(self.cluster.pick(), self.a)
+
+        # still down, keeps probing
+        self.clock.advance(RiakCluster.PROBE_INTERVAL)
+        self.assertFalse(self.a.is_available())
+
+        self.alive.add(self.a)
+        self.clock.advance(RiakCluster.PROBE_INTERVAL)
+        self.assertTrue(self.a.is_available())
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_success_resets_failures(self):
+        for i in range(RiakCluster.ERROR_THRESHOLD - 1):
+            self.cluster.failed(self.a)
+        self.cluster.succeeded(self.a)
+        self.cluster.failed(self.a)
+        self.assertTrue(self.a.is_available())
+
+    def test_all_down(self):
+        for n in self.cluster.nodes:
+            for i in range(RiakCluster.ERROR_THRESHOLD):
+                self.cluster.failed(n)
+        self.assertIdentical(self.cluster.pick(), self.a)
+        self.cluster.stop()
+
+    def test_capabilities(self):
+        self.assertEqual(self.cluster.capabilities, None)
+        self.cluster.set_version(self.a, '1.2.0', 7)
+        self.cluster.set_version(self.b, '1.1.0', 5)
+        self.assertEqual(self.cluster.capabilities, 5)
+
+        # forgotten when a node comes back, it may have been upgraded
+        for i in range(RiakCluster.ERROR_THRESHOLD):
+            self.cluster.failed(self.b)
+        self.alive.add(self.b)
+        self.clock.advance(RiakCluster.PROBE_INTERVAL)
+        self.assertEqual(self.b.capabilities, None)
+        self.assertEqual(self.cluster.capabilities, 7)
@@ -9,7 +9,7 @@ import json
 import random
 from twisted.trial import unittest
 from twisted.python import log
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 
 VERBOSE = False
 
@@ -55,6 +55,8 @@ class Tests(unittest.TestCase):
     def tearDown(self):
         yield self.bucket.disable_search()
         yield self.bucket.purge_keys()
+        # close the persistent http connections
+        yield self.client.get_transport().quit()
 
     @defer.inlineCallbacks
     def test_set_data_empty(self):
@@ -111,6 +113,24 @@ class Tests(unittest.TestCase):
         keys = yield self.bucket.list_keys()
         self.assertEqual([u"foo1", u"foo2"], sorted(keys))
 
+    @defer.inlineCallbacks
+    def test_stream_keys(self):
+        """Test streaming the keys of a bucket."""
+        log.msg("*** stream_keys")
+
+        for i in range(5):
+            yield self.bucket.new("foo%d" % i, i).store()
+
+        keys = []
+        def consumer(batch):
+            keys.extend(batch)
+            d = defer.Deferred()
+            reactor.callLater(0, d.callback, None)
+            return d
+
+        yield self.bucket.stream_keys(consumer)
+        self.assertEqual(["foo%d" % i for i in range(5)], sorted(keys))
+
     @defer.inlineCallbacks
     def test_purge_keys(self):
         """Test purging all keys in a bucket."""
@@ -177,6 +197,48 @@ class Tests(unittest.TestCase):
         self.assertEqual(data, json.loads(obj.get_data()))
         log.msg('done binary_store_and_get')
 
+    @defer.inlineCallbacks
+    def test_multi_get(self):
+        """fetch many objects in one call."""
+        log.msg('*** multi_get')
+        for i in range(10):
+            yield self.bucket.new('foo%d' % i, i).store()
+
+        keys = ['foo%d' % i for i in range(10)] + ['missing']
+        results = yield self.bucket.multi_get(keys, concurrency=3)
+        self.assertEqual(len(results), 11)
+        for i, (success, obj) in enumerate(results[:10]):
+            self.assertTrue(success)
+            self.assertEqual(obj.get_key(), 'foo%d' % i)
+            self.assertEqual(obj.get_data(), i)
+        self.assertTrue(results[10][0])
+        self.assertFalse(results[10][1].exists())
+
+        results = yield self.client.multi_get([(self.bucket_name, 'foo1'),
+                                               (self.bucket, 'foo2')])
+        self.assertEqual([obj.get_data() for success, obj in results], [1, 2])
+        log.msg('done multi_get')
+
+    @defer.inlineCallbacks
+    def test_multi_store_and_delete(self):
+        """store and delete many objects in one call."""
+        log.msg('*** multi_store_and_delete')
+        objs = [self.bucket.new('foo%d' % i, i) for i in range(10)]
+        results = yield self.bucket.multi_store(objs, concurrency=4)
+        self.assertEqual([success for success, obj in results], [True] * 10)
+        self.assertEqual([obj for success, obj in results], objs)
+
+        obj = yield self.bucket.get('foo7')
+        self.assertEqual(obj.get_data(), 7)
+
+        keys = ['foo%d' % i for i in range(5)] + objs[5:]
+        results = yield self.bucket.multi_delete(keys, concurrency=4)
+        self.assertEqual([success for success, obj in results], [True] * 10)
+
+        results = yield self.bucket.multi_get(['foo%d' % i for i in range(10)])
+        self.assertEqual([obj.exists() for success, obj in results], [False] * 10)
+        log.msg('done multi_store_and_delete')
+
     @defer.inlineCallbacks
     def test_missing_object(self):
         """handle missing objects."""
@@ -223,6 +285,7 @@ class Tests(unittest.TestCase):
             client = riak.RiakClient()
             bucket = client.bucket(self.bucket_name)
             yield bucket.new('foo', randint()).store()
+            yield client.get_transport().quit()
 
         # Make sure the object has 5 siblings...
         yield obj.reload()
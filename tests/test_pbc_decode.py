@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+tests for decoding RpbGetResp into get results, trial
+
+no riak node needed
+"""
+
+from struct import pack
+
+from twisted.trial import unittest
+from twisted.test.proto_helpers import StringTransport
+
+from riakasaurus import riak
+from riakasaurus.metadata import *
+from riakasaurus.cache import NOT_MODIFIED
+from riakasaurus.mapreduce import RiakLink
+from riakasaurus.riak_index_entry import RiakIndexEntry
+from riakasaurus.pbc_decode import decode_get_response, parse_get_response
+from riakasaurus.tx_riak_pb import *
+
+
+def response():
+    resp = RpbGetResp()
+    resp.vclock = 'v' * 200
+    content = resp.content.add()
+    content.value = '{"a": "%s"}' % ('x' * 300)
+    content.content_type = 'application/json'
+    content.charset = 'utf-8'
+    content.vtag = 'vtag'
+    content.last_mod = 1335866400
+    content.last_mod_usecs = 123456
+    link = content.links.add()
+    link.bucket, link.key, link.tag = 'b', 'k', 'friend'
+    link = content.links.add()
+    link.bucket, link.key = 'b', 'k2'
+    pair = content.usermeta.add()
+    pair.key, pair.value = 'colour', 'red'
+    for field, value in (('email_bin', 'a@b.c'), ('age_int', '42')):
+        pair = content.indexes.add()
+        pair.key, pair.value = field, value
+    sibling = resp.content.add()
+    sibling.value = ''
+    sibling.deleted = True
+    return resp
+
+
+class Test_DecodeGetResponse(unittest.TestCase):
+
+    def test_same_as_protobuf(self):
+        resp = response()
+        data = resp.SerializeToString()
+        self.assertEqual(decode_get_response(data), parse_get_response(resp))
+        self.assertEqual(decode_get_response(memoryview('\x0a' + data)[1:]),
+                         parse_get_response(resp))
+
+        vclock, [(metadata, value), (deleted, empty)] = decode_get_response(data)
+        self.assertEqual(metadata[MD_LINKS], (('b', 'k', 'friend'), ('b', 'k2', '')))
+        self.assertEqual(metadata[MD_INDEX], (('email_bin', 'a@b.c'), ('age_int', '42')))
+        self.assertEqual(metadata[MD_USERMETA], {'colour': 'red'})
+        self.assertEqual(deleted, {MD_DELETED: True})
+
+    def test_unknown_fields_skipped(self):
+        data = response().SerializeToString()
+        # varint, fixed64, length delimited and fixed32 fields 20 to 23
+        unknown = ('\xa0\x01\x96\x01' + '\xa9\x01' + 'x' * 8 +
+                   '\xb2\x01\x03abc' + '\xbd\x01' + 'x' * 4)
+        self.assertEqual(decode_get_response(unknown + data),
+                         decode_get_response(data))
+
+    def test_not_found(self):
+        self.assertEqual(decode_get_response(''), None)
+
+    def test_unchanged(self):
+        resp = RpbGetResp()
+        resp.unchanged = True
+        self.assertIdentical(decode_get_response(resp.SerializeToString()),
+                             NOT_MODIFIED)
+
+    def test_decoder_error_fails_only_its_request(self):
+        protocol = RiakPBCClientFactory().buildProtocol(None)
+        protocol.makeConnection(StringTransport())
+
+        def broken(body):
+            raise ValueError(body.tobytes())
+        d1 = protocol.get('bucket', 'a', decoder=broken)
+        d2 = protocol.get('bucket', 'b', decoder=decode_get_response)
+        frames = ''.join(pack('!IB', len(body) + 1, MSG_CODE_GET_RESP) + body
+                         for body in ('bad', response().SerializeToString()))
+        protocol.dataReceived(frames)
+        self.failureResultOf(d1, ValueError)
+        self.assertEqual(self.successResultOf(d2)[0], 'v' * 200)
+
+
+class Test_LazyLinksAndIndexes(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient()
+        self.obj = self.client.bucket('bucket').new('key')
+        self.obj.populate(decode_get_response(response().SerializeToString()))
+
+    def tearDown(self):
+        return self.client.get_transport().quit()
+
+    def test_tuples_until_asked_for(self):
+        metadata = self.obj._metadata
+        self.assertIsInstance(metadata[MD_LINKS], tuple)
+        self.assertEqual(self.obj.get_indexes('age_int'), ['42'])
+        self.assertIsInstance(metadata[MD_INDEX], tuple)
+
+        links = self.obj.get_links()
+        self.assertEqual([(l.get_bucket(), l.get_key(), l.get_tag()) for l in links],
+                         [('b', 'k', 'friend'), ('b', 'k2', '')])
+        self.assertIsInstance(links[0], RiakLink)
+        self.assertIdentical(links[0]._client, self.client)
+        self.assertIdentical(self.obj.get_links(), links)
+
+        self.assertEqual(self.obj.get_indexes(),
+                         [RiakIndexEntry('email_bin', 'a@b.c'),
+                          RiakIndexEntry('age_int', '42')])
+
+    def test_changed(self):
+        self.obj.add_index('age_int', 43)
+        self.obj.remove_index('email_bin')
+        self.assertEqual(self.obj.get_indexes('age_int'), ['42', '43'])
+        self.obj.remove_link(RiakLink('b', 'k', 'friend'))
+        self.assertEqual(len(self.obj.get_links()), 1)
+
+    def test_metadata(self):
+        metadata = self.obj.get_metadata()
+        self.assertIsInstance(metadata[MD_LINKS][0], RiakLink)
+        self.assertIsInstance(metadata[MD_INDEX][0], RiakIndexEntry)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+tests for the request templates of prepared buckets, trial
+
+no riak node needed
+"""
+
+from struct import unpack
+
+from twisted.trial import unittest
+from twisted.test.proto_helpers import StringTransport
+
+from riakasaurus import riak
+from riakasaurus.pbc_encode import encode_content
+from riakasaurus.tx_riak_pb import *
+
+
+CONTENT = {'value': '{"a": 1}',
+           'content_type': 'application/json',
+           'charset': 'utf-8',
+           'content_encoding': 'gzip',
+           'links': [('b', 'k', 'friend'), ('b', 'k2', '')],
+           'last_mod': 1335866400,
+           'usermeta': [('colour', 'red')],
+           'indexes': [('email_bin', 'a@b.c'), ('age_int', '42')],
+           'deleted': False}
+
+
+class Test_RequestTemplate(unittest.TestCase):
+
+    def test_content(self):
+        request = RiakPBC._putRequest('bucket', 'key', CONTENT)
+        self.assertEqual(encode_content(CONTENT),
+                         request.content.SerializeToString())
+        self.assertEqual(encode_content('x' * 200),
+                         RiakPBC._putRequest('b', 'k', 'x' * 200).content.SerializeToString())
+
+    def test_get(self):
+        template = RiakPBC.prepareGet('bucket', r='quorum', pr=0, head=True)
+        self.assertEqual(RpbGetReq.FromString(template.body('key', 'vclock')),
+                         RiakPBC._getRequest('bucket', 'key', r='quorum', pr=0,
+                                             head=True, if_modified='vclock'))
+
+    def test_put(self):
+        kwargs = {'w': 'all', 'dw': 1, 'pw': 0, 'return_body': True,
+                  'if_none_match': False}
+        template = RiakPBC.preparePut('bucket', **kwargs)
+        self.assertEqual(RpbPutReq.FromString(template.body('k' * 200, 'vc', CONTENT)),
+                         RiakPBC._putRequest('bucket', 'k' * 200, CONTENT, 'vc', **kwargs))
+        self.assertEqual(RpbPutReq.FromString(template.body('key', None, 'x')),
+                         RiakPBC._putRequest('bucket', 'key', 'x', **kwargs))
+
+    def test_delete(self):
+        template = RiakPBC.prepareDelete('bucket', rw='default', r=2, w=3)
+        self.assertEqual(RpbDelReq.FromString(template.body('key', 'vclock')),
+                         RiakPBC._deleteRequest('bucket', 'key', rw='default', r=2,
+                                                w=3, vclock='vclock'))
+
+    def test_unicode(self):
+        template = RiakPBC.prepareGet('bucket', r=2)
+        self.assertRaises(TypeError, template.body, u'k\xe9y')
+        self.assertRaises(TypeError, RiakPBC.preparePut('bucket').body, 'key',
+                          None, {'value': u'v\xe9'})
+
+    def test_send(self):
+        protocol = RiakPBCClientFactory().buildProtocol(None)
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+
+        template = RiakPBC.prepareDelete('bucket', rw=2)
+        d1, d2 = protocol.sendPreparedMany(template, [('a', None, None),
+                                                      ('b', 'vc', None)])
+        data = transport.value()
+        length, code = unpack('!IB', data[:5])
+        self.assertEqual(code, MSG_CODE_DEL_REQ)
+        self.assertEqual(RpbDelReq.FromString(data[5:4 + length]).key, 'a')
+
+        protocol.dataReceived('\x00\x00\x00\x01\x0e' * 2)
+        self.assertEqual(self.successResultOf(d1), True)
+        self.assertEqual(self.successResultOf(d2), True)
+
+
+class Test_Prepared(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient()
+        self.bucket = self.client.bucket('bucket')
+
+    def tearDown(self):
+        return self.client.get_transport().quit()
+
+    def test_setting(self):
+        self.assertIdentical(self.bucket.get_prepared(), None)
+        templates = self.bucket.set_prepared().get_prepared()
+        self.assertEqual(templates, {})
+        self.assertIdentical(self.bucket.set_prepared().get_prepared(), templates)
+        self.assertIdentical(self.client.bucket('other').get_prepared(), None)
+        self.assertIdentical(self.bucket.set_prepared(False).get_prepared(), None)
@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+"""
+tests for request pipelining on a single RiakPBC connection, trial
+
+these run against an in-memory transport, no riak node needed
+"""
+
+from struct import pack
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+
+from riakasaurus import riak, transport, tx_riak_pb
+from riakasaurus.tx_riak_pb import *
+
+
+def frame(code, message=None):
+    """build a length prefixed response frame like riak sends it"""
+    data = pack('B', code)
+    if message is not None:
+        data += message.SerializeToString()
+    return pack('!I', len(data)) + data
+
+
+class Test_PBCPipelining(unittest.TestCase):
+
+    def setUp(self):
+        factory = RiakPBCClientFactory()
+        self.protocol = factory.buildProtocol(None)
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def test_responses_matched_in_order(self):
+        d1 = self.protocol.ping()
+        d2 = self.protocol.get('bucket', 'key')
+        d3 = self.protocol.ping()
+        self.assertEqual(self.protocol.outstanding(), 3)
+
+        results = []
+        for d in (d1, d2, d3):
+            d.addCallback(results.append)
+
+        response = RpbGetResp()
+        content = response.content.add()
+        content.value = 'foo'
+        self.protocol.dataReceived(frame(MSG_CODE_PING_RESP) +
+                                   frame(MSG_CODE_GET_RESP, response) +
+                                   frame(MSG_CODE_PING_RESP))
+
+        self.assertEqual(self.protocol.outstanding(), 0)
+        self.assertEqual(results[0], True)
+        self.assertEqual(results[1].content[0].value, 'foo')
+        self.assertEqual(results[2], True)
+
+    def test_multi_message_response(self):
+        d1 = self.protocol.getKeys('bucket')
+        d2 = self.protocol.ping()
+
+        part = RpbListKeysResp()
+        part.keys.extend(['a', 'b'])
+        last = RpbListKeysResp()
+        last.keys.append('c')
+        last.done = True
+
+        self.protocol.dataReceived(frame(MSG_CODE_LIST_KEYS_RESP, part))
+        self.assertFalse(d1.called)
+        self.protocol.dataReceived(frame(MSG_CODE_LIST_KEYS_RESP, last) +
+                                   frame(MSG_CODE_PING_RESP))
+
+        self.assertEqual(self.successResultOf(d1), ['a', 'b', 'c'])
+        self.assertEqual(self.successResultOf(d2), True)
+
+    def test_timeout_between_messages(self):
+        clock = task.Clock()
+        self.patch(tx_riak_pb, 'reactor', clock)
+        self.protocol.setTimeout(10)
+        d = self.protocol.getKeys('bucket')
+
+        part = RpbListKeysResp()
+        part.keys.append('a')
+        for i in range(5):
+            clock.advance(8)
+            self.protocol.dataReceived(frame(MSG_CODE_LIST_KEYS_RESP, part))
+        self.assertFalse(d.called)
+
+        # the server stalls after a part of the response
+        clock.advance(10)
+        self.failureResultOf(d, RiakPBCException)
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_no_timeout_after_last_message(self):
+        clock = task.Clock()
+        self.patch(tx_riak_pb, 'reactor', clock)
+        self.protocol.setTimeout(10)
+        d = self.protocol.getKeys('bucket')
+
+        part = RpbListKeysResp()
+        part.keys.append('a')
+        last = RpbListKeysResp()
+        last.done = True
+        self.protocol.dataReceived(frame(MSG_CODE_LIST_KEYS_RESP, part) +
+                                   frame(MSG_CODE_LIST_KEYS_RESP, last))
+        self.assertEqual(clock.getDelayedCalls(), [])
+        self.assertEqual(self.successResultOf(d), ['a'])
+
+    def test_no_timeout_for_slow_consumer(self):
+        clock = task.Clock()
+        self.patch(tx_riak_pb, 'reactor', clock)
+        self.protocol.setTimeout(10)
+        consumed = []
+        waiting = defer.Deferred()
+        def consumer(keys):
+            consumed.append(keys)
+            return waiting
+        d = self.protocol.streamKeys('bucket', consumer)
+
+        part = RpbListKeysResp()
+        part.keys.append('a')
+        self.protocol.dataReceived(frame(MSG_CODE_LIST_KEYS_RESP, part))
+        self.assertEqual(self.transport.producerState, 'paused')
+
+        # reading is paused by the consumer, not stalled by the server
+        clock.advance(11)
+        self.assertFalse(self.transport.disconnecting)
+
+        last = RpbListKeysResp()
+        last.done = True
+        self.protocol.dataReceived(frame(MSG_CODE_LIST_KEYS_RESP, last))
+        waiting.callback(None)
+        self.assertEqual(self.successResultOf(d), None)
+        self.assertEqual(consumed, [['a']])
+        self.assertEqual(clock.getDelayedCalls(), [])
+
+    def test_timeout_after_resume(self):
+        clock = task.Clock()
+        self.patch(tx_riak_pb, 'reactor', clock)
+        self.protocol.setTimeout(10)
+        waiting = defer.Deferred()
+        d = self.protocol.streamKeys('bucket', lambda keys: waiting)
+
+        part = RpbListKeysResp()
+        part.keys.append('a')
+        self.protocol.dataReceived(frame(MSG_CODE_LIST_KEYS_RESP, part))
+        clock.advance(11)
+        waiting.callback(None)
+
+        clock.advance(10)
+        self.failureResultOf(d, RiakPBCException)
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_timeout_starts_at_head_of_queue(self):
+        clock = task.Clock()
+        self.patch(tx_riak_pb, 'reactor', clock)
+        self.protocol.setTimeout(10)
+        d1 = self.protocol.getKeys('bucket')
+        d2 = self.protocol.ping()
+
+        part = RpbListKeysResp()
+        part.keys.append('a')
+        for i in range(3):
+            clock.advance(8)
+            self.protocol.dataReceived(frame(MSG_CODE_LIST_KEYS_RESP, part))
+        last = RpbListKeysResp()
+        last.done = True
+        self.protocol.dataReceived(frame(MSG_CODE_LIST_KEYS_RESP, last))
+        self.assertEqual(self.successResultOf(d1), ['a', 'a', 'a'])
+
+        # the ping waited 24 seconds behind the keys, its own time starts now
+        clock.advance(8)
+        self.assertFalse(d2.called)
+        self.protocol.dataReceived(frame(MSG_CODE_PING_RESP))
+        self.assertEqual(self.successResultOf(d2), True)
+        self.assertEqual(clock.getDelayedCalls(), [])
+
+    def test_error_fails_only_its_request(self):
+        d1 = self.protocol.get('bucket', 'key')
+        d2 = self.protocol.ping()
+
+        error = RpbErrorResp()
+        error.errmsg = 'broken'
+        error.errcode = 1
+        self.protocol.dataReceived(frame(MSG_CODE_ERROR_RESP, error) +
+                                   frame(MSG_CODE_PING_RESP))
+
+        self.failureResultOf(d1, RiakPBCException)
+        self.assertEqual(self.successResultOf(d2), True)
+
+    def test_connection_lost_fails_outstanding(self):
+        d1 = self.protocol.ping()
+        d2 = self.protocol.ping()
+        self.protocol.connectionLost(
+            Failure(RiakPBCException('gone')))
+
+        self.failureResultOf(d1, RiakPBCException)
+        self.failureResultOf(d2, RiakPBCException)
+
+    def test_put_many_single_write(self):
+        writes = []
+        self.transport.writeSequence = writes.append
+        ds = self.protocol.putMany([('bucket', 'a', 'foo', None),
+                                    ('bucket', 'b', 'bar', None)], w=2)
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(self.protocol.outstanding(), 2)
+
+        received = []
+        receiver = RiakPBCClientFactory().buildProtocol(None)
+        receiver.stringReceived = received.append
+        receiver.dataReceived(''.join(writes[0]))
+        self.assertEqual(len(received), 2)
+        request = RpbPutReq()
+        request.ParseFromString(received[1][1:])
+        self.assertEqual((request.key, request.content.value, request.w),
+                         ('b', 'bar', 2))
+
+        self.protocol.dataReceived(frame(MSG_CODE_PUT_RESP) +
+                                   frame(MSG_CODE_PUT_RESP))
+        self.assertTrue(isinstance(self.successResultOf(ds[0]), RpbPutResp))
+        self.assertTrue(isinstance(self.successResultOf(ds[1]), RpbPutResp))
+
+    def test_delete_many_single_write(self):
+        writes = []
+        self.transport.writeSequence = writes.append
+        ds = self.protocol.deleteMany([('bucket', 'a', None),
+                                       ('bucket', 'b', 'vclock')])
+        self.assertEqual(len(writes), 1)
+
+        error = RpbErrorResp()
+        error.errmsg = 'broken'
+        error.errcode = 1
+        self.protocol.dataReceived(frame(MSG_CODE_DEL_RESP) +
+                                   frame(MSG_CODE_ERROR_RESP, error))
+        self.assertEqual(self.successResultOf(ds[0]), True)
+        self.failureResultOf(ds[1], RiakPBCException)
+
+    def test_stream_keys(self):
+        consumed = []
+        waiting = []
+        def consumer(keys):
+            consumed.append(keys)
+            waiting.append(defer.Deferred())
+            return waiting[-1]
+
+        d1 = self.protocol.streamKeys('bucket', consumer)
+        d2 = self.protocol.ping()
+
+        part = RpbListKeysResp()
+        part.keys.extend(['a', 'b'])
+        last = RpbListKeysResp()
+        last.keys.append('c')
+        last.done = True
+
+        self.protocol.dataReceived(frame(MSG_CODE_LIST_KEYS_RESP, part) +
+                                   frame(MSG_CODE_LIST_KEYS_RESP, last) +
+                                   frame(MSG_CODE_PING_RESP))
+        # the consumer is busy, reading stops
+        self.assertEqual(consumed, [['a', 'b']])
+        self.assertEqual(self.transport.producerState, 'paused')
+        self.assertFalse(d2.called)
+
+        waiting[0].callback(None)
+        self.assertEqual(consumed, [['a', 'b'], ['c']])
+        self.assertFalse(d1.called)
+        self.assertFalse(d2.called)
+
+        waiting[1].callback(None)
+        self.assertEqual(self.transport.producerState, 'producing')
+        self.assertEqual(self.successResultOf(d1), None)
+        self.assertEqual(self.successResultOf(d2), True)
+
+    def test_stream_map_reduce(self):
+        consumed = []
+        d = self.protocol.streamMapReduce('{}', consumed.append)
+
+        for phase, data in [(0, '[1]'), (1, '[2]')]:
+            response = RpbMapRedResp()
+            response.phase = phase
+            response.response = data
+            self.protocol.dataReceived(frame(MSG_CODE_MAPRED_RESP, response))
+        self.assertFalse(d.called)
+
+        done = RpbMapRedResp()
+        done.done = True
+        self.protocol.dataReceived(frame(MSG_CODE_MAPRED_RESP, done))
+        self.assertEqual(consumed, [(0, '[1]'), (1, '[2]')])
+        self.assertEqual(self.successResultOf(d), None)
+
+    def test_index_query(self):
+        received = []
+        receiver = RiakPBCClientFactory().buildProtocol(None)
+        receiver.stringReceived = received.append
+
+        d1 = self.protocol.getIndex('bucket', 'field_bin', 'a')
+        d2 = self.protocol.getIndex('bucket', 'field_int', 1, 10)
+        receiver.dataReceived(self.transport.value())
+
+        eq, rng = RpbIndexReq(), RpbIndexReq()
+        eq.ParseFromString(received[0][1:])
+        rng.ParseFromString(received[1][1:])
+        self.assertEqual((eq.qtype, eq.key), (RpbIndexReq.eq, 'a'))
+        self.assertEqual((rng.qtype, rng.range_min, rng.range_max),
+                         (RpbIndexReq.range, '1', '10'))
+
+        response = RpbIndexResp()
+        response.keys.extend(['k1', 'k2'])
+        self.protocol.dataReceived(frame(MSG_CODE_INDEX_RESP, response) +
+                                   frame(MSG_CODE_INDEX_RESP))
+        self.assertEqual(list(self.successResultOf(d1).keys), ['k1', 'k2'])
+        self.assertEqual(list(self.successResultOf(d2).keys), [])
+
+
+class Test_Batches(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient(transport=transport.PBCTransport)
+        self.pbc = self.client.get_transport()
+        self.wire = StringTransport()
+        self.protocol = RiakPBCClientFactory().buildProtocol(None)
+        self.protocol.makeConnection(self.wire)
+
+        class Connection(object):
+            getTransport = lambda connection: self.protocol
+        self.pbc._getFreeTransport = \
+            lambda exclusive=False: defer.succeed(Connection())
+        self.pbc._releaseTransport = lambda stp: None
+        node = self.pbc._cluster.nodes[0]
+        self.pbc._cluster.set_version(node, '1.2.0',
+                                      transport.capabilities('1.2.0'))
+        self.bucket = self.client.bucket('bucket')
+
+    def tearDown(self):
+        return self.pbc.quit()
+
+    def sent(self):
+        received = []
+        receiver = RiakPBCClientFactory().buildProtocol(None)
+        receiver.stringReceived = lambda data: received.append(data.tobytes())
+        receiver.dataReceived(self.wire.value())
+        return received
+
+    def test_bad_object_in_put_batch(self):
+        for prepared in (False, True):
+            self.wire.clear()
+            self.bucket.set_prepared(prepared)
+            objs = [self.bucket.new('a', 1), self.bucket.new('b', object()),
+                    self.bucket.new('c', 3)]
+            d = self.bucket.multi_store(objs)
+            sent = self.sent()
+            self.assertEqual([RpbPutReq.FromString(data[1:]).key
+                              for data in sent], ['a', 'c'])
+            self.protocol.dataReceived(frame(MSG_CODE_PUT_RESP) * 2)
+
+            (ok1, r1), (ok2, r2), (ok3, r3) = self.successResultOf(d)
+            self.assertEqual((ok1, ok2, ok3), (True, False, True))
+            self.assertEqual((r1, r3), (objs[0], objs[2]))
+            r2.trap(TypeError)
+
+    def test_bad_key_in_delete_batch(self):
+        for prepared in (False, True):
+            self.wire.clear()
+            self.bucket.set_prepared(prepared)
+            bad = self.bucket.new('b')
+            bad._key = 5
+            d = self.bucket.multi_delete(['a', bad, 'c'])
+            self.assertEqual([RpbDelReq.FromString(data[1:]).key
+                              for data in self.sent()], ['a', 'c'])
+            self.protocol.dataReceived(frame(MSG_CODE_DEL_RESP) * 2)
+
+            results = self.successResultOf(d)
+            self.assertEqual([ok for ok, result in results], [True, False, True])
+            results[1][1].trap(TypeError)
+
+
+class Test_FrameReceiver(unittest.TestCase):
+
+    def setUp(self):
+        self.receiver = FrameReceiver()
+        self.receiver.makeConnection(StringTransport())
+        self.received = []
+        self.receiver.stringReceived = self.received.append
+
+    def test_frames_in_one_chunk(self):
+        self.receiver.dataReceived(pack('!I', 3) + 'abc' + pack('!I', 2) + 'de')
+        self.assertEqual([f.tobytes() for f in self.received], ['abc', 'de'])
+        self.assertIsInstance(self.received[0], memoryview)
+        self.assertEqual(len(self.receiver._chunks), 0)
+
+    def test_frame_split_over_chunks(self):
+        data = pack('!I', 5) + 'abcde' + pack('!I', 0) + pack('!I', 1) + 'f'
+        for i in range(len(data)):
+            self.receiver.dataReceived(data[i])
+        self.assertEqual([f.tobytes() for f in self.received], ['abcde', '', 'f'])
+        self.assertEqual(self.receiver._buffered, 0)
+
+    def test_paused(self):
+        def received(frame):
+            self.received.append(frame)
+            self.receiver.pauseProducing()
+        self.receiver.stringReceived = received
+        self.receiver.dataReceived(pack('!I', 1) + 'a' + pack('!I', 1) + 'b')
+        self.assertEqual(len(self.received), 1)
+        self.receiver.resumeProducing()
+        self.assertEqual([f.tobytes() for f in self.received], ['a', 'b'])
+
+    def test_too_long(self):
+        self.receiver.MAX_LENGTH = 10
+        self.receiver.dataReceived(pack('!I', 11) + 'a')
+        self.assertTrue(self.receiver.transport.disconnecting)
+        self.assertEqual(self.received, [])
+
+    def test_send_frames(self):
+        writes = []
+        self.receiver.transport.writeSequence = writes.append
+        body = 'x' * 100
+        self.receiver.sendFrames([('\x01', ''), ('\x0b', body)])
+        self.assertEqual(writes, [[pack('!I', 1) + '\x01',
+                                   pack('!I', 101) + '\x0b', body]])
+        self.assertIdentical(writes[0][2], body)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""
+tests for the PBC connection pool, trial
+
+connections are faked, no riak node needed
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from riakasaurus import RiakError, riak, transport
+from riakasaurus.transport import PBCConnectionPool
+
+
+class FakeConnection(object):
+    connected = 1
+
+    def setTimeout(self, t):
+        pass
+
+    def quit(self):
+        self.connected = 0
+
+
+class FakeConnector(object):
+    """hands out connections right away, counts how many were made"""
+    made = 0
+
+    def connect(self, host, port):
+        FakeConnector.made += 1
+        return defer.succeed(FakeConnection())
+
+
+class Test_PBCConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        FakeConnector.made = 0
+
+    def pool(self, **kwargs):
+        pool = PBCConnectionPool('127.0.0.1', 8087, **kwargs)
+        pool.connector = FakeConnector
+        return pool
+
+    def test_pipelines_before_connecting(self):
+        pool = self.pool(max_connections=2, pipeline_depth=3)
+        stps = [self.successResultOf(pool.acquire()) for i in range(3)]
+        self.assertEqual(FakeConnector.made, 1)
+        self.assertEqual(stps[0].load(), 3)
+
+        stp = self.successResultOf(pool.acquire())
+        self.assertEqual(FakeConnector.made, 2)
+        self.assertNotIdentical(stp, stps[0])
+
+    def test_waiter_served_on_release(self):
+        pool = self.pool(max_connections=1, pipeline_depth=1)
+        stp = self.successResultOf(pool.acquire())
+        d = pool.acquire()
+        self.assertNoResult(d)
+
+        pool.release(stp)
+        self.assertIdentical(self.successResultOf(d), stp)
+        self.assertEqual(stp.load(), 1)
+
+    def test_exclusive_gets_own_connection(self):
+        pool = self.pool(max_connections=2, pipeline_depth=8)
+        shared = self.successResultOf(pool.acquire())
+        exclusive = self.successResultOf(pool.acquire(exclusive=True))
+        self.assertNotIdentical(shared, exclusive)
+
+        # nothing is pipelined onto the exclusive connection
+        for i in range(5):
+            self.assertIdentical(self.successResultOf(pool.acquire()), shared)
+
+    def test_acquire_timeout(self):
+        clock = task.Clock()
+        self.patch(transport, 'reactor', clock)
+        pool = self.pool(max_connections=1, pipeline_depth=1,
+                         acquire_timeout=5)
+        self.successResultOf(pool.acquire())
+        d = pool.acquire()
+        clock.advance(5)
+        self.failureResultOf(d, RiakError)
+
+    def test_dead_connection_is_replaced(self):
+        pool = self.pool(max_connections=1, pipeline_depth=1)
+        stp = self.successResultOf(pool.acquire())
+        d = pool.acquire()
+
+        stp.getTransport().connected = 0
+        pool.release(stp)
+        self.assertNotIdentical(self.successResultOf(d), stp)
+        self.assertEqual(FakeConnector.made, 2)
+
+    @defer.inlineCallbacks
+    def test_on_connect(self):
+        connected = []
+        def on_connect(node, connection):
+            connected.append((node, connection))
+            return defer.succeed(None)
+
+        pool = self.pool(node='node', on_connect=on_connect)
+        stp = yield pool.acquire()
+        self.assertEqual(connected, [('node', stp.getTransport())])
+
+    def test_warm(self):
+        pool = self.pool(min_idle=3)
+        pool.warm()
+        self.assertEqual(pool.size(), 3)
+        self.successResultOf(pool.acquire(exclusive=True))
+        self.assertEqual(FakeConnector.made, 3)
+
+
+class Test_Capabilities(unittest.TestCase):
+
+    def test_versions(self):
+        self.assertEqual(transport.capabilities('0.14.0'), 0)
+        caps = transport.capabilities('1.1.4')
+        self.assertTrue(caps & transport.TOMBSTONE_VCLOCKS)
+        self.assertTrue(caps & transport.PHASELESS_MAPRED)
+        self.assertFalse(caps & transport.PB_INDEXES)
+
+    def test_version_suffixes(self):
+        self.assertEqual(transport.capabilities('1.4.2-0-g61ac9d8'),
+                         transport.capabilities('1.4.2'))
+        self.assertEqual(transport.capabilities('2.0.0pre5'),
+                         transport.capabilities('2.0.0'))
+        self.assertEqual(transport.capabilities('1.2'),
+                         transport.capabilities('1.2.0'))
+        self.assertEqual(transport.capabilities('unknown'), None)
+
+    def test_unreadable_version_on_connect(self):
+        client = riak.RiakClient(transport=transport.PBCTransport)
+        t = client.get_transport()
+        self.addCleanup(t.quit)
+
+        class Connection(object):
+            def getServerInfo(self):
+                return defer.succeed(ServerInfo())
+
+        class ServerInfo(object):
+            server_version = 'unknown'
+
+        node = t._cluster.nodes[0]
+        self.successResultOf(t._connected(node, Connection()))
+        self.assertEqual(node.capabilities, None)
+        self.assertEqual(self.successResultOf(t.capabilities()), 0)
+
+    def test_delete_holds_one_connection(self):
+        client = riak.RiakClient(transport=transport.PBCTransport)
+        t = client.get_transport()
+        self.addCleanup(t.quit)
+        held = []
+        deleted = []
+
+        class ServerInfo(object):
+            server_version = '1.2.0'
+
+        class Connection(object):
+            def getServerInfo(self):
+                return defer.succeed(ServerInfo())
+
+            def delete(self, bucket, key, **kwargs):
+                deleted.append(kwargs.get('vclock'))
+                return defer.succeed(True)
+
+        class Pool(object):
+            node = t._cluster.nodes[0]
+
+        class Stp(object):
+            getTransport = lambda stp: Connection()
+            getPool = lambda stp: Pool()
+
+        def acquire(exclusive=False):
+            # with a single connection a second one is never handed out
+            self.assertEqual(held, [])
+            held.append(Stp())
+            return defer.succeed(held[-1])
+        t._getFreeTransport = acquire
+        t._releaseTransport = held.remove
+
+        # the version of the node is not known yet
+        obj = client.bucket('bucket').new('key')
+        obj._vclock = 'vclock'
+        self.successResultOf(t.delete(obj))
+        self.assertEqual(deleted, ['vclock'])
+        self.assertEqual(held, [])
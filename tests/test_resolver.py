@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+tests for sibling resolution, trial
+
+no riak node needed
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from riakasaurus import riak, resolver
+from riakasaurus.metadata import *
+
+
+def content(value, lastmod, usecs=0):
+    return ({MD_CTYPE: 'application/json', MD_USERMETA: {}, MD_INDEX: [],
+             MD_LASTMOD: lastmod, MD_LASTMOD_USECS: usecs}, value)
+
+
+class FakeTransport(object):
+    """holds one key with siblings, records what is stored"""
+
+    def __init__(self, client):
+        self.stored = []
+
+    def get(self, robj, r=None, pr=None, vtag=None, if_modified=None):
+        return defer.succeed(('vclock', [
+            content('["a", "b"]', 'Tue, 01 May 2012 10:00:05 GMT'),
+            content('["b", "c"]', 'Tue, 01 May 2012 10:00:00 GMT')]))
+
+    def put(self, robj, w=None, dw=None, pw=None, return_body=True,
+            if_none_match=False, if_not_modified=False, return_head=False):
+        self.stored.append((robj.vclock(), robj.get_data()))
+        return defer.succeed(None)
+
+
+class Test_Resolver(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient(transport=FakeTransport)
+        self.transport = self.client.get_transport()
+        self.bucket = self.client.bucket('bucket')
+
+    @defer.inlineCallbacks
+    def test_unresolved(self):
+        obj = yield self.bucket.get('key')
+        self.assertEqual(obj.get_sibling_count(), 2)
+
+    @defer.inlineCallbacks
+    def test_last_write_wins(self):
+        self.bucket.set_resolver(resolver.last_write_wins)
+        obj = yield self.bucket.get('key')
+        self.assertFalse(obj.has_siblings())
+        self.assertEqual((obj.vclock(), obj.get_data()), ('vclock', ['a', 'b']))
+        self.assertEqual(self.transport.stored, [])
+
+    @defer.inlineCallbacks
+    def test_union_write_back(self):
+        self.client.set_resolver(resolver.union, write_back=True)
+        obj = yield self.bucket.get('key')
+        self.assertEqual(sorted(obj.get_data()), ['a', 'b', 'c'])
+        [(vclock, data)] = self.transport.stored
+        self.assertEqual((vclock, sorted(data)), ('vclock', ['a', 'b', 'c']))
+
+    @defer.inlineCallbacks
+    def test_merge(self):
+        self.bucket.set_resolver(resolver.merge(lambda a, b: a + b))
+        obj = yield self.bucket.get('key')
+        self.assertEqual(sorted(obj.get_data()), ['a', 'b', 'b', 'c'])
+
+    def test_last_modified(self):
+        obj = self.bucket.new('key')
+        obj.set_metadata({MD_LASTMOD: 1335866400, MD_LASTMOD_USECS: 500000})
+        self.assertEqual(resolver.last_modified(obj), 1335866400.5)
+        obj.set_metadata({MD_LASTMOD: 'Tue, 01 May 2012 10:00:00 GMT'})
+        self.assertEqual(resolver.last_modified(obj), 1335866400)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+tests for RiakObject without a riak node, trial
+"""
+
+import json
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from riakasaurus import riak
+from riakasaurus.metadata import *
+from riakasaurus.riak_object import RiakObject
+from riakasaurus.riak_index_entry import RiakIndexEntry
+
+
+class Test_LazyData(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient()
+        self.bucket = self.client.bucket('bucket')
+        self.decoded = []
+
+        def decoder(data):
+            self.decoded.append(data)
+            return {'decoded': data}
+        self.bucket.set_decoder('application/json', decoder)
+
+    def tearDown(self):
+        return self.client.get_transport().quit()
+
+    def populate(self, *values):
+        obj = self.bucket.new('key')
+        obj.populate(('vclock', [({MD_CTYPE: 'application/json'}, value)
+                                 for value in values]))
+        return obj
+
+    def test_decoded_on_first_access(self):
+        obj = self.populate('"a"', '"b"')
+        self.assertTrue(obj.exists())
+        self.assertEqual(obj.get_raw_data(), '"a"')
+        self.assertEqual(obj.get_encoded_data(), '"a"')
+        self.assertEqual(self.decoded, [])
+
+        self.assertEqual(obj.get_data(), {'decoded': '"a"'})
+        obj.get_data()
+        self.assertEqual(self.decoded, ['"a"'])
+
+    def test_set_data(self):
+        obj = self.populate('"a"')
+        obj.get_data()['more'] = 1
+        self.assertEqual(obj.get_raw_data(), '"a"')
+        self.assertEqual(json.loads(obj.get_encoded_data()),
+                         {'decoded': '"a"', 'more': 1})
+
+        obj.set_data([1])
+        self.assertEqual(obj.get_raw_data(), '[1]')
+        self.assertEqual(self.decoded, ['"a"'])
+
+    def test_binary(self):
+        obj = self.bucket.new_binary('key', '')
+        obj.populate(('vclock', [({MD_CTYPE: 'application/json'}, '"a"')]))
+        self.assertEqual(obj.get_data(), '"a"')
+        self.assertEqual(self.decoded, [])
+
+
+class Test_LazyMetadata(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient()
+        self.bucket = self.client.bucket('bucket')
+
+    def tearDown(self):
+        return self.client.get_transport().quit()
+
+    def test_empty(self):
+        obj = self.bucket.new('key', {})
+        self.assertEqual(obj.get_metadata(), {MD_CTYPE: 'application/json',
+                                              MD_USERMETA: {}, MD_INDEX: []})
+        self.assertEqual(obj.get_usermeta(), {})
+        self.assertEqual(obj.get_indexes(), [])
+        self.assertEqual(obj.get_indexes('field_bin'), [])
+        self.assertEqual(obj.get_links(), [])
+        self.assertFalse(hasattr(obj, '__dict__'))
+
+    def test_added_on_demand(self):
+        obj = self.bucket.new('key', {})
+        obj.add_index('field_bin', 'a')
+        obj.add_meta_data('colour', 'red')
+        obj.add_link(self.bucket.new('other'))
+        self.assertEqual(obj.get_indexes('field_bin'), ['a'])
+        self.assertEqual(obj.get_usermeta(), {'colour': 'red'})
+        self.assertEqual([l.get_key() for l in obj.get_links()], ['other'])
+
+        obj.remove_index('field_bin')
+        self.assertEqual(obj.get_indexes(), [])
+
+    def test_containers_kept_when_read(self):
+        obj = RiakObject(None, None, 'key')
+        obj.get_usermeta()['a'] = 'b'
+        self.assertEqual(obj.get_usermeta(), {'a': 'b'})
+        self.assertEqual(obj.get_metadata()[MD_USERMETA], {'a': 'b'})
+        self.assertEqual(obj.get_all_meta_data(), {'a': 'b'})
+
+        obj = RiakObject(None, None, 'key')
+        obj.get_metadata()[MD_INDEX].append(RiakIndexEntry('field_bin', 'x'))
+        self.assertEqual(obj.get_indexes('field_bin'), ['x'])
+
+    @defer.inlineCallbacks
+    def test_store_changed_usermeta(self):
+        client = riak.RiakClient(transport=UsermetaTransport)
+        obj = client.bucket('bucket').new('key', {})
+        obj.get_usermeta()['colour'] = 'red'
+        yield obj.store(return_body=False)
+        self.assertEqual(client.get_transport().stored, {'colour': 'red'})
+
+
+class UsermetaTransport(object):
+    """keeps the usermeta of the last object stored"""
+
+    def __init__(self, client):
+        self.stored = None
+
+    def put(self, robj, w=None, dw=None, pw=None, return_body=True,
+            if_none_match=False, if_not_modified=False, return_head=False):
+        self.stored = dict(robj.get_usermeta())
+        return defer.succeed(None)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+tests for streamed responses and their backpressure, trial
+
+no riak node needed
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone
+
+from riakasaurus import RiakError
+from riakasaurus.stream import ResultStream
+from riakasaurus.transport import KeyStreamReceiver, MultipartParser
+
+
+class FakeProducer(object):
+    paused = False
+    stopped = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        self.stopped = True
+
+
+class Test_ResultStream(unittest.TestCase):
+
+    def setUp(self):
+        self.producer = FakeProducer()
+        self.consumed = []
+        self.waiting = None
+        self.stream = ResultStream(self.consume, self.producer)
+
+    def consume(self, batch):
+        self.consumed.append(batch)
+        return self.waiting
+
+    def test_synchronous_consumer(self):
+        self.stream.deliver([1, 2])
+        self.stream.deliver([3])
+        self.assertFalse(self.stream.d.called)
+        self.stream.finish()
+        self.assertEqual(self.consumed, [[1, 2], [3]])
+        self.assertEqual(self.successResultOf(self.stream.d), None)
+        self.assertFalse(self.producer.paused)
+
+    def test_backpressure(self):
+        self.waiting = d = defer.Deferred()
+        self.stream.deliver([1])
+        self.assertTrue(self.producer.paused)
+
+        # arrives while paused, held back until the consumer is done
+        self.stream.deliver([2])
+        self.stream.finish()
+        self.assertEqual(self.consumed, [[1]])
+        self.assertFalse(self.stream.d.called)
+
+        self.waiting = None
+        d.callback(None)
+        self.assertFalse(self.producer.paused)
+        self.assertEqual(self.consumed, [[1], [2]])
+        self.assertEqual(self.successResultOf(self.stream.d), None)
+
+    def test_consumer_failure(self):
+        self.waiting = defer.fail(ValueError('bad'))
+        self.stream.deliver([1])
+        self.stream.deliver([2])
+        self.stream.finish()
+        self.assertEqual(self.consumed, [[1]])
+        self.failureResultOf(self.stream.d, ValueError)
+
+    def test_response_failure(self):
+        self.stream.deliver([1])
+        self.stream.fail(Failure(IOError('gone')))
+        self.failureResultOf(self.stream.d, IOError)
+
+
+class Test_KeyStreamReceiver(unittest.TestCase):
+
+    def test_split_objects(self):
+        consumed = []
+        stream = ResultStream(consumed.append)
+        receiver = KeyStreamReceiver(stream)
+        receiver.makeConnection(FakeProducer())
+
+        receiver.dataReceived('{"keys":[]}{"keys":["a",')
+        self.assertEqual(consumed, [])
+        receiver.dataReceived('"b"]}\n{"keys":["c"]}')
+        self.assertEqual(consumed, [['a', 'b'], ['c']])
+
+        receiver.connectionLost(Failure(ResponseDone()))
+        self.assertEqual(self.successResultOf(stream.d), None)
+
+    def test_byte_at_a_time(self):
+        consumed = []
+        stream = ResultStream(consumed.append)
+        receiver = KeyStreamReceiver(stream)
+        receiver.makeConnection(FakeProducer())
+
+        body = '{"keys":["a}\\"{", "b"]}\n{"keys":["%s"]}' % ('k' * 1000)
+        for c in body:
+            receiver.dataReceived(c)
+        self.assertEqual(consumed, [['a}"{', 'b'], ['k' * 1000]])
+
+        receiver.connectionLost(Failure(ResponseDone()))
+        self.assertEqual(self.successResultOf(stream.d), None)
+
+    def test_malformed_object(self):
+        consumed = []
+        stream = ResultStream(consumed.append)
+        receiver = KeyStreamReceiver(stream)
+        producer = FakeProducer()
+        receiver.makeConnection(producer)
+
+        receiver.dataReceived('{"keys":["a"]}{"keys":[b]}{"keys":["c"]}')
+        self.assertEqual(consumed, [['a']])
+        # the rest of the response is not read
+        self.assertTrue(producer.stopped)
+        receiver.dataReceived('{"keys":["d"]}{"keys":')
+        self.assertEqual(consumed, [['a']])
+        receiver.connectionLost(Failure(ResponseDone()))
+        self.failureResultOf(stream.d, ValueError)
+
+    def test_left_over(self):
+        consumed = []
+        stream = ResultStream(consumed.append)
+        receiver = KeyStreamReceiver(stream)
+        receiver.makeConnection(FakeProducer())
+
+        receiver.dataReceived('{"keys":["a"]}{"keys":["b"')
+        receiver.connectionLost(Failure(ResponseDone()))
+        self.assertEqual(consumed, [['a']])
+        self.failureResultOf(stream.d, RiakError)
+
+
+class Test_MultipartParser(unittest.TestCase):
+
+    body = ('\r\n--XYZ\r\nContent-Type: application/json\r\n\r\n'
+            '{"phase":0,"data":[1]}\r\n'
+            '--XYZ\r\nContent-Type: application/json\r\n\r\n'
+            '{"phase":1,"data":[2]}\r\n'
+            '--XYZ--\r\n')
+
+    def test_whole_body(self):
+        parts = []
+        MultipartParser('XYZ', lambda h, b: parts.append((h, b))).feed(self.body)
+        self.assertEqual(parts, [
+                ({'content-type': 'application/json'}, '{"phase":0,"data":[1]}'),
+                ({'content-type': 'application/json'}, '{"phase":1,"data":[2]}')])
+
+    def test_byte_at_a_time(self):
+        parts = []
+        parser = MultipartParser('XYZ', lambda h, b: parts.append(b))
+        for c in self.body[:self.body.index('{"phase":1')]:
+            parser.feed(c)
+        # a part is handed over as soon as it is complete
+        self.assertEqual(parts, ['{"phase":0,"data":[1]}'])
+
+        for c in self.body[self.body.index('{"phase":1'):]:
+            parser.feed(c)
+        self.assertEqual(parts, ['{"phase":0,"data":[1]}',
+                                 '{"phase":1,"data":[2]}'])
+        self.assertTrue(parser.done)
+
+    def test_boundary(self):
+        self.assertEqual(MultipartParser.boundary(
+                'multipart/mixed; boundary=XYZ'), 'XYZ')
+        self.assertEqual(MultipartParser.boundary(
+                'multipart/mixed; boundary="XYZ"; charset=utf-8'), 'XYZ')
+        self.assertEqual(MultipartParser.boundary('application/json'), None)
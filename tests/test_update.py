@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+tests for conditional read-modify-write, trial
+
+no riak node needed
+"""
+
+from struct import pack
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.test.proto_helpers import StringTransport
+
+from riakasaurus import riak, RiakError, RiakConflictError
+from riakasaurus.metadata import *
+from riakasaurus.transport import PBCTransport
+from riakasaurus.tx_riak_pb import *
+
+
+class FakeTransport(object):
+    """a riak in a dict that checks the conditions of puts"""
+
+    def __init__(self, client):
+        self.data = {}
+        self.puts = 0
+        self.before_put = None      # called before a put is applied
+
+    def result(self, key, head=False):
+        if key not in self.data:
+            return None
+        vclock, value = self.data[key]
+        return vclock, [({MD_CTYPE: 'application/json', MD_USERMETA: {},
+                          MD_INDEX: [], MD_VTAG: vclock}, head and '' or value)]
+
+    def get(self, robj, r=None, pr=None, vtag=None, if_modified=None):
+        return defer.succeed(self.result(robj.get_key()))
+
+    def put(self, robj, w=None, dw=None, pw=None, return_body=True,
+            if_none_match=False, if_not_modified=False, return_head=False):
+        self.puts += 1
+        if self.before_put is not None:
+            self.before_put()
+        key = robj.get_key()
+        vclock = self.data.get(key, ('0',))[0]
+        if if_none_match and key in self.data:
+            return defer.fail(RiakConflictError('match_found'))
+        if if_not_modified and robj.vclock() != vclock:
+            return defer.fail(RiakConflictError('modified'))
+        self.data[key] = (str(int(vclock) + 1), robj.get_encoded_data())
+        if return_head:
+            return defer.succeed(self.result(key, head=True))
+        return defer.succeed(return_body and self.result(key) or None)
+
+
+class Test_Update(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient(transport=FakeTransport)
+        self.transport = self.client.get_transport()
+        self.bucket = self.client.bucket('bucket')
+
+    def increment(self, value):
+        return (value or 0) + 1
+
+    @defer.inlineCallbacks
+    def test_update(self):
+        obj = yield self.bucket.update('counter', self.increment)
+        self.assertEqual((obj.get_data(), obj.vclock()), (1, '1'))
+        obj = yield self.bucket.update('counter', self.increment)
+        self.assertEqual((obj.get_data(), obj.vclock()), (2, '2'))
+        self.assertEqual(self.transport.puts, 2)
+
+    @defer.inlineCallbacks
+    def test_store_return_head(self):
+        obj = self.bucket.new('key', {'big': 'value'})
+        yield obj.store(return_head=True)
+        yield obj.store(return_head=True)
+        self.assertEqual(obj.vclock(), '2')
+        self.assertEqual(obj.get_metadata()[MD_VTAG], '2')
+        self.assertEqual(obj.get_data(), {'big': 'value'})
+
+    @defer.inlineCallbacks
+    def test_retry_on_conflict(self):
+        yield self.bucket.update('counter', self.increment)
+
+        # somebody else writes in between the first read and write
+        def race():
+            self.transport.before_put = None
+            self.transport.data['counter'] = ('5', '10')
+        self.transport.before_put = race
+
+        obj = yield self.bucket.update('counter', self.increment, backoff=0)
+        self.assertEqual(obj.get_data(), 11)
+        self.assertEqual(self.transport.puts, 3)
+
+    @defer.inlineCallbacks
+    def test_retries_exhausted(self):
+        def race():
+            vclock = str(self.transport.puts + 5)
+            self.transport.data['counter'] = (vclock, '10')
+        self.transport.before_put = race
+
+        d = self.bucket.update('counter', self.increment, retries=2, backoff=0)
+        yield self.assertFailure(d, RiakConflictError)
+        self.assertEqual(self.transport.puts, 3)
+
+
+class Test_PBCConditions(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient(transport=PBCTransport)
+        self.transport = self.client.get_transport()
+        self.wire = StringTransport()
+        self.protocol = RiakPBCClientFactory().buildProtocol(None)
+        self.protocol.makeConnection(self.wire)
+
+        class Connection(object):
+            getTransport = lambda connection: self.protocol
+        self.transport._getFreeTransport = \
+            lambda exclusive=False: defer.succeed(Connection())
+        self.transport._releaseTransport = lambda stp: None
+
+    def tearDown(self):
+        return self.transport.quit()
+
+    def fail_with(self, errmsg, **kwargs):
+        obj = self.client.bucket('bucket').new('key', {'a': 1})
+        d = obj.store(**kwargs)
+        error = RpbErrorResp()
+        error.errmsg = errmsg
+        error.errcode = 1
+        body = pack('B', MSG_CODE_ERROR_RESP) + error.SerializeToString()
+        self.protocol.dataReceived(pack('!I', len(body)) + body)
+        return d
+
+    def test_modified(self):
+        self.failureResultOf(self.fail_with('modified', if_not_modified=True),
+                             RiakConflictError)
+
+    def test_match_found(self):
+        self.failureResultOf(self.fail_with('match_found', if_none_match=True),
+                             RiakConflictError)
+
+    def test_other_errors(self):
+        self.failureResultOf(self.fail_with('broken'), RiakPBCException)
+
+
+class Test_HTTPConditions(unittest.TestCase):
+
+    def setUp(self):
+        self.client = riak.RiakClient()
+        self.transport = self.client.get_transport()
+        self.requests = []
+        self.responses = []
+
+        def http_request(method, path, headers={}, body=None, node=None,
+                         receiver=None):
+            self.requests.append((method, path, dict(headers), body))
+            return defer.succeed(self.responses.pop(0))
+        self.transport.http_request = http_request
+
+    def tearDown(self):
+        return self.transport.quit()
+
+    def test_precondition_failed(self):
+        self.responses.append(({'http_code': 412}, 'modified'))
+        obj = self.client.bucket('bucket').new('key', {'a': 1})
+        obj.get_metadata()[MD_VTAG] = 'tag'
+        self.failureResultOf(obj.store(if_not_modified=True), RiakConflictError)
+        self.assertEqual(self.requests[0][2]['If-Match'], 'tag')
+
+    def test_no_vtag(self):
+        obj = self.client.bucket('bucket').new('key', {'a': 1})
+        self.failureResultOf(obj.store(if_not_modified=True), RiakError)
+        self.assertEqual(self.requests, [])